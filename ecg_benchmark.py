@@ -0,0 +1,274 @@
+"""Измерване на основните стъпки върху синтетични записи - зареждане, baseline, филтриране,
+heart rate, рисуване (Agg, без прозорец) и CSV експорт. Резултатите са в JSON за сравнение между версии.
+
+Пример:
+    python ecg_benchmark.py --leads 3 12 --fs 500 1000 --minutes 10 60 --out bench.json
+    python ecg_benchmark.py --compare bench.json --out bench_new.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from ecg_core import BackendDispatcher, ECGExporter, ECGProcessor, ECGRecording, FileLayout, default_lead_names
+
+# Форма на един удар - (отместване от R (s), ширина (s), амплитуда (mV)) за P, Q, R, S, T
+BEAT_WAVES = [(-0.2, 0.025, 0.15), (-0.03, 0.01, -0.1), (0.0, 0.012, 1.2), (0.03, 0.01, -0.25), (0.25, 0.05, 0.3)]
+
+
+def synthesize(filename, num_leads=12, sampling_rate=1000, duration=600.0, header_size=0,
+               heart_rate=72.0, scale=200.0, seed=0, block_sec=60.0):
+    """Записва синтетичен int16 interleaved запис - удари с вариабилност на RR, различно
+    усилване по отвеждания, дишане (baseline wander) и шум. Пише на блокове - паметта не
+    зависи от дължината. Връща позициите на R върховете (семпли)"""
+    rng = np.random.default_rng(seed)
+    total = int(duration * sampling_rate)
+    rr = 60.0 / heart_rate * (1 + 0.05 * rng.standard_normal(int(duration * heart_rate / 60) + 10))
+    peaks = np.cumsum(rr)
+    peaks = peaks[peaks < duration - 1.0]
+
+    gains = np.linspace(0.5, 1.2, num_leads) * rng.choice([-1.0, 1.0], num_leads, p=[0.2, 0.8])
+    offsets = rng.uniform(-0.3, 0.3, num_leads)
+    block = max(1, int(block_sec * sampling_rate))
+    margin = 0.6
+
+    with open(filename, 'wb') as f:
+        f.write(b'\0' * header_size)
+        for start in range(0, total, block):
+            end = min(start + block, total)
+            t = np.arange(start, end) / sampling_rate
+            beat = np.zeros(end - start)
+            near = peaks[(peaks > t[0] - margin) & (peaks < t[-1] + margin)]
+            for peak in near:
+                for offset, width, amplitude in BEAT_WAVES:
+                    center = peak + offset
+                    i0 = max(0, int((center - 5 * width - t[0]) * sampling_rate))
+                    i1 = min(len(t), int((center + 5 * width - t[0]) * sampling_rate) + 1)
+                    if i1 > i0:
+                        beat[i0:i1] += amplitude * np.exp(-0.5 * ((t[i0:i1] - center) / width) ** 2)
+
+            data = beat[:, None] * gains[None, :] + offsets[None, :]
+            data += 0.2 * np.sin(2 * np.pi * 0.25 * t)[:, None]
+            data += 0.02 * rng.standard_normal(data.shape)
+            f.write(np.clip(np.round(data * scale), -32768, 32767).astype('<i2').tobytes())
+
+    return (peaks * sampling_rate).astype(np.int64)
+
+
+class StepTimer:
+    """Време (s) за всяко повторение на стъпка и пик на паметта (tracemalloc) от отделно
+    изпълнение - tracemalloc забавя алокациите и не се включва в измереното време"""
+
+    def __init__(self, repeat=3, track_memory=True):
+        self.repeat = max(1, repeat)
+        self.track_memory = track_memory
+        self.steps = {}
+
+    def measure(self, name, func, repeat=None):
+        seconds = []
+        result = None
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            result = func()
+            seconds.append(time.perf_counter() - start)
+
+        peak = None
+        if self.track_memory:
+            tracemalloc.start()
+            try:
+                func()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        self.steps[name] = {
+            'seconds': seconds,
+            'best': min(seconds),
+            'median': float(np.median(seconds)),
+            'peak_bytes': peak,
+        }
+        return result
+
+
+def make_renderer(figsize=(14, 8), dpi=100):
+    """ECGPlotRenderer върху Agg canvas - същото рисуване като във viewer-а, без прозорец"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from ecg_viewerGPU import ECGPlotRenderer
+
+    figure = Figure(figsize=figsize, dpi=dpi)
+    return ECGPlotRenderer(figure, FigureCanvasAgg(figure))
+
+
+def benchmark_recording(filename, layout, sampling_rate, timer, window_sec=10, export_sec=60,
+                        use_gpu=False, workdir=None):
+    """Стъпките на viewer-а върху един файл; резултатите се натрупват в timer.steps"""
+    recording = timer.measure('load', lambda: ECGRecording(filename, layout.num_leads, layout=layout))
+    processor = ECGProcessor(sampling_rate, use_gpu=use_gpu)
+    recording.baseline = timer.measure('baseline', lambda: processor.estimate_baseline(recording.raw))
+
+    window = int(window_sec * sampling_rate)
+    middle = max(0, len(recording) // 2 - window // 2)
+    raw_window = recording.window(middle, middle + window)
+    timer.measure('window', lambda: recording.window(middle, middle + window))
+    filtered = timer.measure('filter', lambda: processor.filter(raw_window))
+    timer.measure('heart_rate', lambda: processor.heart_rate(raw_window, False))
+
+    # Първото рисуване строи осите; следващите са навигация (само линиите - blitting)
+    lead_names = default_lead_names(layout.num_leads)
+    time_axis = np.arange(len(filtered)) / sampling_rate
+    ylims = [(-1.5, 1.5)] * layout.num_leads
+
+    def first_draw():
+        renderer = make_renderer()
+        renderer.ensure_layout(lead_names, window_sec)
+        renderer.render(time_axis, filtered, ylims, 'ECG')
+        return renderer
+
+    # Строенето на осите е бавно (секунди при 12 отвеждания) - измерва се веднъж
+    renderer = timer.measure('render_layout', first_draw, repeat=1)
+    timer.measure('render', lambda: renderer.render(time_axis, filtered, ylims, 'ECG'))
+
+    export_end = min(len(recording), int(export_sec * sampling_rate))
+    exporter = ECGExporter(recording, sampling_rate, lead_names)
+    csv_path = os.path.join(workdir or tempfile.gettempdir(), 'ecg_benchmark_export.csv')
+    try:
+        timer.measure('export_csv', lambda: exporter.export_csv(csv_path, 0, export_end))
+    finally:
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+    return timer.steps
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'backends': BackendDispatcher.shared().describe(),
+    }
+
+
+def run_matrix(leads, rates, minutes, header_size=0, repeat=3, window_sec=10, export_sec=60,
+               use_gpu=False, data_dir=None, track_memory=True, log=print):
+    """Всички комбинации отвеждания x честота x продължителност; синтетичните файлове
+    се създават веднъж в data_dir и се преизползват при следващо пускане"""
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), 'ecg_benchmark')
+    os.makedirs(data_dir, exist_ok=True)
+    BackendDispatcher.shared().use_gpu = use_gpu
+
+    results = []
+    for num_leads in leads:
+        for sampling_rate in rates:
+            for duration_min in minutes:
+                name = f"synth_{num_leads}l_{sampling_rate}hz_{duration_min:g}min_h{header_size}.BIN"
+                filename = os.path.join(data_dir, name)
+                if not os.path.exists(filename):
+                    log(f"Създаване на {name}...")
+                    synthesize(filename, num_leads, sampling_rate, duration_min * 60, header_size)
+
+                layout = FileLayout(header_size, num_leads, sampling_rate=sampling_rate)
+                timer = StepTimer(repeat, track_memory)
+                steps = benchmark_recording(filename, layout, sampling_rate, timer, window_sec, export_sec,
+                                            use_gpu, data_dir)
+                results.append({
+                    'leads': num_leads,
+                    'sampling_rate': sampling_rate,
+                    'minutes': duration_min,
+                    'header_size': header_size,
+                    'file_bytes': os.path.getsize(filename),
+                    'steps': steps,
+                })
+                log(format_case(results[-1]))
+    return results
+
+
+def format_case(case):
+    def format_step(name, step):
+        text = f"{name}={step['best'] * 1000:.1f}ms"
+        if step['peak_bytes'] is not None:
+            text += f"/{step['peak_bytes'] / 2**20:.1f}MB"
+        return text
+
+    steps = ' '.join(format_step(name, step) for name, step in case['steps'].items())
+    return f"{case['leads']} отв., {case['sampling_rate']} Hz, {case['minutes']:g} мин: {steps}"
+
+
+def compare(baseline, results, threshold=1.2):
+    """Редове за стъпките, станали по-бавни от threshold пъти спрямо предишен JSON"""
+    def case_key(case):
+        return case['leads'], case['sampling_rate'], case['minutes'], case['header_size']
+
+    previous = {case_key(case): case for case in baseline.get('results', [])}
+    lines = []
+    for case in results:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        for name, step in case['steps'].items():
+            old_step = old['steps'].get(name)
+            if old_step is None or old_step['best'] <= 0:
+                continue
+            ratio = step['best'] / old_step['best']
+            marker = ' <-- по-бавно' if ratio > threshold else ''
+            lines.append(f"{case['leads']} отв. {case['sampling_rate']} Hz {case['minutes']:g} мин "
+                         f"{name}: {old_step['best'] * 1000:.1f} -> {step['best'] * 1000:.1f} ms "
+                         f"(x{ratio:.2f}){marker}")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark на ECG обработката върху синтетични записи")
+    parser.add_argument('--leads', type=int, nargs='+', default=[3, 12], help="брой отвеждания")
+    parser.add_argument('--fs', type=int, nargs='+', default=[500, 1000], help="честоти на семплиране, Hz")
+    parser.add_argument('--minutes', type=float, nargs='+', default=[10, 60], help="продължителности, мин")
+    parser.add_argument('--header', type=int, default=0, help="размер на header-а в байтове")
+    parser.add_argument('--repeat', type=int, default=3, help="повторения на всяка стъпка (пази се най-доброто)")
+    parser.add_argument('--window', type=int, default=10, help="прозорец за филтриране/рисуване, s")
+    parser.add_argument('--export-seconds', type=float, default=60, help="продължителност на CSV експорта, s")
+    parser.add_argument('--data-dir', help="директория за синтетичните файлове (преизползват се)")
+    parser.add_argument('--gpu', action='store_true', help="GPU backends, ако са налични")
+    parser.add_argument('--no-memory', action='store_true', help="без измерване на паметта (по-бързо)")
+    parser.add_argument('--out', help="JSON файл за резултатите")
+    parser.add_argument('--compare', help="предишен JSON - отпечатва промяната по стъпки")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_matrix(args.leads, args.fs, args.minutes, args.header, args.repeat, args.window,
+                         args.export_seconds, args.gpu, args.data_dir, not args.no_memory)
+    report = {'environment': environment(), 'results': results}
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Резултатите са записани в {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare(json.load(f), results):
+                print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3159 @@
+"""Обработка на ECG записи без графичен интерфейс - общо ядро за ECGViewer и ecg_process"""
+import numpy as np
+from scipy import signal
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import hashlib
+import multiprocessing
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+# GPU Support - глобална променлива
+GPU_AVAILABLE = False
+cp = None
+
+try:
+    import cupy as cp
+    from cupyx.scipy import signal as cusignal
+
+    GPU_AVAILABLE = True
+    print("✓ GPU (CUDA) Support Enabled")
+except ImportError:
+    print("✗ GPU Support Not Available - Install cupy for CUDA acceleration")
+
+# HDF5 експорт - по избор
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# Грешки на числените ядра (NumPy/scipy, CUDA) - при тях обработката минава на резервен вариант.
+# JobCancelled и KeyboardInterrupt не са сред тях и прекъсват обработката
+NUMERIC_ERRORS = (ValueError, ArithmeticError, np.linalg.LinAlgError, MemoryError, RuntimeError)
+
+
+class PerfTracer:
+    """Времена на стъпките (spans) в кръгов буфер - за overlay и Chrome trace.
+    Изключен, span() връща общ празен context manager - почти без разход"""
+
+    CAPACITY = 4096
+
+    _shared = None
+
+    def __init__(self, capacity=CAPACITY, enabled=False):
+        self.enabled = enabled
+        self.events = deque(maxlen=capacity)
+        self.epoch = time.perf_counter()
+
+    @classmethod
+    def shared(cls):
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def span(self, name):
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def record(self, name, start, duration):
+        # deque.append е атомарен - spans идват и от фоновите нишки
+        self.events.append((name, start, duration, threading.get_ident()))
+
+    def clear(self):
+        self.events.clear()
+
+    def stats(self):
+        """{стъпка: {'count', 'last', 'mean', 'p95'}} в секунди, по реда на първата поява"""
+        durations = {}
+        for name, _, duration, _ in list(self.events):
+            durations.setdefault(name, []).append(duration)
+        return {name: {'count': len(values), 'last': values[-1], 'mean': float(np.mean(values)),
+                       'p95': float(np.percentile(values, 95))}
+                for name, values in durations.items()}
+
+    def describe(self):
+        lines = [f"{'стъпка':<18}{'посл.':>9}{'p95':>9}{'брой':>6}"]
+        for name, stat in self.stats().items():
+            lines.append(f"{name:<18}{stat['last'] * 1000:>7.1f}ms{stat['p95'] * 1000:>7.1f}ms{stat['count']:>6}")
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, filename):
+        """JSON във формата на Chrome trace (chrome://tracing, Perfetto) - завършени събития в μs"""
+        pid = os.getpid()
+        events = [{'name': name, 'cat': 'ecg', 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': (start - self.epoch) * 1e6, 'dur': duration * 1e6}
+                  for name, start, duration, tid in list(self.events)]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class BlockBaseline:
+    """Baseline по блокове - медиана за всеки блок и линейна интерполация между тях"""
+
+    # Продължителност на блок (сек) и брой кадри, обработвани наведнъж
+    BLOCK_SEC = 2.0
+    CHUNK_FRAMES = 1 << 20
+    # Максимален брой точки в блок, върху които се смята медианата
+    MAX_BLOCK_POINTS = 256
+
+    def __init__(self, positions, values):
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float32)
+
+    @classmethod
+    def constant(cls, values):
+        values = np.asarray(values, dtype=np.float32)
+        return cls([0.0], values[np.newaxis, :])
+
+    @classmethod
+    def estimate(cls, raw, block_size, median=None, progress=None):
+        """Поточна оценка върху (samples, leads) масив или memmap - паметта е ограничена от CHUNK_FRAMES"""
+        if median is None:
+            median = lambda blocks: np.median(blocks, axis=1)
+
+        block_size = max(1, int(block_size))
+        step = max(1, block_size // cls.MAX_BLOCK_POINTS)
+        chunk_frames = max(1, cls.CHUNK_FRAMES // block_size) * block_size
+        total = len(raw)
+
+        positions = []
+        values = []
+        for chunk_start in range(0, total, chunk_frames):
+            chunk_end = min(chunk_start + chunk_frames, total)
+            chunk = np.asarray(raw[chunk_start:chunk_end])
+
+            # Децимацията е вътре във всеки блок - точките не се изместват спрямо границите му
+            full_blocks = len(chunk) // block_size
+            if full_blocks:
+                blocks = chunk[:full_blocks * block_size].reshape(full_blocks, block_size, -1)[:, ::step]
+                values.append(np.asarray(median(blocks), dtype=np.float32))
+                positions.append(chunk_start + block_size * (np.arange(full_blocks) + 0.5))
+
+            # Непълен последен блок
+            rest = chunk[full_blocks * block_size::step]
+            if len(rest):
+                values.append(np.asarray(median(rest[np.newaxis]), dtype=np.float32))
+                rest_start = chunk_start + full_blocks * block_size
+                positions.append(np.array([(rest_start + chunk_end) / 2.0]))
+
+            if progress is not None:
+                progress(chunk_end / total)
+
+        if not values:
+            return cls.constant(np.zeros(raw.shape[1], dtype=np.float32))
+
+        return cls(np.concatenate(positions), np.concatenate(values))
+
+    def extended(self, raw, block_size, median=None):
+        """Baseline за дописан в края raw - преизчисляват се само последният блок и новите.
+        Блоковете са подравнени към кратни на block_size, както в estimate()"""
+        block_size = max(1, int(block_size))
+        if len(self.positions) == 1:
+            return self.estimate(raw, block_size, median)
+
+        first_block = int(self.positions[-1] // block_size) * block_size
+        keep = self.positions < first_block
+        tail = self.estimate(raw[first_block:], block_size, median)
+        return BlockBaseline(np.concatenate([self.positions[keep], tail.positions + first_block]),
+                             np.concatenate([self.values[keep], tail.values]))
+
+    @property
+    def nbytes(self):
+        return self.positions.nbytes + self.values.nbytes
+
+    def evaluate(self, start, end):
+        """Baseline за семплите [start, end) - (end-start, leads) float32"""
+        if len(self.positions) == 1:
+            return np.broadcast_to(self.values[0], (max(0, end - start), self.values.shape[1]))
+        return self.evaluate_at(np.arange(start, end, dtype=np.float64))
+
+    def evaluate_at(self, t):
+        """Baseline в произволни позиции (номера на семпли)"""
+        if len(self.positions) == 1:
+            return np.broadcast_to(self.values[0], (len(t), self.values.shape[1]))
+
+        t = np.asarray(t, dtype=np.float64)
+        idx = np.searchsorted(self.positions, t, side='right') - 1
+        idx = np.clip(idx, 0, len(self.positions) - 2)
+        left = self.positions[idx]
+        weight = np.clip((t - left) / (self.positions[idx + 1] - left), 0.0, 1.0)
+        weight = weight.astype(np.float32)[:, np.newaxis]
+        return self.values[idx] * (1.0 - weight) + self.values[idx + 1] * weight
+
+
+class ComputeBackend:
+    """Общ интерфейс на изчислителните ядра - decode, baseline медиани, филтриране, пикове, децимация.
+    Всички методи приемат и връщат NumPy масиви. GPU backend се използва само след като
+    резултатът му съвпадне с NumPy в рамките на TOLERANCE"""
+
+    name = 'base'
+    # Максимална грешка спрямо NumPy, отнесена към стандартното отклонение на сигнала
+    TOLERANCE = 1e-4
+    _instances = {}
+
+    @classmethod
+    def get(cls, use_gpu=False):
+        """NumPy backend или проверен CuPy backend (веднъж на процес); при проблем - NumPy"""
+        if use_gpu and GPU_AVAILABLE and cp is not None:
+            if 'cupy' not in cls._instances:
+                try:
+                    backend = CupyBackend()
+                    error = backend.check()
+                    if error > cls.TOLERANCE:
+                        raise ValueError(f"error {error:.2e} above tolerance {cls.TOLERANCE:.0e}")
+                    cls._instances['cupy'] = backend
+                except Exception as e:
+                    print(f"GPU backend disabled: {e}")
+                    cls._instances['cupy'] = None
+            if cls._instances['cupy'] is not None:
+                return cls._instances['cupy']
+
+        if 'numpy' not in cls._instances:
+            cls._instances['numpy'] = NumpyBackend()
+        return cls._instances['numpy']
+
+    @classmethod
+    def get_threaded(cls, workers=None):
+        """Многонишков NumPy backend с дадения брой нишки (по подразбиране - всички ядра)"""
+        workers = workers or os.cpu_count() or 1
+        key = ('threads', workers)
+        if key not in cls._instances:
+            cls._instances[key] = ThreadedNumpyBackend(workers)
+        return cls._instances[key]
+
+    def decode(self, raw, offset, factor):
+        """(raw - offset) * factor като float32 - int стойности към mV"""
+        raise NotImplementedError
+
+    def median(self, blocks, axis):
+        raise NotImplementedError
+
+    def sosfiltfilt(self, sos, data):
+        """Zero-phase филтриране по ос 0 - (samples, leads) float32"""
+        raise NotImplementedError
+
+    def find_peaks(self, x, height, distance):
+        """Позиции на локалните максимуми над height, разделени поне с distance семпли"""
+        raise NotImplementedError
+
+    def minmax(self, data, factor):
+        """Min и max на всеки `factor` съседни реда (последният bin може да е непълен)"""
+        raise NotImplementedError
+
+    @staticmethod
+    def test_signal(samples=8192, leads=12, seed=0):
+        """Детерминиран сигнал за сравнение - дрейф, 50 Hz и шум, 1 kHz"""
+        rng = np.random.default_rng(seed)
+        t = np.arange(samples)[:, np.newaxis] / 1000.0
+        drift = np.cumsum(rng.standard_normal((samples, leads)), axis=0) * 0.01
+        data = drift + 0.2 * np.sin(2 * np.pi * 50 * t) + 0.05 * rng.standard_normal((samples, leads))
+        return data.astype(np.float32)
+
+    def check(self, reference=None):
+        """Максимална относителна разлика спрямо референтния (NumPy) backend по всички ядра"""
+        reference = reference or NumpyBackend()
+        data = self.test_signal()
+        sos = FilterBank.get(1000).sos
+
+        expected = reference.sosfiltfilt(sos, data)
+        scale = float(np.std(expected)) or 1.0
+        errors = [np.max(np.abs(self.sosfiltfilt(sos, data) - expected)) / scale]
+
+        blocks = data[:8000].reshape(-1, 250, data.shape[1])
+        errors.append(np.max(np.abs(self.median(blocks, axis=1) - reference.median(blocks, axis=1))) / scale)
+
+        raw = (data * 200).astype(np.int16)
+        offset = raw.mean(axis=0)
+        errors.append(np.max(np.abs(self.decode(raw, offset, 0.005) - reference.decode(raw, offset, 0.005))))
+
+        mins, maxs = self.minmax(data, 64)
+        ref_mins, ref_maxs = reference.minmax(data, 64)
+        errors.append(max(np.max(np.abs(mins - ref_mins)), np.max(np.abs(maxs - ref_maxs))) / scale)
+
+        envelope = expected[:, 0] ** 2
+        peaks = self.find_peaks(envelope, float(np.percentile(envelope, 90)), 50)
+        if not np.array_equal(peaks, reference.find_peaks(envelope, float(np.percentile(envelope, 90)), 50)):
+            errors.append(np.inf)
+        return float(max(errors))
+
+
+class NumpyBackend(ComputeBackend):
+    """CPU изпълнение с NumPy и scipy.signal - референция за останалите backends"""
+
+    name = 'numpy'
+
+    def decode(self, raw, offset, factor):
+        data = raw.astype(np.float32)
+        data -= offset
+        data *= np.float32(factor)
+        return data
+
+    def median(self, blocks, axis):
+        return np.median(blocks, axis=axis)
+
+    def sosfiltfilt(self, sos, data):
+        return signal.sosfiltfilt(sos, data, axis=0).astype(np.float32, copy=False)
+
+    def find_peaks(self, x, height, distance):
+        return signal.find_peaks(x, height=height, distance=distance)[0]
+
+    def minmax(self, data, factor):
+        full = len(data) // factor
+        leads = data.shape[1]
+        out_min = [data[:full * factor].reshape(full, factor, leads).min(axis=1)]
+        out_max = [data[:full * factor].reshape(full, factor, leads).max(axis=1)]
+        if len(data) > full * factor:
+            out_min.append(data[full * factor:].min(axis=0, keepdims=True))
+            out_max.append(data[full * factor:].max(axis=0, keepdims=True))
+        return np.concatenate(out_min), np.concatenate(out_max)
+
+
+class ThreadedNumpyBackend(NumpyBackend):
+    """NumPy ядрата, разделени по отвеждания (или по време за decode) между нишки.
+    scipy и NumPy освобождават GIL в тези операции - резултатът е идентичен със серийния"""
+
+    name = 'threads'
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ecg-compute')
+
+    def _split(self, count):
+        """Граници на до `workers` приблизително равни части от count елемента"""
+        bounds = np.linspace(0, count, min(self.workers, max(1, count)) + 1).astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _by_leads(self, fn, data):
+        parts = self._split(data.shape[-1])
+        if len(parts) == 1:
+            return fn(data)
+        results = list(self._executor.map(lambda part: fn(data[..., part[0]:part[1]]), parts))
+        if isinstance(results[0], tuple):
+            return tuple(np.concatenate(items, axis=-1) for items in zip(*results))
+        return np.concatenate(results, axis=-1)
+
+    def decode(self, raw, offset, factor):
+        out = np.empty(raw.shape, dtype=np.float32)
+        offset = np.broadcast_to(offset, raw.shape)
+
+        def run(part):
+            out[part[0]:part[1]] = NumpyBackend.decode(self, raw[part[0]:part[1]], offset[part[0]:part[1]], factor)
+
+        list(self._executor.map(run, self._split(len(raw))))
+        return out
+
+    def median(self, blocks, axis):
+        return self._by_leads(lambda part: NumpyBackend.median(self, part, axis), blocks)
+
+    def sosfiltfilt(self, sos, data):
+        return self._by_leads(lambda part: NumpyBackend.sosfiltfilt(self, sos, part), data)
+
+    def minmax(self, data, factor):
+        return self._by_leads(lambda part: NumpyBackend.minmax(self, part, factor), data)
+
+
+class CupyBackend(ComputeBackend):
+    """GPU изпълнение с CuPy и cupyx.scipy.signal - всички отвеждания в едно извикване.
+    Данните остават на GPU между копирането нагоре и обратно; филтрира се във float64 като scipy"""
+
+    name = 'cupy'
+
+    def __init__(self):
+        if cp is None:
+            raise RuntimeError("CuPy не е наличен")
+        self._sos = {}
+
+    def _device_sos(self, sos):
+        key = sos.tobytes()
+        if key not in self._sos:
+            self._sos[key] = cp.asarray(sos, dtype=cp.float64)
+        return self._sos[key]
+
+    def decode(self, raw, offset, factor):
+        data = cp.asarray(raw).astype(cp.float32)
+        data -= cp.asarray(offset, dtype=cp.float32)
+        data *= cp.float32(factor)
+        return cp.asnumpy(data)
+
+    def median(self, blocks, axis):
+        # Прехвърляме само текущия блок към GPU
+        return cp.asnumpy(cp.median(cp.asarray(blocks, dtype=cp.float32), axis=axis))
+
+    def sosfiltfilt_device(self, sos, data):
+        """Филтриране на масив, който вече е на GPU - резултатът също остава там"""
+        return cusignal.sosfiltfilt(self._device_sos(sos), data, axis=0)
+
+    def sosfiltfilt(self, sos, data):
+        filtered = self.sosfiltfilt_device(sos, cp.asarray(data, dtype=cp.float64))
+        return cp.asnumpy(filtered.astype(cp.float32))
+
+    def find_peaks(self, x, height, distance):
+        return cp.asnumpy(cusignal.find_peaks(cp.asarray(x), height=height, distance=distance)[0])
+
+    def minmax(self, data, factor):
+        device = cp.asarray(data)
+        full = len(device) // factor
+        leads = device.shape[1]
+        out_min = [device[:full * factor].reshape(full, factor, leads).min(axis=1)]
+        out_max = [device[:full * factor].reshape(full, factor, leads).max(axis=1)]
+        if len(device) > full * factor:
+            out_min.append(device[full * factor:].min(axis=0, keepdims=True))
+            out_max.append(device[full * factor:].max(axis=0, keepdims=True))
+        return cp.asnumpy(cp.concatenate(out_min)), cp.asnumpy(cp.concatenate(out_max))
+
+
+class BackendDispatcher:
+    """Избира backend за всяко извикване според ядрото и размера на данните.
+    Калибрирането измерва всеки наличен backend при няколко размера и пази класирането в JSON -
+    така праговете CPU/GPU идват от измерване на конкретната машина"""
+
+    KERNELS = ('decode', 'baseline', 'filter', 'peaks', 'decimate')
+    # Размери (кадри) при калибриране и брой отвеждания на тестовия сигнал
+    SIZES = (1 << 10, 1 << 13, 1 << 16, 1 << 19)
+    LEADS = 12
+    REPEATS = 3
+    # Друг backend измества NumPy само ако е поне толкова пъти по-бърз (шум в измерването)
+    MARGIN = 1.1
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.ecg_viewer_backends.json')
+    # Без калибриране - GPU само за филтриране на повече от 10000 семпли
+    DEFAULT_RANKING = {'filter': [[0, ['numpy']], [10000, ['cupy', 'numpy']]]}
+
+    _shared = None
+
+    def __init__(self, path=None, use_gpu=False, workers=None):
+        self.path = path or self.DEFAULT_PATH
+        self.use_gpu = use_gpu
+        self.workers = workers
+        self.ranking = self.load()
+
+    @classmethod
+    def shared(cls):
+        """Общият за процеса dispatcher - използва се, когато не е подаден друг"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def backends(self, use_gpu=None):
+        """Наличните backends по име - CuPy само ако е активиран и е минал проверката"""
+        available = {'numpy': ComputeBackend.get(), 'threads': ComputeBackend.get_threaded(self.workers)}
+        if self.use_gpu if use_gpu is None else use_gpu:
+            gpu = ComputeBackend.get(use_gpu=True)
+            if gpu.name == 'cupy':
+                available['cupy'] = gpu
+        return available
+
+    def select(self, kernel, size, use_gpu=None):
+        """Най-бързият наличен backend за ядрото при дадения брой кадри"""
+        available = self.backends(use_gpu)
+        order = ['numpy']
+        for min_size, names in self.ranking.get(kernel, []):
+            if size >= min_size:
+                order = names
+        for name in order:
+            if name in available:
+                return available[name]
+        return available['numpy']
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)['ranking']
+        except (OSError, ValueError, KeyError):
+            return dict(self.DEFAULT_RANKING)
+
+    def save(self):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=directory, suffix='.partial')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'ranking': self.ranking, 'backends': sorted(self.backends()),
+                       'calibrated': time.time()}, f, indent=2)
+        os.replace(partial, self.path)
+
+    def needs_calibration(self):
+        """Няма измерване или има backend, който не е бил измерен"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                calibrated = set(json.load(f).get('backends', []))
+        except (OSError, ValueError):
+            return True
+        return not set(self.backends()) <= calibrated
+
+    def _benchmark(self, backend, kernel, data, raw):
+        if kernel == 'decode':
+            return lambda: backend.decode(raw, np.zeros(data.shape[1], dtype=np.float32), 0.005)
+        if kernel == 'baseline':
+            points = min(256, len(data))
+            blocks = data[:len(data) // points * points].reshape(-1, points, data.shape[1])
+            return lambda: backend.median(blocks, axis=1)
+        if kernel == 'filter':
+            sos = FilterBank.get(1000).sos
+            return lambda: backend.sosfiltfilt(sos, data)
+        if kernel == 'peaks':
+            envelope = data[:, 0] ** 2
+            height = float(np.percentile(envelope, 90))
+            return lambda: backend.find_peaks(envelope, height, 250)
+        return lambda: backend.minmax(data, 64)
+
+    def calibrate(self, progress=None):
+        """Измерва всяко ядро за всички налични backends; класирането за размер важи от
+        геометричната среда с предходния измерен размер нагоре"""
+        available = self.backends()
+        ranking = {}
+        steps = len(self.KERNELS) * len(self.SIZES)
+        for size_index, size in enumerate(self.SIZES):
+            data = ComputeBackend.test_signal(size, self.LEADS)
+            raw = (data * 200).astype(np.int16)
+            for kernel_index, kernel in enumerate(self.KERNELS):
+                timings = {}
+                for name, backend in available.items():
+                    run = self._benchmark(backend, kernel, data, raw)
+                    run()  # загряване (JIT, кеширане на филтъра на GPU)
+                    best = np.inf
+                    for _ in range(self.REPEATS):
+                        start = time.perf_counter()
+                        run()
+                        best = min(best, time.perf_counter() - start)
+                    timings[name] = best
+
+                order = sorted(timings, key=lambda name: timings[name] * (1 if name == 'numpy' else self.MARGIN))
+                entries = ranking.setdefault(kernel, [])
+                if not entries or entries[-1][1] != order:
+                    min_size = 0 if size_index == 0 else int(np.sqrt(size * self.SIZES[size_index - 1]))
+                    entries.append([min_size, order])
+                if progress is not None:
+                    progress((size_index * len(self.KERNELS) + kernel_index + 1) / steps)
+
+        self.ranking = ranking
+        self.save()
+        return ranking
+
+    def describe(self):
+        """Кратко описание на избора по ядра - за статус/диалог"""
+        lines = []
+        for kernel in self.KERNELS:
+            entries = self.ranking.get(kernel, [[0, ['numpy']]])
+            lines.append(f"{kernel}: " + ", ".join(f"≥{min_size}: {names[0]}" for min_size, names in entries))
+        return "\n".join(lines)
+
+
+class FilterBank:
+    """Bandpass + notch филтри като second-order sections, проектирани веднъж за всеки набор параметри"""
+
+    _cache = {}
+
+    def __init__(self, sampling_rate, band=(0.5, 40.0), notch_freq=50.0, notch_q=30.0, order=4):
+        self.key = (sampling_rate, tuple(band), notch_freq, notch_q, order)
+        nyquist = sampling_rate / 2
+
+        sections = [signal.butter(order, [band[0] / nyquist, band[1] / nyquist],
+                                  btype='band', output='sos')]
+        if notch_freq and notch_freq < nyquist:
+            b_notch, a_notch = signal.iirnotch(notch_freq / nyquist, notch_q)
+            sections.append(signal.tf2sos(b_notch, a_notch))
+
+        self.sos = np.vstack(sections)
+
+    @classmethod
+    def get(cls, sampling_rate, band=(0.5, 40.0), notch_freq=50.0, notch_q=30.0, order=4):
+        """Връща кеширан филтър за дадените параметри"""
+        key = (sampling_rate, tuple(band), notch_freq, notch_q, order)
+        bank = cls._cache.get(key)
+        if bank is None:
+            bank = cls(sampling_rate, band, notch_freq, notch_q, order)
+            cls._cache[key] = bank
+        return bank
+
+    def apply(self, data, backend=None):
+        """Zero-phase филтриране на всички отвеждания с едно извикване"""
+        return (backend or ComputeBackend.get()).sosfiltfilt(self.sos, data)
+
+
+class ChunkedFilter:
+    """Филтриране на дълъг диапазон на части с припокриване (overlap-and-discard), паралелно в нишки.
+    Всяка част се филтрира с `pad` семпли от съседите и краищата се изхвърлят, така резултатът
+    е един и същ при всякакъв брой нишки"""
+
+    def __init__(self, bank, chunk_size, pad, workers=1, backend=None):
+        self.bank = bank
+        self.chunk_size = max(1, chunk_size)
+        self.pad = pad
+        self.workers = max(1, workers)
+        self.backend = backend
+
+    def chunks(self, total):
+        return [(start, min(start + self.chunk_size, total)) for start in range(0, total, self.chunk_size)]
+
+    def _filter_chunk(self, read, write, total, start, end, backend):
+        padded_start = max(0, start - self.pad)
+        padded_end = min(total, end + self.pad)
+        filtered = self.bank.apply(read(padded_start, padded_end), backend)
+        write(start, end, filtered[start - padded_start:end - padded_start])
+        return end
+
+    def run(self, read, write, total, progress=None, cancelled=None):
+        """read(start, end) -> (samples, leads); write(start, end, data) - извиква се от нишките
+        за непресичащи се диапазони. Връща False, ако е прекъснато чрез cancelled()"""
+        chunks = self.chunks(total)
+        backend = self.backend
+        if self.workers == 1 or len(chunks) < self.workers or getattr(backend, 'name', None) == 'cupy':
+            # Малко части (или GPU) - последователно, а нишките делят отвежданията
+            if backend is None and self.workers > 1:
+                backend = ComputeBackend.get_threaded(self.workers)
+            for start, end in chunks:
+                if cancelled is not None and cancelled():
+                    return False
+                self._filter_chunk(read, write, total, start, end, backend)
+                if progress is not None:
+                    progress(end / total)
+            return True
+
+        # Всяка нишка - цяла част с NumPy (без вложени нишки); най-много 2 части на нишка в движение
+        backend = ComputeBackend.get()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ecg-filter') as executor:
+            pending = []
+            for start, end in chunks:
+                if cancelled is not None and cancelled():
+                    break
+                pending.append(executor.submit(self._filter_chunk, read, write, total, start, end, backend))
+                if len(pending) >= 2 * self.workers:
+                    done_end = pending.pop(0).result()
+                    if progress is not None:
+                        progress(done_end / total)
+            for future in pending:
+                done_end = future.result()
+                if progress is not None:
+                    progress(done_end / total)
+        return not (cancelled is not None and cancelled())
+
+
+class StreamingFilter:
+    """Каузално sosfilt филтриране на поток - състоянието (zi) се пренася между блоковете,
+    така всеки блок струва колкото дължината си"""
+
+    def __init__(self, bank):
+        self.sos = bank.sos
+        self.zi = None
+
+    def process(self, data):
+        if len(data) == 0:
+            return np.zeros(data.shape, dtype=np.float32)
+        if self.zi is None:
+            # Стационарно начало от първия кадър - без преходен процес
+            self.zi = signal.sosfilt_zi(self.sos)[:, :, np.newaxis] * np.asarray(data[0])[np.newaxis, np.newaxis, :]
+        filtered, self.zi = signal.sosfilt(self.sos, data, axis=0, zi=self.zi)
+        return filtered.astype(np.float32)
+
+
+class FilteredCache:
+    """Филтриран сигнал за целия зареден диапазон, изчислен на части с припокриване"""
+
+    CHUNK_SEC = 60.0
+    # Припокриване от всяка страна - покрива преходния процес на filtfilt
+    PAD_SEC = 5.0
+
+    def __init__(self, recording, bank, sampling_rate, sidecar=None, sidecar_key=None, backend=None,
+                 workers=1):
+        self.key = bank.key
+        self.bank = bank
+        self.backend = backend
+        self.workers = workers
+        self.recording = recording
+        self.chunk_size = max(1, int(self.CHUNK_SEC * sampling_rate))
+        self.pad = self.pad_samples(sampling_rate)
+        self.progress = 0.0
+        self.ready = False
+        self.error = None
+        self._cancelled = threading.Event()
+        self.sidecar = sidecar
+        self.sidecar_key = sidecar_key
+
+        # Резултатът се пази в .npy файл, а не в RAM - в дисковия кеш или временно
+        if sidecar is not None:
+            os.makedirs(os.path.dirname(sidecar.array_path(sidecar_key, 'filtered')), exist_ok=True)
+            self.path = sidecar.array_path(sidecar_key, 'filtered') + '.partial'
+        else:
+            fd, self.path = tempfile.mkstemp(prefix='ecg_filtered_', suffix='.npy')
+            os.close(fd)
+        self.data = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float32,
+                                              shape=recording.shape)
+
+    @classmethod
+    def from_sidecar(cls, recording, bank, sidecar, sidecar_key):
+        """Зарежда готов филтриран сигнал от дисковия кеш или връща None"""
+        data = sidecar.load(sidecar_key, 'filtered')
+        if data is None or data.shape != recording.shape:
+            return None
+
+        cache = cls.__new__(cls)
+        cache.key = bank.key
+        cache.bank = bank
+        cache.recording = recording
+        cache.progress = 1.0
+        cache.ready = True
+        cache.error = None
+        cache._cancelled = threading.Event()
+        cache.sidecar = sidecar
+        cache.sidecar_key = sidecar_key
+        cache.path = None
+        cache.data = data
+        return cache
+
+    @classmethod
+    def pad_samples(cls, sampling_rate):
+        return int(cls.PAD_SEC * sampling_rate)
+
+    def build(self, progress=None):
+        """Филтрира записа на части - изпълнява се във фонова задача"""
+        try:
+            def write(start, end, filtered):
+                self.data[start:end] = filtered
+
+            def report(fraction):
+                self.progress = fraction
+                if progress is not None:
+                    progress(fraction)
+
+            runner = ChunkedFilter(self.bank, self.chunk_size, self.pad, self.workers, self.backend)
+            if not runner.run(lambda start, end: self.recording.window(start, end, gain=1.0), write,
+                              len(self.recording), report, self._cancelled.is_set):
+                return
+
+            self.data.flush()
+            if self._cancelled.is_set():
+                return
+
+            if self.sidecar is not None:
+                final_path = self.sidecar.array_path(self.sidecar_key, 'filtered')
+                self.data = None
+                self.sidecar.commit(self.sidecar_key, 'filtered', self.path)
+                self.path = None
+                self.data = np.load(final_path, mmap_mode='r')
+            self.ready = True
+        except JobCancelled:
+            raise
+        except Exception as e:
+            self.error = e
+            raise
+
+    def matches(self, bank):
+        return self.key == bank.key
+
+    def covers(self, start, end):
+        """Дали диапазонът е в кеша (записът може да е дописан след филтрирането)"""
+        return self.data is not None and end <= len(self.data)
+
+    def segment(self, start, end, gain=1.0):
+        return self.data[start:end] * np.float32(gain)
+
+    @property
+    def nbytes(self):
+        """Данните са memmap към .npy файла - в паметта на процеса се броят само копия в RAM"""
+        return resident_nbytes(self.data) if self.data is not None else 0
+
+    def close(self):
+        self._cancelled.set()
+        self.ready = False
+        self.data = None
+        # Завършеният файл в дисковия кеш остава; изтрива се само недовършеният
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class SidecarCache:
+    """Дисков кеш на обработени данни (.npy файлове) с LRU изчистване по общ размер"""
+
+    DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.ecg_viewer_cache')
+    DEFAULT_BUDGET = 10 * 1024 ** 3  # bytes
+    # Колко байта от началото и края на файла участват в подписа
+    PROBE_BYTES = 1 << 20
+
+    def __init__(self, root=None, budget_bytes=None):
+        self.root = root or self.DEFAULT_DIR
+        self.budget_bytes = self.DEFAULT_BUDGET if budget_bytes is None else budget_bytes
+
+    @classmethod
+    def file_signature(cls, filename):
+        """Подпис от размер, mtime и хеш на началото и края на файла"""
+        st = os.stat(filename)
+        digest = hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode())
+        with open(filename, 'rb') as f:
+            digest.update(f.read(cls.PROBE_BYTES))
+            if st.st_size > cls.PROBE_BYTES:
+                f.seek(max(cls.PROBE_BYTES, st.st_size - cls.PROBE_BYTES))
+                digest.update(f.read(cls.PROBE_BYTES))
+        return digest.hexdigest()
+
+    def make_key(self, filename, **params):
+        digest = hashlib.sha1(self.file_signature(filename).encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()[:32]
+
+    @staticmethod
+    def derive_key(base_key, params):
+        """Ключ за данни, зависещи и от допълнителни параметри (напр. филтъра)"""
+        return hashlib.sha1(f"{base_key}:{params}".encode()).hexdigest()[:32]
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def array_path(self, key, name):
+        return os.path.join(self._entry_dir(key), f"{name}.npy")
+
+    def touch(self, key):
+        """Отбелязва достъп до записа (за LRU)"""
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            os.utime(entry, None)
+
+    def load(self, key, name, mmap=True):
+        path = self.array_path(key, name)
+        if not os.path.exists(path):
+            return None
+        try:
+            array = np.load(path, mmap_mode='r' if mmap else None)
+        except (OSError, ValueError):
+            return None
+        self.touch(key)
+        return array
+
+    def store(self, key, name, array):
+        """Атомарен запис на масив в кеша"""
+        os.makedirs(self._entry_dir(key), exist_ok=True)
+        path = self.array_path(key, name)
+        partial = path + '.partial'
+        with open(partial, 'wb') as f:
+            np.save(f, np.asarray(array))
+        os.replace(partial, path)
+        self.touch(key)
+        self.evict(keep=key)
+
+    def commit(self, key, name, partial_path):
+        """Приема вече записан файл (напр. memmap) като елемент на кеша"""
+        os.replace(partial_path, self.array_path(key, name))
+        self.touch(key)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Изтрива най-отдавна използваните записи, докато общият размер е под бюджета"""
+        if not os.path.isdir(self.root):
+            return
+
+        entries = []
+        total = 0
+        for key in os.listdir(self.root):
+            entry = self._entry_dir(key)
+            if not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, key))
+            total += size
+
+        for _, size, key in sorted(entries):
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+
+
+def write_rows(buffer, current, first, rows):
+    """Записва rows от ред first нататък в буфер, който расте с удвояване - връща (буфер, запълнената
+    част). current е досегашното съдържание; копира се само при разширяване на буфера"""
+    needed = first + len(rows)
+    if buffer is None or len(buffer) < needed:
+        grown = np.empty((max(needed, 2 * len(current), 16),) + rows.shape[1:], dtype=rows.dtype)
+        grown[:first] = current[:first]
+        buffer = grown
+    buffer[first:needed] = rows
+    return buffer, buffer[:needed]
+
+
+def resident_nbytes(array):
+    """Байтове на масива в паметта на процеса - изгледите към файл (memmap) не се броят,
+    страниците им се освобождават от ОС при нужда"""
+    base = array
+    while base is not None:
+        if isinstance(base, (np.memmap, mmap.mmap)):
+            return 0
+        base = getattr(base, 'base', None)
+    return array.nbytes
+
+
+class MinMaxPyramid:
+    """Многостепенна min/max децимация по отвеждания за преглед на дълги прозорци"""
+
+    BASE_FACTOR = 64
+    LEVEL_FACTOR = 4
+    CHUNK_FRAMES = 1 << 20
+
+    def __init__(self, mins=None, maxs=None, base_factor=BASE_FACTOR, level_factor=LEVEL_FACTOR):
+        # mins[i] / maxs[i] - (bins, leads) за ниво i; размер на bin = base * factor**i
+        self.mins = mins or []
+        self.maxs = maxs or []
+        self.base_factor = base_factor
+        self.level_factor = level_factor
+        self.ready = bool(self.mins)
+        self.progress = 0.0
+        self._cancelled = threading.Event()
+        # Брой обхванати кадри - нужен за extend(); None за пирамида от дисковия кеш без него
+        self.length = None
+        self._buffers = {}
+
+    def bin_size(self, level):
+        return self.base_factor * self.level_factor ** level
+
+    @property
+    def nbytes(self):
+        """Байтове на нивата - при дописване се броят буферите с резерва, не само изгледите"""
+        total = 0
+        for level, (mins, maxs) in enumerate(zip(self.mins, self.maxs)):
+            buffers = self._buffers.get(level, (None, None))
+            total += sum(resident_nbytes(buffer if buffer is not None else array)
+                         for buffer, array in zip(buffers, (mins, maxs)))
+        return total
+
+    @staticmethod
+    def _reduce(mins, maxs, factor):
+        """Обединява по `factor` съседни bin-а (последният може да е непълен)"""
+        full = len(mins) // factor
+        leads = mins.shape[1]
+        out_min = [mins[:full * factor].reshape(full, factor, leads).min(axis=1)]
+        out_max = [maxs[:full * factor].reshape(full, factor, leads).max(axis=1)]
+        if len(mins) > full * factor:
+            out_min.append(mins[full * factor:].min(axis=0, keepdims=True))
+            out_max.append(maxs[full * factor:].max(axis=0, keepdims=True))
+        return np.concatenate(out_min), np.concatenate(out_max)
+
+    def build(self, recording, progress=None):
+        """Строи пирамидата на части - ниво 0 директно от записа, останалите от предходното ниво"""
+        total = len(recording)
+        chunk_frames = max(1, self.CHUNK_FRAMES // self.base_factor) * self.base_factor
+
+        level_min = []
+        level_max = []
+        for start in range(0, total, chunk_frames):
+            if self._cancelled.is_set():
+                return
+            end = min(start + chunk_frames, total)
+            data = recording.window(start, end, gain=1.0)
+            mins, maxs = BackendDispatcher.shared().select('decimate', len(data)).minmax(data, self.base_factor)
+            level_min.append(mins)
+            level_max.append(maxs)
+            self.progress = end / total
+            if progress is not None:
+                progress(self.progress)
+
+        if not level_min:
+            return
+
+        mins = [np.concatenate(level_min)]
+        maxs = [np.concatenate(level_max)]
+        while len(mins[-1]) > 1:
+            level = self._reduce(mins[-1], maxs[-1], self.level_factor)
+            mins.append(level[0])
+            maxs.append(level[1])
+
+        self.mins, self.maxs = mins, maxs
+        self.length = total
+        self.ready = True
+
+    def extend(self, recording, changed_from=None):
+        """Добавя bin-ове за дописаните кадри - преизчисляват се само последните bin-ове на всяко ниво.
+        changed_from - по-ранна позиция, от която данните са се променили (напр. обновен baseline)"""
+        total = len(recording)
+        if not self.ready or self.length is None or total <= self.length:
+            return
+
+        first = min(self.length, total if changed_from is None else changed_from) // self.base_factor
+        data = recording.window(first * self.base_factor, total, gain=1.0)
+        mins, maxs = BackendDispatcher.shared().select('decimate', len(data)).minmax(data, self.base_factor)
+        self._write_level(0, first, mins, maxs)
+
+        level = 0
+        while len(self.mins[level]) > 1:
+            first //= self.level_factor
+            lower = first * self.level_factor
+            mins, maxs = self._reduce(self.mins[level][lower:], self.maxs[level][lower:], self.level_factor)
+            self._write_level(level + 1, first, mins, maxs)
+            level += 1
+        self.length = total
+
+    def _write_level(self, level, first, mins, maxs):
+        """Записва bin-ове от индекс first нататък в растящите буфери на нивото"""
+        if level == len(self.mins):
+            self.mins.append(mins[:0])
+            self.maxs.append(maxs[:0])
+        min_buffer, max_buffer = self._buffers.get(level, (None, None))
+        min_buffer, self.mins[level] = write_rows(min_buffer, self.mins[level], first, mins)
+        max_buffer, self.maxs[level] = write_rows(max_buffer, self.maxs[level], first, maxs)
+        self._buffers[level] = (min_buffer, max_buffer)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def query(self, start, end, max_bins):
+        """Min/max точки за [start, end) - най-финото ниво с не повече от max_bins bin-а"""
+        level = 0
+        while level < len(self.mins) - 1 and (end - start) / self.bin_size(level) > max_bins:
+            level += 1
+
+        size = self.bin_size(level)
+        first = start // size
+        last = min(-(-end // size), len(self.mins[level]))
+        mins = self.mins[level][first:last]
+        maxs = self.maxs[level][first:last]
+
+        # Всеки bin дава две точки - min и max - за да се виждат QRS пиковете
+        positions = (np.arange(first, last) + 0.5) * size
+        positions = np.clip(positions, start, max(start, end - 1))
+        x = np.repeat(positions, 2)
+        y = np.empty((2 * len(mins), mins.shape[1]), dtype=np.float32)
+        y[0::2] = mins
+        y[1::2] = maxs
+        return x, y
+
+    def save(self, sidecar, key):
+        sidecar.store(key, 'pyramid_meta',
+                      np.array([self.base_factor, self.level_factor, len(self.mins)], dtype=np.int64))
+        for i, (mins, maxs) in enumerate(zip(self.mins, self.maxs)):
+            sidecar.store(key, f'pyramid_min_{i}', mins)
+            sidecar.store(key, f'pyramid_max_{i}', maxs)
+
+    @classmethod
+    def load(cls, sidecar, key):
+        meta = sidecar.load(key, 'pyramid_meta', mmap=False)
+        if meta is None:
+            return None
+
+        base_factor, level_factor, levels = (int(v) for v in meta)
+        mins = [sidecar.load(key, f'pyramid_min_{i}') for i in range(levels)]
+        maxs = [sidecar.load(key, f'pyramid_max_{i}') for i in range(levels)]
+        if any(level is None for level in mins + maxs):
+            return None
+        return cls(mins, maxs, base_factor, level_factor)
+
+
+class StatsIndex:
+    """Статистики по отвеждания за блокове от CHUNK_SEC (mV при gain 1) - min, max, сума, сума на
+    квадратите и квантили от до SKETCH_POINTS точки на блок. Строи се с едно поточно минаване;
+    заявка за прозорец обхожда само блоковете в него"""
+
+    CHUNK_SEC = 2.0
+    QUANTILES = (5, 25, 50, 75, 95)
+    SKETCH_POINTS = 256
+    READ_FRAMES = 1 << 18
+    FIELDS = ('counts', 'mins', 'maxs', 'sums', 'sumsq', 'quantiles')
+
+    def __init__(self, sampling_rate, arrays=None):
+        self.chunk_size = max(1, int(self.CHUNK_SEC * sampling_rate))
+        self.arrays = arrays
+        self.ready = arrays is not None
+        # Брой обхванати кадри - нужен за extend()
+        self.length = None
+        self.progress = 0.0
+        self._cancelled = threading.Event()
+        self._buffers = {}
+
+    @property
+    def nbytes(self):
+        arrays = self.arrays or {}
+        return sum(resident_nbytes(self._buffers[name] if self._buffers.get(name) is not None else array)
+                   for name, array in arrays.items())
+
+    def _reduce(self, blocks):
+        """Статистики на (блокове, точки, отвеждания)"""
+        step = max(1, blocks.shape[1] // self.SKETCH_POINTS)
+        sketch = np.percentile(blocks[:, ::step], self.QUANTILES, axis=1)
+        return (np.full(len(blocks), blocks.shape[1], dtype=np.int64),
+                blocks.min(axis=1), blocks.max(axis=1),
+                blocks.sum(axis=1, dtype=np.float64),
+                np.square(blocks, dtype=np.float64).sum(axis=1),
+                np.moveaxis(sketch, 0, 1).astype(np.float32))
+
+    def _chunk_stats(self, data):
+        """Статистики на блоковете в data (започва от граница на блок; последният може да е непълен)"""
+        size = self.chunk_size
+        full = len(data) // size
+        parts = []
+        if full:
+            parts.append(self._reduce(data[:full * size].reshape(full, size, -1)))
+        if len(data) > full * size:
+            parts.append(self._reduce(data[full * size:][np.newaxis]))
+        return tuple(np.concatenate(columns) for columns in zip(*parts))
+
+    def _update(self, recording, start, progress=None):
+        """Преизчислява блоковете от start (граница на блок) до края на записа"""
+        total = len(recording)
+        read_frames = max(1, self.READ_FRAMES // self.chunk_size) * self.chunk_size
+        first = start // self.chunk_size
+        for read_start in range(start, total, read_frames):
+            if self._cancelled.is_set():
+                return False
+            read_end = min(read_start + read_frames, total)
+            stats = self._chunk_stats(recording.window(read_start, read_end, gain=1.0))
+            self._write(first, stats)
+            first += len(stats[0])
+            if progress is not None:
+                progress((read_end - start) / max(1, total - start))
+        return True
+
+    def _write(self, first, stats):
+        arrays = dict(self.arrays or {})
+        for name, rows in zip(self.FIELDS, stats):
+            current = arrays.get(name, rows[:0])
+            self._buffers[name], arrays[name] = write_rows(self._buffers.get(name), current, first, rows)
+        # Подмяна наведнъж - заявките от други нишки виждат съгласувани масиви
+        self.arrays = arrays
+
+    def build(self, recording, progress=None):
+        """Поточно минаване по целия запис - изпълнява се във фонова задача"""
+        total = len(recording)
+        self.arrays = None
+        self._buffers = {}
+        if self._update(recording, 0, progress) and self.arrays is not None:
+            self.length = total
+            self.ready = True
+
+    def extend(self, recording, changed_from=None):
+        """Преизчислява само блоковете след changed_from (или края) - за дописван запис"""
+        if not self.ready or self.length is None or len(recording) <= self.length:
+            return
+        start = min(self.length, len(recording) if changed_from is None else changed_from)
+        total = len(recording)
+        if self._update(recording, start // self.chunk_size * self.chunk_size):
+            self.length = total
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def query(self, start, end, gain=1.0):
+        """Статистики за [start, end) по отвеждания - по целите блокове, които пресича прозорецът.
+        Квантилите са медиани на квантилите на блоковете. None, ако няма данни"""
+        arrays = self.arrays
+        if not self.ready or arrays is None:
+            return None
+        first = max(0, start // self.chunk_size)
+        last = min(-(-end // self.chunk_size), len(arrays['counts']))
+        if last <= first:
+            return None
+
+        count = arrays['counts'][first:last].sum()
+        mean = arrays['sums'][first:last].sum(axis=0) / count
+        variance = np.maximum(arrays['sumsq'][first:last].sum(axis=0) / count - mean ** 2, 0.0)
+        gain = abs(gain)
+        return {
+            'min': arrays['mins'][first:last].min(axis=0) * gain,
+            'max': arrays['maxs'][first:last].max(axis=0) * gain,
+            'mean': (mean * gain).astype(np.float32),
+            'std': (np.sqrt(variance) * gain).astype(np.float32),
+            'quantiles': np.median(arrays['quantiles'][first:last], axis=0) * gain,
+        }
+
+    def save(self, sidecar, key):
+        for name in self.FIELDS:
+            sidecar.store(key, f'stats_{name}', self.arrays[name])
+
+    @classmethod
+    def load(cls, sidecar, key, sampling_rate):
+        arrays = {name: sidecar.load(key, f'stats_{name}', mmap=False) for name in cls.FIELDS}
+        if any(array is None for array in arrays.values()):
+            return None
+        return cls(sampling_rate, arrays)
+
+
+class JobCancelled(Exception):
+    """Задачата е отменена или заменена с по-нова"""
+
+
+class BeatTable:
+    """Таблица на ударите - масиви по колони, сортирани по позиция (търсене за O(log n))"""
+
+    # Битове в quality
+    QUALITY_OK = 0
+    QUALITY_AMPLITUDE = 1
+    QUALITY_RR = 2
+
+    def __init__(self, samples, rr, lead, quality, sampling_rate):
+        self.samples = np.asarray(samples, dtype=np.int64)
+        self.rr = np.asarray(rr, dtype=np.float32)
+        self.lead = np.asarray(lead, dtype=np.int8)
+        self.quality = np.asarray(quality, dtype=np.uint8)
+        self.sampling_rate = sampling_rate
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes + self.rr.nbytes + self.lead.nbytes + self.quality.nbytes
+
+    def between(self, start, end):
+        """Индекси [first, last) на ударите в семплите [start, end)"""
+        return (int(np.searchsorted(self.samples, start, side='left')),
+                int(np.searchsorted(self.samples, end, side='left')))
+
+    def heart_rate(self, start, end):
+        """Средна честота (bpm) от добрите RR интервали в диапазона или None"""
+        first, last = self.between(start, end)
+        rr = self.rr[first:last]
+        good = (self.quality[first:last] == self.QUALITY_OK) & np.isfinite(rr)
+        if good.sum() < 1:
+            return None
+        return int(60.0 / float(np.mean(rr[good])))
+
+    def truncate(self, position):
+        """Таблица само с ударите преди position"""
+        count = int(np.searchsorted(self.samples, position, side='left'))
+        return BeatTable(self.samples[:count], self.rr[:count], self.lead[:count], self.quality[:count],
+                         self.sampling_rate)
+
+    def next_beat(self, position):
+        index = int(np.searchsorted(self.samples, position, side='right'))
+        return int(self.samples[index]) if index < len(self.samples) else None
+
+    def prev_beat(self, position):
+        index = int(np.searchsorted(self.samples, position, side='left')) - 1
+        return int(self.samples[index]) if index >= 0 else None
+
+    def save(self, sidecar, key):
+        sidecar.store(key, 'beats_samples', self.samples)
+        sidecar.store(key, 'beats_rr', self.rr)
+        sidecar.store(key, 'beats_lead', self.lead)
+        sidecar.store(key, 'beats_quality', self.quality)
+
+    @classmethod
+    def load(cls, sidecar, key, sampling_rate):
+        columns = [sidecar.load(key, f'beats_{name}', mmap=False)
+                   for name in ('samples', 'rr', 'lead', 'quality')]
+        if any(column is None for column in columns):
+            return None
+        return cls(*columns, sampling_rate)
+
+
+class BeatDetector:
+    """Pan-Tompkins детектор (5-15 Hz, производна, квадрат, интегриране) - векторизиран, на части с припокриване"""
+
+    CHUNK_SEC = 60.0
+    PAD_SEC = 2.0
+    INTEGRATION_SEC = 0.15
+    REFRACTORY_SEC = 0.25
+    SEARCH_SEC = 0.1
+    THRESHOLD_RATIO = 0.3
+    # Удари за медианите при оценка на качеството на дописаните удари
+    REFERENCE_BEATS = 300
+
+    def __init__(self, sampling_rate):
+        self.sampling_rate = sampling_rate
+        nyquist = sampling_rate / 2
+        self.sos = signal.butter(2, [5.0 / nyquist, min(15.0 / nyquist, 0.99)], btype='band', output='sos')
+        self.integration = max(1, int(self.INTEGRATION_SEC * sampling_rate))
+        self.refractory = max(1, int(self.REFRACTORY_SEC * sampling_rate))
+        self.search = max(1, int(self.SEARCH_SEC * sampling_rate))
+
+    def _integrate(self, data):
+        """Moving-window интегриране по всички отвеждания чрез cumsum"""
+        csum = np.cumsum(data, axis=0, dtype=np.float64)
+        csum = np.vstack([np.zeros((1, data.shape[1])), csum])
+        width = self.integration
+        head = width // 2
+        idx = np.arange(len(data))
+        upper = np.minimum(idx + width - head, len(data))
+        lower = np.maximum(idx - head, 0)
+        return ((csum[upper] - csum[lower]) / width).astype(np.float32)
+
+    def detect_chunk(self, data, offset):
+        """Удари в (samples, leads) блок - позиции (+offset), използваното отвеждане и амплитуди на R"""
+        empty = np.zeros(0, dtype=np.int64), 0, np.zeros(0, dtype=np.float32)
+        if len(data) <= 2 * self.search + 1 + 3 * (2 * len(self.sos) + 1):
+            return empty
+
+        band = signal.sosfiltfilt(self.sos, data, axis=0)
+        energy = np.gradient(band, axis=0) ** 2
+        integrated = self._integrate(energy)
+
+        # Отвеждането с най-ясно изразени QRS комплекси в блока
+        peak_level = np.percentile(integrated, 98, axis=0)
+        floor = np.median(integrated, axis=0) + 1e-12
+        lead = int(np.argmax(peak_level / floor))
+        envelope = integrated[:, lead]
+
+        peaks = BackendDispatcher.shared().select('peaks', len(envelope)).find_peaks(
+            envelope, self.THRESHOLD_RATIO * peak_level[lead], self.refractory)
+        if len(peaks) == 0:
+            return empty[0], lead, empty[2]
+
+        # Уточняване на R върха - максимум на |band| около пика на обвивката
+        magnitude = np.abs(band[:, lead])
+        starts = np.clip(peaks - self.search, 0, len(magnitude) - 2 * self.search - 1)
+        windows = np.lib.stride_tricks.sliding_window_view(magnitude, 2 * self.search + 1)
+        r_peaks = starts + np.argmax(windows[starts], axis=1)
+        return r_peaks.astype(np.int64) + offset, lead, magnitude[r_peaks].astype(np.float32)
+
+    def detect(self, recording, progress=None):
+        """Детекция върху целия зареден диапазон - паметта е ограничена от размера на блока"""
+        return self.make_table(*self.detect_range(recording, 0, len(recording), progress))
+
+    def detect_range(self, recording, first, last, progress=None):
+        """Удари в [first, last) - (позиции, отвеждания, амплитуди). Блоковете се четат с padding
+        и извън диапазона, доколкото записът стига"""
+        total = len(recording)
+        chunk = max(1, int(self.CHUNK_SEC * self.sampling_rate))
+        pad = int(self.PAD_SEC * self.sampling_rate)
+
+        samples = []
+        leads = []
+        amplitudes = []
+        for start in range(first, last, chunk):
+            end = min(start + chunk, last)
+            padded_start = max(0, start - pad)
+            padded_end = min(total, end + pad)
+            data = recording.window(padded_start, padded_end, gain=1.0)
+
+            beats, lead, amplitude = self.detect_chunk(data, padded_start)
+            inside = (beats >= start) & (beats < end)
+            samples.append(beats[inside])
+            amplitudes.append(amplitude[inside])
+            leads.append(np.full(int(inside.sum()), lead, dtype=np.int8))
+            if progress is not None:
+                progress((end - first) / max(1, last - first))
+
+        samples = np.concatenate(samples) if samples else np.zeros(0, dtype=np.int64)
+        leads = np.concatenate(leads) if leads else np.zeros(0, dtype=np.int8)
+        amplitudes = np.concatenate(amplitudes) if amplitudes else np.zeros(0, dtype=np.float32)
+
+        # Удари от съседни блокове, по-близки от рефрактерния период
+        if len(samples) > 1:
+            keep = np.concatenate([[True], np.diff(samples) >= self.refractory])
+            samples, leads, amplitudes = samples[keep], leads[keep], amplitudes[keep]
+
+        return samples, leads, amplitudes
+
+    def extend_table(self, table, samples, leads, amplitudes, reference_amplitudes=None):
+        """Добавя удари след края на таблицата - качеството на новите се оценява спрямо
+        последните REFERENCE_BEATS удара, без да се обхожда цялата таблица"""
+        if table is None or len(table) == 0:
+            return self.make_table(samples, leads, amplitudes)
+
+        keep = samples - table.samples[-1] >= self.refractory
+        samples, leads, amplitudes = samples[keep], leads[keep], amplitudes[keep]
+        if len(samples) == 0:
+            return table
+
+        rr = (np.diff(np.concatenate([table.samples[-1:], samples])) / self.sampling_rate).astype(np.float32)
+        recent_rr = np.concatenate([table.rr[-self.REFERENCE_BEATS:], rr])
+        median_rr = np.nanmedian(recent_rr)
+        quality = np.zeros(len(samples), dtype=np.uint8)
+        rr_bad = (rr < 0.25) | (rr > 2.5) | (np.abs(rr - median_rr) > 0.5 * median_rr)
+        quality[rr_bad] |= BeatTable.QUALITY_RR
+
+        reference = amplitudes if reference_amplitudes is None else np.concatenate([reference_amplitudes, amplitudes])
+        median_amp = np.median(reference[-self.REFERENCE_BEATS:]) + 1e-6
+        amp_bad = (amplitudes < 0.3 * median_amp) | (amplitudes > 3.0 * median_amp)
+        quality[amp_bad] |= BeatTable.QUALITY_AMPLITUDE
+
+        return BeatTable(np.concatenate([table.samples, samples]), np.concatenate([table.rr, rr]),
+                         np.concatenate([table.lead, leads]), np.concatenate([table.quality, quality]),
+                         self.sampling_rate)
+
+    def make_table(self, samples, leads, amplitudes):
+        rr = np.full(len(samples), np.nan, dtype=np.float32)
+        if len(samples) > 1:
+            rr[1:] = np.diff(samples) / self.sampling_rate
+
+        quality = np.zeros(len(samples), dtype=np.uint8)
+        if len(samples) > 2:
+            # RR извън физиологичния диапазон или рязко различен от медианата
+            median_rr = np.nanmedian(rr)
+            rr_bad = (rr < 0.25) | (rr > 2.5) | (np.abs(rr - median_rr) > 0.5 * median_rr)
+            quality[rr_bad] |= BeatTable.QUALITY_RR
+
+            # Амплитуда на R спрямо медианата
+            median_amp = np.median(amplitudes) + 1e-6
+            amp_bad = (amplitudes < 0.3 * median_amp) | (amplitudes > 3.0 * median_amp)
+            quality[amp_bad] |= BeatTable.QUALITY_AMPLITUDE
+
+        return BeatTable(samples, rr, leads, quality, self.sampling_rate)
+
+
+class HRVAnalyzer:
+    """HR тахограма и HRV по епохи от таблицата на ударите - SDNN, RMSSD, pNN50 и LF/HF (Lomb-Scargle).
+    Времевите метрики се смятат наведнъж за всички епохи (bincount); спектърът се кешира по епохи
+    и се преизчислява само за епохи с променени удари"""
+
+    EPOCH_SEC = 300.0
+    # Минимален брой добри RR интервали в епоха
+    MIN_BEATS = 30
+    LF_BAND = (0.04, 0.15)
+    HF_BAND = (0.15, 0.4)
+    FREQS = np.linspace(0.0033, 0.5, 200)
+    CACHE_SIZE = 4096
+
+    def __init__(self, sampling_rate, epoch_sec=EPOCH_SEC):
+        self.sampling_rate = sampling_rate
+        self.epoch_sec = epoch_sec
+        self._spectra = {}
+
+    def good_rr(self, beats, start=0, end=None):
+        """(позиции, RR в s) на добрите удари в [start, end)"""
+        if end is None:
+            first, last = int(np.searchsorted(beats.samples, start, side='left')), len(beats)
+        else:
+            first, last = beats.between(start, end)
+        samples = beats.samples[first:last]
+        rr = beats.rr[first:last].astype(np.float64)
+        good = (beats.quality[first:last] == BeatTable.QUALITY_OK) & np.isfinite(rr)
+        return samples[good], rr[good]
+
+    def tachogram(self, beats, start=0, end=None, bin_sec=None):
+        """(време в s, HR в bpm) - по удари или средно за bin_sec (за тренд на целия запис)"""
+        samples, rr = self.good_rr(beats, start, end)
+        times = samples / self.sampling_rate
+        hr = 60.0 / rr
+        if bin_sec is None or len(times) == 0:
+            return times, hr
+
+        bins = ((times - times[0]) // bin_sec).astype(np.int64)
+        counts = np.bincount(bins)
+        filled = counts > 0
+        centers = times[0] + (np.arange(len(counts)) + 0.5) * bin_sec
+        return centers[filled], (np.bincount(bins, weights=hr) / np.maximum(counts, 1))[filled]
+
+    @staticmethod
+    def lomb_scargle(times, values, freqs):
+        """Lomb-Scargle периодограма за неравномерно разположени стойности - матрично (честоти x удари)"""
+        omega = 2 * np.pi * freqs[:, np.newaxis]
+        values = values - values.mean()
+        tau = np.arctan2(np.sin(2 * omega * times).sum(axis=1),
+                         np.cos(2 * omega * times).sum(axis=1))[:, np.newaxis] / (2 * omega)
+        phase = omega * (times - tau)
+        cos, sin = np.cos(phase), np.sin(phase)
+        return 0.5 * ((cos @ values) ** 2 / (cos ** 2).sum(axis=1) + (sin @ values) ** 2 / (sin ** 2).sum(axis=1))
+
+    def band_powers(self, times, rr_ms):
+        """LF и HF мощност (ms²) - периодограмата е нормирана така, че площта ѝ е дисперсията на RR"""
+        power = self.lomb_scargle(times, rr_ms, self.FREQS)
+        df = self.FREQS[1] - self.FREQS[0]
+        total = power.sum() * df
+        if total <= 0:
+            return np.nan, np.nan
+        psd = power * (np.var(rr_ms) / total)
+
+        def band(low, high):
+            mask = (self.FREQS >= low) & (self.FREQS < high)
+            return float(psd[mask].sum() * df)
+
+        return band(*self.LF_BAND), band(*self.HF_BAND)
+
+    def epochs(self, beats, start=0, end=None, progress=None):
+        """Метрики за всяка епоха от EPOCH_SEC в [start, end) - речник от масиви с по един елемент на епоха"""
+        samples, rr = self.good_rr(beats, start, end)
+        epoch_len = int(self.epoch_sec * self.sampling_rate)
+        end = end if end is not None else (int(samples[-1]) + 1 if len(samples) else start)
+        count = max(0, -(-(end - start) // epoch_len))
+        epoch = (samples - start) // epoch_len
+        rr_ms = rr * 1000.0
+
+        n = np.bincount(epoch, minlength=count)[:count].astype(np.float64)
+        total = np.bincount(epoch, weights=rr_ms, minlength=count)[:count]
+        total_sq = np.bincount(epoch, weights=rr_ms ** 2, minlength=count)[:count]
+        valid = n >= self.MIN_BEATS
+        safe_n = np.maximum(n, 1)
+        mean_rr = total / safe_n
+        sdnn = np.sqrt(np.maximum(total_sq / safe_n - mean_rr ** 2, 0.0) * safe_n / np.maximum(n - 1, 1))
+
+        # Последователни разлики само между съседни добри удари в една епоха
+        diffs = np.diff(rr_ms)
+        same = np.diff(epoch) == 0
+        diff_epoch = epoch[1:][same]
+        diffs = diffs[same]
+        n_diff = np.bincount(diff_epoch, minlength=count)[:count].astype(np.float64)
+        safe_diffs = np.maximum(n_diff, 1)
+        rmssd = np.sqrt(np.bincount(diff_epoch, weights=diffs ** 2, minlength=count)[:count] / safe_diffs)
+        pnn50 = 100.0 * np.bincount(diff_epoch, weights=np.abs(diffs) > 50.0, minlength=count)[:count] / safe_diffs
+
+        lf = np.full(count, np.nan)
+        hf = np.full(count, np.nan)
+        bounds = np.searchsorted(epoch, np.arange(count + 1))
+        for i in np.nonzero(valid)[0]:
+            lo, hi = bounds[i], bounds[i + 1]
+            # Ключ - епоха и удари в нея; при дописан запис се преизчислява само последната
+            key = (start + i * epoch_len, epoch_len, hi - lo, int(samples[hi - 1]))
+            powers = self._spectra.get(key)
+            if powers is None:
+                powers = self.band_powers(samples[lo:hi] / self.sampling_rate, rr_ms[lo:hi])
+                if len(self._spectra) >= self.CACHE_SIZE:
+                    self._spectra.clear()
+                self._spectra[key] = powers
+            lf[i], hf[i] = powers
+            if progress is not None:
+                progress((i + 1) / count)
+
+        def masked(values):
+            return np.where(valid, values, np.nan)
+
+        # Без HF мощност съотношението е неопределено - NaN, без деление на нула
+        lf_hf = np.full(count, np.nan)
+        np.divide(lf, hf, out=lf_hf, where=hf > 0)
+
+        return {
+            'start': start + np.arange(count) * epoch_len,
+            'beats': n.astype(np.int64),
+            'hr': masked(60000.0 / np.where(mean_rr > 0, mean_rr, np.nan)),
+            'mean_rr': masked(mean_rr),
+            'sdnn': masked(sdnn),
+            'rmssd': masked(rmssd),
+            'pnn50': masked(pnn50),
+            'lf': lf,
+            'hf': hf,
+            'lf_hf': lf_hf,
+        }
+
+    def export_csv(self, filename, epochs):
+        """Метриките по епохи като CSV - начало (s), удари, HR, SDNN, RMSSD, pNN50, LF, HF, LF/HF"""
+        columns = ['beats', 'hr', 'sdnn', 'rmssd', 'pnn50', 'lf', 'hf', 'lf_hf']
+        with open(filename, 'w', newline='') as f:
+            f.write(','.join(['Start(s)'] + columns) + '\n')
+            for i, start in enumerate(epochs['start']):
+                values = [f"{start / self.sampling_rate:.1f}"] + [f"{epochs[name][i]:.4g}" for name in columns]
+                f.write(','.join(values) + '\n')
+
+    def summary(self, beats, epochs=None, start=0, end=None):
+        """Метрики за целия диапазон - SDNN, RMSSD, pNN50, SDANN (по средните RR на епохите) и SDNN index"""
+        samples, rr = self.good_rr(beats, start, end)
+        if len(rr) < 2:
+            return None
+        if epochs is None:
+            epochs = self.epochs(beats, start, end)
+        rr_ms = rr * 1000.0
+        diffs = np.diff(rr_ms)
+        epoch_rr = epochs['mean_rr'][np.isfinite(epochs['mean_rr'])]
+        epoch_sdnn = epochs['sdnn'][np.isfinite(epochs['sdnn'])]
+        return {
+            'beats': len(rr),
+            'hr': float(60000.0 / rr_ms.mean()),
+            'sdnn': float(rr_ms.std(ddof=1)),
+            'rmssd': float(np.sqrt(np.mean(diffs ** 2))),
+            'pnn50': float(100.0 * np.mean(np.abs(diffs) > 50.0)),
+            'sdann': float(epoch_rr.std(ddof=1)) if len(epoch_rr) > 1 else np.nan,
+            'sdnn_index': float(epoch_sdnn.mean()) if len(epoch_sdnn) else np.nan,
+        }
+
+
+def format_csv_block(time_col, data, row_format):
+    """Форматира блок от CSV с едно извикване на % (на ниво модул - за process pool)"""
+    values = np.column_stack([time_col, data]).ravel().tolist()
+    return (row_format * len(time_col)) % tuple(values)
+
+
+@contextlib.contextmanager
+def atomic_output(filename):
+    """Пише в <filename>.partial и го преименува на filename само при успех - прекъснат
+    или неуспешен запис изтрива .partial и не оставя недовършен файл под крайното име"""
+    partial = filename + '.partial'
+    try:
+        yield partial
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+    os.replace(partial, filename)
+
+
+class ECGExporter:
+    """Поточен експорт на зареден диапазон на блокове - паметта не зависи от дължината"""
+
+    CHUNK_FRAMES = 1 << 16
+
+    def __init__(self, recording, sampling_rate, lead_names, gain=1.0):
+        self.recording = recording
+        self.sampling_rate = sampling_rate
+        self.lead_names = list(lead_names)
+        self.gain = gain
+
+    def _blocks(self, start, end):
+        for block_start in range(start, end, self.CHUNK_FRAMES):
+            yield block_start, min(block_start + self.CHUNK_FRAMES, end)
+
+    def export_csv(self, filename, start=0, end=None, progress=None, workers=1):
+        """CSV за [start, end) - време (s) от началото на заредения диапазон и mV по отвеждания.
+        При workers > 1 блоковете се форматират паралелно в отделни процеси."""
+        end = len(self.recording) if end is None else min(end, len(self.recording))
+        start = max(0, min(start, end))
+        num_leads = self.recording.num_leads
+        row_format = ','.join(['%.3f'] + ['%.6f'] * num_leads) + '\n'
+        header = ','.join(['Time(s)'] + self.lead_names[:num_leads])
+
+        tracer = PerfTracer.shared()
+
+        def block_args(block_start, block_end):
+            with tracer.span('export.decode'):
+                time_col = np.arange(block_start, block_end) / self.sampling_rate
+                return time_col, self.recording.window(block_start, block_end, self.gain), row_format
+
+        with atomic_output(filename) as partial, open(partial, 'w', newline='') as f:
+            f.write(header + '\n')
+
+            if workers <= 1:
+                for block_start, block_end in self._blocks(start, end):
+                    args = block_args(block_start, block_end)
+                    with tracer.span('export.format'):
+                        text = format_csv_block(*args)
+                    with tracer.span('export.write'):
+                        f.write(text)
+                    if progress is not None:
+                        progress((block_end - start) / max(1, end - start))
+                return
+
+            # Най-много 2 блока на процес в движение - паметта остава ограничена
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                pending = []
+                blocks = iter(self._blocks(start, end))
+                for block in blocks:
+                    pending.append((block[1], executor.submit(format_csv_block, *block_args(*block))))
+                    if len(pending) < 2 * workers:
+                        continue
+                    block_end, future = pending.pop(0)
+                    f.write(future.result())
+                    if progress is not None:
+                        progress((block_end - start) / max(1, end - start))
+
+                for block_end, future in pending:
+                    f.write(future.result())
+                    if progress is not None:
+                        progress((block_end - start) / max(1, end - start))
+
+    EXPORT_FORMATS = {
+        '.csv': 'csv',
+        '.npy': 'npy',
+        '.h5': 'hdf5',
+        '.hdf5': 'hdf5',
+        '.edf': 'edf',
+        '.ecgz': 'ecgz',
+    }
+
+    def export(self, filename, start=0, end=None, progress=None, workers=None):
+        """Избира формата по разширението на файла. workers - процеси за CSV (по подразбиране 1),
+        нишки за компресията на .ecgz (по подразбиране всички)"""
+        fmt = self.EXPORT_FORMATS.get(os.path.splitext(filename)[1].lower(), 'csv')
+        with PerfTracer.shared().span(f'export.{fmt}'):
+            if fmt == 'csv':
+                return self.export_csv(filename, start, end, progress, workers or 1)
+            if fmt == 'ecgz':
+                return self.export_ecgz(filename, start, end, progress, workers)
+            return getattr(self, f'export_{fmt}')(filename, start, end, progress)
+
+    def _range(self, start, end):
+        end = len(self.recording) if end is None else min(end, len(self.recording))
+        return max(0, min(start, end)), end
+
+    def metadata(self, start, end):
+        """Описание на raw данните - физична стойност (mV) = стойност / scale"""
+        recording = self.recording
+        return {
+            'format': 'ecg-raw',
+            'sampling_rate': self.sampling_rate,
+            'num_leads': recording.num_leads,
+            'lead_names': self.lead_names[:recording.num_leads],
+            'dtype': str(recording.raw.dtype),
+            'scale': recording.scale,
+            'units': 'mV',
+            'source_file': os.path.basename(recording.filename),
+            'start_sample': recording.start_sample + start,
+            'num_samples': end - start,
+        }
+
+    def export_npy(self, filename, start=0, end=None, progress=None):
+        """Raw стойности като .npy (без преобразуване) + JSON метаданни до файла"""
+        start, end = self._range(start, end)
+        # Метаданните се заменят след данните - при грешка не остава нито един от двата файла
+        with atomic_output(os.path.splitext(filename)[0] + '.json') as meta_partial, \
+                atomic_output(filename) as partial:
+            out = np.lib.format.open_memmap(partial, mode='w+', dtype=self.recording.raw.dtype,
+                                            shape=(end - start, self.recording.num_leads))
+            for block_start, block_end in self._blocks(start, end):
+                out[block_start - start:block_end - start] = self.recording.raw[block_start:block_end]
+                if progress is not None:
+                    progress((block_end - start) / max(1, end - start))
+            out.flush()
+            del out
+
+            with open(meta_partial, 'w', encoding='utf-8') as f:
+                json.dump(self.metadata(start, end), f, ensure_ascii=False, indent=2)
+
+    def export_hdf5(self, filename, start=0, end=None, progress=None):
+        """Raw стойности в HDF5 dataset на блокове с gzip + shuffle компресия"""
+        if h5py is None:
+            raise RuntimeError("HDF5 експортът изисква h5py (pip install h5py)")
+
+        start, end = self._range(start, end)
+        num_leads = self.recording.num_leads
+        chunk_rows = max(1, min(end - start, int(10 * self.sampling_rate)))
+        with atomic_output(filename) as partial, h5py.File(partial, 'w') as f:
+            dataset = f.create_dataset('ecg', shape=(end - start, num_leads),
+                                       dtype=self.recording.raw.dtype,
+                                       chunks=(chunk_rows, num_leads),
+                                       compression='gzip', shuffle=True)
+            for key, value in self.metadata(start, end).items():
+                dataset.attrs[key] = value
+            for block_start, block_end in self._blocks(start, end):
+                dataset[block_start - start:block_end - start] = self.recording.raw[block_start:block_end]
+                if progress is not None:
+                    progress((block_end - start) / max(1, end - start))
+
+    def export_ecgz(self, filename, start=0, end=None, progress=None, workers=None):
+        """Raw стойности в компресиран .ecgz контейнер (без загуби) с индекс за четене на части"""
+        start, end = self._range(start, end)
+        block_frames = int(ECGZContainer.BLOCK_SEC * self.sampling_rate)
+        ECGZContainer.write(filename, self.recording.raw, self.metadata(start, end), block_frames,
+                            start, end, progress, workers)
+
+    def export_edf(self, filename, start=0, end=None, progress=None):
+        """EDF+C с 1-секундни записи; digital = raw int16, physical (mV) = digital / scale"""
+        recording = self.recording
+        if recording.raw.dtype.itemsize != 2:
+            raise ValueError("EDF+ поддържа само 16-битови данни")
+        if int(self.sampling_rate) != self.sampling_rate:
+            raise ValueError("EDF+ изисква цял брой семпли в секунда")
+
+        start, end = self._range(start, end)
+        fs = int(self.sampling_rate)
+        num_leads = recording.num_leads
+        num_records = -(-(end - start) // fs)
+        annotation_samples = 30
+        signals = num_leads + 1
+
+        def field(value, width):
+            text = str(value)
+            if len(text) > width:
+                raise ValueError(f"EDF поле '{text}' е по-дълго от {width} символа")
+            return text.ljust(width).encode('ascii')
+
+        def number(value, width=8):
+            text = f"{value:.6f}".rstrip('0').rstrip('.')
+            return field(text[:width], width)
+
+        physical_min = -32768 / recording.scale
+        physical_max = 32767 / recording.scale
+        labels = [name.encode('ascii', 'replace').decode('ascii') for name in self.lead_names[:num_leads]]
+
+        header = b''.join([
+            field('0', 8), field('X X X X', 80), field('Startdate X X X X', 80),
+            field('01.01.85', 8), field('00.00.00', 8), field(256 * (signals + 1), 8),
+            field('EDF+C', 44), field(num_records, 8), field(1, 8), field(signals, 4),
+            b''.join(field(label[:16], 16) for label in labels) + field('EDF Annotations', 16),
+            field('', 80) * signals,
+            field('mV', 8) * num_leads + field('', 8),
+            number(physical_min) * num_leads + field(-1, 8),
+            number(physical_max) * num_leads + field(1, 8),
+            field(-32768, 8) * signals,
+            field(32767, 8) * signals,
+            field('', 80) * signals,
+            field(fs, 8) * num_leads + field(annotation_samples, 8),
+            field('', 32) * signals,
+        ])
+
+        records_per_block = max(1, self.CHUNK_FRAMES // fs)
+        with atomic_output(filename) as partial, open(partial, 'wb') as f:
+            f.write(header)
+            for first_record in range(0, num_records, records_per_block):
+                records = min(records_per_block, num_records - first_record)
+                block_start = start + first_record * fs
+                data = np.zeros((records * fs, num_leads), dtype='<i2')
+                chunk = recording.raw[block_start:min(block_start + records * fs, end)]
+                data[:len(chunk)] = chunk
+
+                # Всеки запис: fs семпли за всяко отвеждане, после annotation сигналът
+                out = np.zeros((records, num_leads * fs + annotation_samples), dtype='<i2')
+                out[:, :num_leads * fs] = data.reshape(records, fs, num_leads).transpose(0, 2, 1).reshape(records, -1)
+                annotations = out[:, num_leads * fs:].view(np.uint8)
+                for i in range(records):
+                    tal = f"+{first_record + i}\x14\x14\x00".encode('ascii')
+                    annotations[i, :len(tal)] = np.frombuffer(tal, dtype=np.uint8)
+                f.write(out.tobytes())
+
+                if progress is not None:
+                    progress((first_record + records) / num_records)
+
+
+class FileLayout:
+    """Подредба на данните във файла - header, отвеждания, ширина, byte order, interleaved/blocked"""
+
+    # Имената на отвежданията ги има само в контейнерите (ECGZLayout)
+    lead_names = None
+
+    def __init__(self, header_size=0, num_leads=12, sample_width=2, byteorder='<',
+                 interleaved=True, sampling_rate=None, scale=200.0):
+        self.header_size = header_size
+        self.num_leads = num_leads
+        self.sample_width = sample_width
+        self.byteorder = byteorder
+        self.interleaved = interleaved
+        self.sampling_rate = sampling_rate
+        self.scale = scale
+
+    @property
+    def frame_bytes(self):
+        return self.num_leads * self.sample_width
+
+    def total_samples(self, file_size):
+        return max(0, (file_size - self.header_size) // self.frame_bytes)
+
+    def fits(self, file_size):
+        payload = file_size - self.header_size
+        return payload > 0 and payload % self.frame_bytes == 0
+
+    def decode(self, buffer):
+        """Декодира байтове (цял брой стойности) в int32 масив"""
+        if self.sample_width == 3:
+            raw = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            if self.byteorder == '>':
+                raw = raw[:, ::-1]
+            values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+            return (values ^ 0x800000) - 0x800000
+        return np.frombuffer(buffer, dtype=f'{self.byteorder}i{self.sample_width}').astype(np.int32)
+
+    def memmap(self, filename, total_samples):
+        """(samples, leads) изглед към файла без копиране"""
+        if self.sample_width == 3:
+            shape = (total_samples, self.num_leads, 3) if self.interleaved else (self.num_leads, total_samples, 3)
+            packed = np.memmap(filename, dtype=np.uint8, mode='r', offset=self.header_size, shape=shape)
+            return PackedInt24(packed if self.interleaved else packed.transpose(1, 0, 2), self.byteorder)
+
+        dtype = f'{self.byteorder}i{self.sample_width}'
+        if self.interleaved:
+            return np.memmap(filename, dtype=dtype, mode='r', offset=self.header_size,
+                             shape=(total_samples, self.num_leads))
+        return np.memmap(filename, dtype=dtype, mode='r', offset=self.header_size,
+                         shape=(self.num_leads, total_samples)).T
+
+    def describe(self):
+        order = 'LE' if self.byteorder == '<' else 'BE'
+        arrangement = 'interleaved' if self.interleaved else 'blocked'
+        return (f"{self.num_leads} отв., int{self.sample_width * 8} {order}, {arrangement}, "
+                f"header {self.header_size} B")
+
+    def to_dict(self):
+        return {
+            'header_size': self.header_size,
+            'num_leads': self.num_leads,
+            'sample_width': self.sample_width,
+            'byteorder': self.byteorder,
+            'interleaved': self.interleaved,
+            'sampling_rate': self.sampling_rate,
+            'scale': self.scale,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**{key: values[key] for key in cls().to_dict() if key in values})
+
+    def key(self):
+        """Без честотата - тя не променя raw данните"""
+        values = self.to_dict()
+        values.pop('sampling_rate')
+        return values
+
+
+class PackedInt24:
+    """24-битови стойности (samples, leads, 3 байта) - декодират се само прочетените редове"""
+
+    dtype = np.dtype(np.int32)
+    ndim = 2
+
+    def __init__(self, packed, byteorder='<'):
+        self.packed = packed
+        self.byteorder = byteorder
+
+    @property
+    def shape(self):
+        return self.packed.shape[:2]
+
+    def __len__(self):
+        return len(self.packed)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("PackedInt24 поддържа само slice индексиране")
+        raw = np.asarray(self.packed[key]).astype(np.int32)
+        if self.byteorder == '>':
+            raw = raw[..., ::-1]
+        values = raw[..., 0] | (raw[..., 1] << 8) | (raw[..., 2] << 16)
+        return (values ^ 0x800000) - 0x800000
+
+
+class ECGZContainer:
+    """Компресиран .ecgz запис - блокове с фиксирана продължителност, всеки кодиран без загуби
+    (предиктор по отвеждане като във FLAC + zlib), и индекс на отместванията в края на файла.
+    При четене се декодират само блоковете, които покриват заявения диапазон.
+
+    Файл: magic, версия, JSON метаданни (отвеждания, имена, честота, мащаб, dtype, кадри на блок),
+    блоковете, индекс (uint64 отместване на всеки блок + края) и trailer с отместването на индекса."""
+
+    MAGIC = b'ECGZ'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHI')
+    TRAILER = struct.Struct('<QI4s')
+    # Кадри, ред на предиктора, байтове на остатък
+    BLOCK_HEADER = struct.Struct('<IBB')
+    BLOCK_SEC = 10.0
+    # Редове на предиктора - 1 (разлика) или 2 (втора разлика); за всеки блок се избира по-добрият
+    ORDERS = (1, 2)
+    COMPRESS_LEVEL = 6
+    # Декодирани блокове в паметта - при 12 отвеждания и 1000 Hz около 240 KB на блок
+    CACHE_BLOCKS = 32
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file_size = os.path.getsize(filename)
+        self._bytes = np.memmap(filename, dtype=np.uint8, mode='r')
+
+        magic, version, meta_size = self.HEADER.unpack_from(self._bytes, 0)
+        if magic != self.MAGIC or version > self.VERSION:
+            raise ValueError(f"Не е поддържан .ecgz файл: {filename}")
+        meta_start = self.HEADER.size
+        self.metadata = json.loads(bytes(self._bytes[meta_start:meta_start + meta_size]).decode('utf-8'))
+
+        index_offset, count, magic = self.TRAILER.unpack_from(self._bytes, self.file_size - self.TRAILER.size)
+        if magic != self.MAGIC:
+            raise ValueError(f"Непълен .ecgz файл (липсва индекс): {filename}")
+        self.offsets = np.frombuffer(self._bytes, dtype='<u8', count=count + 1, offset=index_offset).astype(np.int64)
+
+        self.num_leads = int(self.metadata['num_leads'])
+        self.total_samples = int(self.metadata['num_samples'])
+        self.block_frames = int(self.metadata['block_frames'])
+        self.dtype = np.dtype(self.metadata['dtype'])
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @classmethod
+    def is_container(cls, filename):
+        try:
+            with open(filename, 'rb') as f:
+                return f.read(len(cls.MAGIC)) == cls.MAGIC
+        except OSError:
+            return False
+
+    def layout(self):
+        return ECGZLayout(self)
+
+    def array(self, start=0, end=None):
+        """(samples, leads) изглед към [start, end) - декодира се при четене"""
+        end = self.total_samples if end is None else min(end, self.total_samples)
+        start = max(0, min(start, end))
+        return ECGZArray(self, start, end - start)
+
+    @property
+    def nbytes(self):
+        """Байтове на декодираните блокове в кеша"""
+        with self._lock:
+            return sum(block.nbytes for block in self._cache.values())
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    @property
+    def ratio(self):
+        """Степен на компресия спрямо несвития запис"""
+        return self.total_samples * self.num_leads * self.dtype.itemsize / max(1, self.file_size)
+
+    @classmethod
+    def encode_block(cls, data):
+        """(samples, leads) цели стойности -> bytes. Остатъкът на предиктора се записва с най-малката
+        достатъчна ширина, разделен по байтове (shuffle) - zlib свива по-добре старшите байтове"""
+        frames = len(data)
+        values = np.asarray(data, dtype=np.int64).T
+
+        best = None
+        residual = values
+        for order in range(1, max(cls.ORDERS) + 1):
+            residual = np.diff(residual, axis=1, prepend=0)
+            if order in cls.ORDERS:
+                cost = np.abs(residual[:, order:]).sum()
+                if best is None or cost < best[0]:
+                    best = (cost, order, residual)
+        _, order, residual = best
+
+        # Първите order стойности на всяко отвеждане (началото на предиктора) са в пълна ширина
+        head = np.ascontiguousarray(residual[:, :order], dtype='<i8')
+        body = residual[:, order:]
+        peak = int(np.abs(body).max()) if body.size else 0
+        width = next(w for w in (1, 2, 4, 8) if peak < 1 << (8 * w - 1))
+        shuffled = np.ascontiguousarray(body, dtype=f'<i{width}').view(np.uint8).reshape(-1, width).T
+
+        payload = zlib.compress(head.tobytes() + shuffled.tobytes(), cls.COMPRESS_LEVEL)
+        return cls.BLOCK_HEADER.pack(frames, order, width) + payload
+
+    def decode_block(self, index):
+        """Блок index като (frames, leads) масив с dtype на записа"""
+        buffer = self._bytes[self.offsets[index]:self.offsets[index + 1]]
+        frames, order, width = self.BLOCK_HEADER.unpack_from(buffer, 0)
+        raw = zlib.decompress(buffer[self.BLOCK_HEADER.size:])
+
+        leads = self.num_leads
+        warmup = min(order, frames)
+        head_bytes = leads * warmup * 8
+        residual = np.empty((leads, frames), dtype=np.int64)
+        residual[:, :warmup] = np.frombuffer(raw, dtype='<i8', count=leads * warmup).reshape(leads, warmup)
+        body = np.frombuffer(raw, dtype=np.uint8, offset=head_bytes).reshape(width, -1).T
+        residual[:, warmup:] = np.ascontiguousarray(body).view(f'<i{width}').reshape(leads, frames - warmup)
+
+        for _ in range(order):
+            np.cumsum(residual, axis=1, out=residual)
+        # Само за четене, като memmap-а - блокът се споделя през кеша
+        block = residual.T.astype(self.dtype)
+        block.flags.writeable = False
+        return block
+
+    def blocks(self, indices):
+        """Декодирани блокове за indices - от кеша или паралелно в нишки (zlib освобождава GIL)"""
+        with self._lock:
+            found = {i: self._cache[i] for i in indices if i in self._cache}
+            for i in found:
+                self._cache.move_to_end(i)
+        missing = [i for i in indices if i not in found]
+
+        if len(missing) > 1:
+            if self._pool is None:
+                workers = BackendDispatcher.shared().workers or os.cpu_count() or 1
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ecgz')
+            decoded = dict(zip(missing, self._pool.map(self.decode_block, missing)))
+        else:
+            decoded = {i: self.decode_block(i) for i in missing}
+
+        with self._lock:
+            for i, block in decoded.items():
+                self._cache[i] = block
+            while len(self._cache) > self.CACHE_BLOCKS:
+                self._cache.popitem(last=False)
+        found.update(decoded)
+        return found
+
+    def read(self, start, end, step=1):
+        """Кадрите start, start+step, ... < end като (n, leads) масив"""
+        if end <= start:
+            return np.zeros((0, self.num_leads), dtype=self.dtype)
+        first, last = start // self.block_frames, (end - 1) // self.block_frames
+
+        if step == 1:
+            blocks = self.blocks(list(range(first, last + 1)))
+            data = np.concatenate([blocks[i] for i in range(first, last + 1)]) if last > first else blocks[first]
+            offset = start - first * self.block_frames
+            return data[offset:offset + end - start]
+
+        # Прореден прочит - декодират се само блоковете, в които попада някоя позиция
+        positions = np.arange(start, end, step)
+        block_ids, bounds = np.unique(positions // self.block_frames, return_index=True)
+        block_ids = block_ids.tolist()
+        bounds = bounds.tolist() + [len(positions)]
+        blocks = self.blocks(block_ids)
+        out = np.empty((len(positions), self.num_leads), dtype=self.dtype)
+        for i, block_id in enumerate(block_ids):
+            lo, hi = bounds[i], bounds[i + 1]
+            out[lo:hi] = blocks[block_id][positions[lo:hi] - block_id * self.block_frames]
+        return out
+
+    @classmethod
+    def write(cls, filename, raw, metadata, block_frames, start=0, end=None, progress=None, workers=None):
+        """Поточно записва raw[start:end] като .ecgz - блоковете се кодират паралелно в нишки,
+        най-много 2 на нишка в движение, и се записват по ред"""
+        end = len(raw) if end is None else min(end, len(raw))
+        start = max(0, min(start, end))
+        block_frames = max(1, int(block_frames))
+        workers = max(1, workers or BackendDispatcher.shared().workers or os.cpu_count() or 1)
+
+        dtype = np.dtype(raw.dtype)
+        metadata = dict(metadata, format='ecgz', dtype=f'{dtype.kind}{dtype.itemsize}',
+                        num_samples=end - start, block_frames=block_frames, codec='zlib')
+        meta = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+
+        tracer = PerfTracer.shared()
+        offsets = []
+        with atomic_output(filename) as partial, open(partial, 'wb') as f, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(meta)) + meta)
+            pending = deque()
+
+            def flush_one():
+                block_end, future = pending.popleft()
+                offsets.append(f.tell())
+                f.write(future.result())
+                if progress is not None:
+                    progress((block_end - start) / max(1, end - start))
+
+            for block_start in range(start, end, block_frames):
+                block_end = min(block_start + block_frames, end)
+                with tracer.span('export.decode'):
+                    block = np.asarray(raw[block_start:block_end])
+                pending.append((block_end, executor.submit(cls.encode_block, block)))
+                if len(pending) >= 2 * workers:
+                    flush_one()
+            while pending:
+                flush_one()
+
+            index_offset = f.tell()
+            offsets.append(index_offset)
+            f.write(np.asarray(offsets, dtype='<u8').tobytes())
+            f.write(cls.TRAILER.pack(index_offset, len(offsets) - 1, cls.MAGIC))
+
+
+class ECGZArray:
+    """(samples, leads) изглед към част от ECGZContainer - като PackedInt24, декодира само
+    прочетените редове (точно блоковете, които ги съдържат)"""
+
+    ndim = 2
+
+    def __init__(self, container, offset, length):
+        self.container = container
+        self.offset = offset
+        self.length = length
+        self.dtype = container.dtype
+
+    @property
+    def shape(self):
+        return self.length, self.container.num_leads
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("ECGZArray поддържа само slice индексиране")
+        start, stop, step = key.indices(self.length)
+        if step < 1:
+            raise ValueError("ECGZArray поддържа само положителна стъпка")
+        return self.container.read(self.offset + start, self.offset + max(start, stop), step)
+
+    def crop(self, start, end):
+        """Изглед към [start, end) от този изглед - без декодиране"""
+        end = min(max(end, 0), self.length)
+        start = max(0, min(start, end))
+        return ECGZArray(self.container, self.offset + start, end - start)
+
+
+class ECGZLayout(FileLayout):
+    """Подредба на .ecgz контейнер - отвежданията, честотата и мащабът са в метаданните му,
+    а броят кадри не следва от размера на файла"""
+
+    def __init__(self, container):
+        metadata = container.metadata
+        super().__init__(0, container.num_leads, container.dtype.itemsize, '<', True,
+                         metadata.get('sampling_rate'), metadata.get('scale', 200.0))
+        self.container = container
+        self.lead_names = metadata.get('lead_names')
+
+    def total_samples(self, file_size):
+        return self.container.total_samples
+
+    def fits(self, file_size):
+        return True
+
+    def memmap(self, filename, total_samples):
+        return self.container.array(0, total_samples)
+
+    def describe(self):
+        return (f"ECGZ, {self.num_leads} отв., int{self.sample_width * 8}, "
+                f"компресия {self.container.ratio:.1f}x")
+
+
+class FormatDetector:
+    """Разпознава подредбата на файла по статистики на няколко малки проби (начало, среда, край).
+
+    Всеки кандидат (header, отвеждания, ширина, byte order, interleaved/blocked) се оценява
+    векторно: истинската подредба дава гладък сигнал (малки разлики между съседни семпли
+    спрямо разсейването) и корелирани съседни отвеждания."""
+
+    HEADER_SIZES = (0, 64, 128, 256, 512, 1024)
+    LEAD_COUNTS = (1, 2, 3, 4, 5, 6, 8, 12, 15, 16)
+    SAMPLE_WIDTHS = (2, 3, 4)
+    PROBE_FRAMES = 1024
+    HEAD_FRAMES = 32
+    BOUNDARY_FRAMES = 32
+    # Скок между съседни семпли, по-голям от толкова типични стъпки - граница между отвеждания
+    JUMP_RATIO = 4.0
+    # Относителна разлика в оценката, под която кандидатите се считат равни - тогава се
+    # избира по-простата подредба (напр. един канал, прочетен като N отвеждания, е почти
+    # толкова гладък, колкото истинския)
+    TIE_TOLERANCE = 0.25
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file_size = os.path.getsize(filename)
+        self._reads = {}
+
+    def _read(self, offset, length):
+        key = (offset, length)
+        if key not in self._reads:
+            with open(self.filename, 'rb') as f:
+                f.seek(offset)
+                self._reads[key] = f.read(length)
+        return self._reads[key]
+
+    def _probes(self, layout):
+        """Три проби (frames, leads) като int32 - начало, среда, край на данните"""
+        samples = layout.total_samples(self.file_size)
+        count = min(self.PROBE_FRAMES, samples)
+        starts = sorted({0, max(0, samples // 2 - count // 2), samples - count})
+        probes = []
+        for start in starts:
+            if layout.interleaved:
+                buffer = self._read(layout.header_size + start * layout.frame_bytes,
+                                    count * layout.frame_bytes)
+                probes.append(layout.decode(buffer).reshape(count, layout.num_leads))
+            else:
+                columns = [layout.decode(self._read(
+                    layout.header_size + (lead * samples + start) * layout.sample_width,
+                    count * layout.sample_width)) for lead in range(layout.num_leads)]
+                probes.append(np.stack(columns, axis=1))
+        return probes
+
+    @staticmethod
+    def _roughness(x):
+        """std на първата разлика / std на сигнала по отвеждания; NaN за плоски отвеждания"""
+        spread = x.std(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(spread > 0, np.diff(x, axis=0).std(axis=0) / spread, np.nan)
+
+    def _boundary_penalty(self, layout):
+        """За последователни отвеждания - границите между тях трябва да са скокове,
+        а средата на всяко отвеждане - непрекъсната (иначе броят отвеждания е грешен)"""
+        samples = layout.total_samples(self.file_size)
+        half = self.BOUNDARY_FRAMES // 2
+        if samples < 4 * half:
+            return 0.0
+
+        def jump(position):
+            x = layout.decode(self._read(layout.header_size + (position - half) * layout.sample_width,
+                                         2 * half * layout.sample_width)).astype(np.float64)
+            steps = np.abs(np.diff(x))
+            typical = np.median(np.delete(steps, half - 1)) + 1
+            return steps[half - 1] / typical > self.JUMP_RATIO
+
+        boundaries = [jump(lead * samples) for lead in range(1, layout.num_leads)]
+        middles = [jump(lead * samples + samples // 2) for lead in range(layout.num_leads)]
+        continuous = 1 - np.mean(boundaries) if boundaries else 0.0
+        return 0.5 * continuous + 0.5 * float(np.mean(middles))
+
+    def _head_anomaly(self, probe):
+        """Дял от първите кадри далеч извън разсейването на пробата - остатък от header-а"""
+        head = probe[:self.HEAD_FRAMES]
+        body = probe[self.HEAD_FRAMES:]
+        if len(body) <= self.HEAD_FRAMES:
+            return 0.0
+        center = np.median(body, axis=0)
+        spread = np.median(np.abs(body - center), axis=0) + 1
+        return float(np.mean(np.any(np.abs(head - center) > 20 * spread, axis=1)))
+
+    def _padding(self, layout, start, end):
+        """Стойностите в байтовете [start, end) са константни по отвеждания (напр. нулев header) -
+        запълване, а не сигнал. Константните кадри нямат аномалия спрямо медианата на пробата"""
+        values = layout.decode(self._read(start, end - start))
+        if layout.interleaved:
+            values = values.reshape(-1, layout.num_leads)
+        else:
+            values = values.reshape(-1, 1)
+        return len(values) > 0 and bool(np.all(np.ptp(values, axis=0) == 0))
+
+    def score(self, layout):
+        """По-ниска оценка - по-вероятна подредба. Връща (оценка, аномалия в началото)"""
+        probes = [probe.astype(np.float64) for probe in self._probes(layout)]
+        data = np.concatenate(probes)
+        roughness = np.concatenate([self._roughness(probe) for probe in probes])
+        if np.all(np.isnan(roughness)):
+            return np.inf, 1.0
+        score = np.nanmedian(roughness)
+
+        # Отвеждания само със знаковите битове - широка стойност, прочетена като две тесни
+        ptp = np.ptp(data, axis=0)
+        score += 0.5 * np.mean((ptp > 0) & (ptp <= 2))
+
+        # Долните 16 бита са гладък сигнал, а горните варират - всъщност са две int16 стойности
+        if layout.sample_width == 4:
+            low = (data.astype(np.int64) & 0xFFFF).astype(np.uint16).view(np.int16).astype(np.float64)
+            high_ptp = np.ptp(np.floor_divide(data, 65536), axis=0)
+            split = (np.nan_to_num(self._roughness(low), nan=2.0) < 2 * score) & (high_ptp > 2)
+            score += 0.5 * np.mean(split)
+
+        if not layout.interleaved or layout.num_leads == 1:
+            score += self._boundary_penalty(layout)
+        else:
+            # Един поток, прочетен като N колони, е по-гладък без разделянето на колони
+            flat = np.nanmedian([self._roughness(probe.reshape(-1, 1))[0] for probe in probes])
+            if flat < score:
+                score += 0.5
+
+        head_anomaly = self._head_anomaly(probes[0])
+        score += 0.5 * head_anomaly
+
+        if layout.num_leads > 1:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                adjacent = np.diagonal(np.corrcoef(data, rowvar=False), offset=1)
+            adjacent = adjacent[np.isfinite(adjacent)]
+            if len(adjacent):
+                score -= 0.05 * np.mean(np.abs(adjacent))
+        return float(score), head_anomaly
+
+    def candidates(self):
+        for header_size in self.HEADER_SIZES:
+            for num_leads in self.LEAD_COUNTS:
+                for sample_width in self.SAMPLE_WIDTHS:
+                    for byteorder in ('<', '>'):
+                        for interleaved in ((True,) if num_leads == 1 else (True, False)):
+                            layout = FileLayout(header_size, num_leads, sample_width,
+                                                byteorder, interleaved)
+                            if layout.fits(self.file_size) and \
+                                    layout.total_samples(self.file_size) >= 2 * self.HEAD_FRAMES:
+                                yield layout
+
+    def detect(self):
+        """Връща (FileLayout, увереност 0..1) или (None, 0), ако нито един кандидат не пасва"""
+        # Header-и, различаващи се с цял брой кадри, дават същите данни с отместване -
+        # по-големият се разглежда само ако началото на по-малкия изглежда като header.
+        # Константни кадри (нулев header) нямат аномалия - тогава по-големият header ги пропуска
+        clean_headers = {}
+        scored = []
+        for layout in self.candidates():
+            group = (layout.num_leads, layout.sample_width, layout.byteorder, layout.interleaved,
+                     layout.header_size % layout.frame_bytes)
+            clean = clean_headers.get(group)
+            if clean is not None and not self._padding(layout, scored[clean][1].header_size, layout.header_size):
+                continue
+            score, head_anomaly = self.score(layout)
+            if not np.isfinite(score):
+                continue
+            if clean is not None:
+                scored[clean] = (score, layout)
+                continue
+            if head_anomaly == 0:
+                clean_headers[group] = len(scored)
+            scored.append((score, layout))
+        if not scored:
+            return None, 0.0
+
+        scored.sort(key=lambda item: item[0])
+        best_score = scored[0][0]
+        tolerance = self.TIE_TOLERANCE * max(abs(best_score), 0.01)
+        tied = [layout for score, layout in scored if score <= best_score + tolerance]
+
+        # При равенство - interleaved с най-малко отвеждания, най-тясна стойност, най-малък header.
+        # При blocked всички потвърдени граници са реални - печели най-големият брой отвеждания
+        best = min(tied, key=lambda layout: (not layout.interleaved,
+                                             layout.num_leads if layout.interleaved else -layout.num_leads,
+                                             layout.sample_width, layout.header_size))
+
+        # Увереност - колко по-лош е най-добрият кандидат извън равните
+        others = [score for score, layout in scored if score > best_score + tolerance]
+        if not others:
+            return best, 0.0
+        confidence = float(np.clip(1 - max(best_score, 0.01) / max(others[0], 0.01), 0, 1))
+        return best, confidence
+
+
+class FormatProfiles:
+    """Именувани потвърдени формати - файлове от същото устройство пропускат разпознаването"""
+
+    DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.ecg_viewer_formats.json')
+    MAGIC_BYTES = 16
+
+    def __init__(self, path=None):
+        self.path = path or self.DEFAULT_PATH
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, profiles):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=directory, suffix='.partial')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(profiles, f, ensure_ascii=False, indent=2)
+        os.replace(partial, self.path)
+
+    @classmethod
+    def _magic(cls, filename, header_size):
+        """Началото на header-а - същото устройство обикновено пише еднакви първи байтове"""
+        if header_size <= 0:
+            return ''
+        with open(filename, 'rb') as f:
+            return f.read(min(header_size, cls.MAGIC_BYTES)).hex()
+
+    def match(self, filename):
+        """Най-скоро използваният профил, който пасва на файла - (име, FileLayout) или None"""
+        extension = os.path.splitext(filename)[1].lower()
+        file_size = os.path.getsize(filename)
+        profiles = sorted(self.load().items(), key=lambda item: item[1].get('last_used', 0), reverse=True)
+        for name, profile in profiles:
+            layout = FileLayout.from_dict(profile['layout'])
+            if profile.get('extension', extension) != extension or not layout.fits(file_size):
+                continue
+            if profile.get('magic') and profile['magic'] != self._magic(filename, layout.header_size):
+                continue
+            profile['last_used'] = time.time()
+            try:
+                self._write(dict(profiles))
+            except OSError as e:
+                print(f"Format profile update failed: {e}")
+            return name, layout
+        return None
+
+    def save(self, name, filename, layout):
+        profiles = self.load()
+        profiles[name] = {
+            'layout': layout.to_dict(),
+            'extension': os.path.splitext(filename)[1].lower(),
+            'magic': self._magic(filename, layout.header_size),
+            'last_used': time.time(),
+        }
+        self._write(profiles)
+
+
+class TransformStage:
+    """Стъпка от TransformPipeline - преобразува (samples, leads) float32 прозорец, започващ от start.
+    pad - семпли контекст от всяка страна, нужни на стъпката (напр. за филтър)"""
+
+    pad = 0
+
+    def key(self):
+        return (type(self).__name__,)
+
+    def apply(self, data, start, recording):
+        raise NotImplementedError
+
+
+class BaselineStage(TransformStage):
+    """Изважда baseline-а на записа"""
+
+    def apply(self, data, start, recording):
+        data -= recording.baseline.evaluate(start, start + len(data))
+        return data
+
+
+class ScaleStage(TransformStage):
+    """Умножение по константа - мащаб на файла (стойности към mV) или gain на изгледа"""
+
+    def __init__(self, factor):
+        self.factor = float(factor)
+
+    def key(self):
+        return ('scale', self.factor)
+
+    def apply(self, data, start, recording):
+        data *= np.float32(self.factor)
+        return data
+
+
+class FilterStage(TransformStage):
+    """Филтриране с контекст от pad семпли - filter_func(data) -> data, key идентифицира филтъра"""
+
+    def __init__(self, filter_func, pad, key=None):
+        self.filter_func = filter_func
+        self.pad = pad
+        self.filter_key = key
+
+    def key(self):
+        return ('filter', self.filter_key)
+
+    def apply(self, data, start, recording):
+        return self.filter_func(data)
+
+
+class TransformPipeline:
+    """Верига от преобразувания върху int източника, изчислявана само за четения прозорец.
+    Смяна на gain или филтър е нова верига - O(1), без копие на записа"""
+
+    def __init__(self, stages=()):
+        self.stages = tuple(stages)
+
+    def then(self, *stages):
+        return TransformPipeline(self.stages + stages)
+
+    @property
+    def pad(self):
+        return max((stage.pad for stage in self.stages), default=0)
+
+    def key(self):
+        """Ключ за кеширане на резултата - еднакви вериги дават еднакви прозорци"""
+        return tuple(stage.key() for stage in self.stages)
+
+    def evaluate(self, recording, start, end):
+        """float32 прозорец [start, end) - източникът се чете с контекста, нужен на стъпките"""
+        pad = self.pad
+        padded_start = max(0, start - pad)
+        padded_end = min(len(recording), end + pad)
+        stages = self.stages
+        with PerfTracer.shared().span('slice'):
+            raw = recording.raw[padded_start:padded_end]
+
+            # Baseline и следващите мащабирания се изпълняват наведнъж от decode ядрото
+            if stages and isinstance(stages[0], BaselineStage):
+                factor = 1.0
+                fused = 1
+                while fused < len(stages) and isinstance(stages[fused], ScaleStage):
+                    factor *= stages[fused].factor
+                    fused += 1
+                backend = BackendDispatcher.shared().select('decode', len(raw))
+                data = backend.decode(raw, recording.baseline.evaluate(padded_start, padded_start + len(raw)),
+                                      factor)
+                stages = stages[fused:]
+            else:
+                data = np.asarray(raw, dtype=np.float32).copy()
+
+        for stage in stages:
+            data = stage.apply(data, padded_start, recording)
+
+        offset = start - padded_start
+        return data[offset:offset + max(0, min(end, len(recording)) - start)]
+
+
+class ECGRecording:
+    """Memory-mapped ECG запис - (samples, leads) изглед без копиране според FileLayout"""
+
+    # Производни данни, които могат да се освободят и изчислят отново
+    ARTIFACTS = ('decoded', 'filtered', 'pyramid', 'stats', 'beats')
+
+    def __init__(self, filename, num_leads, header_size=0, start_sample=0, end_sample=None,
+                 scale=200.0, layout=None):
+        if layout is None:
+            layout = FileLayout(header_size, num_leads, scale=scale)
+        if not isinstance(layout, ECGZLayout) and ECGZContainer.is_container(filename):
+            # Подредбата на контейнера е в метаданните му - подадената е за raw файлове
+            layout = ECGZContainer(filename).layout()
+        self.filename = filename
+        self.layout = layout
+        self.num_leads = layout.num_leads
+        self.header_size = layout.header_size
+        self.scale = layout.scale
+        self.gain = 1.0
+        self.baseline = BlockBaseline.constant(np.zeros(self.num_leads, dtype=np.float32))
+        self.filtered_cache = None
+        self.pyramid = None
+        self.stats = None
+        self.beats = None
+        self.sidecar_key = None
+
+        # Брой цели кадри (по едно измерване за всяко отвеждане) след header-а
+        self.total_samples = layout.total_samples(os.path.getsize(filename))
+
+        if self.total_samples > 0:
+            full_data = layout.memmap(filename, self.total_samples)
+        else:
+            full_data = np.zeros((0, self.num_leads), dtype=np.int16)
+
+        self.start_sample = min(max(0, start_sample), self.total_samples)
+        if end_sample is None:
+            self.end_sample = self.total_samples
+        else:
+            self.end_sample = min(max(end_sample, self.start_sample), self.total_samples)
+
+        # Изглед към избрания диапазон - без копиране (от контейнер - без декодиране)
+        if isinstance(full_data, ECGZArray):
+            self.raw = full_data.crop(self.start_sample, self.end_sample)
+        else:
+            self.raw = full_data[self.start_sample:self.end_sample]
+
+    def __len__(self):
+        return len(self.raw)
+
+    def refresh(self):
+        """Преоткрива memmap-а след дописване във файла - само цели кадри и само ако зареденият
+        диапазон стига до края. Връща броя нови кадри"""
+        total = self.layout.total_samples(os.path.getsize(self.filename))
+        if total <= self.total_samples or self.end_sample < self.total_samples:
+            return 0
+
+        old_end = self.end_sample
+        self.raw = self.layout.memmap(self.filename, total)[self.start_sample:total]
+        self.total_samples = total
+        self.end_sample = total
+        return total - old_end
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("ECGRecording поддържа само slice индексиране")
+        start, stop, step = key.indices(len(self.raw))
+        return self.window(start, stop)[::step]
+
+    def strided(self, start, end, step, gain=None):
+        """Всеки step-ти семпъл от [start, end) - груб преглед без четене на целия прозорец"""
+        if gain is None:
+            gain = self.gain
+        data = self.raw[start:end:step].astype(np.float32)
+        data -= self.baseline.evaluate_at(np.arange(start, end, step)[:len(data)])
+        data *= gain / self.scale
+        return data
+
+    def transforms(self, gain=None):
+        """Верига baseline -> scale -> gain; останалите стъпки (филтър) се добавят с then()"""
+        if gain is None:
+            gain = self.gain
+        stages = [BaselineStage(), ScaleStage(1.0 / self.scale)]
+        if gain != 1.0:
+            stages.append(ScaleStage(gain))
+        return TransformPipeline(stages)
+
+    def window(self, start, end, gain=None):
+        """Връща float32 копие само на прозореца [start, end)"""
+        return self.transforms(gain).evaluate(self, start, end)
+
+    def release_caches(self):
+        """Освобождава производните данни (филтриран кеш)"""
+        if self.filtered_cache is not None:
+            self.filtered_cache.close()
+            self.filtered_cache = None
+
+    def release_pyramid(self):
+        if self.pyramid is not None:
+            self.pyramid.cancel()
+            self.pyramid = None
+
+    def release_stats(self):
+        if self.stats is not None:
+            self.stats.cancel()
+            self.stats = None
+
+    def release_beats(self):
+        self.beats = None
+
+    def release_decoded(self):
+        """Изчиства кеша с декодирани блокове на .ecgz контейнер"""
+        if isinstance(self.raw, ECGZArray):
+            self.raw.container.clear_cache()
+
+    def release(self, artifact):
+        {
+            'decoded': self.release_decoded,
+            'filtered': self.release_caches,
+            'pyramid': self.release_pyramid,
+            'stats': self.release_stats,
+            'beats': self.release_beats,
+        }[artifact]()
+
+    def close(self):
+        for artifact in self.ARTIFACTS:
+            self.release(artifact)
+
+    def building(self, artifact):
+        """Дали артефактът се строи в момента - освобождаването му би прекъснало изграждането"""
+        target = {'filtered': self.filtered_cache, 'pyramid': self.pyramid, 'stats': self.stats}.get(artifact)
+        return target is not None and not target.ready
+
+    def memory_usage(self):
+        """Байтове в паметта по производни данни (без самия memory-mapped запис)"""
+        return {
+            'baseline': self.baseline.nbytes,
+            'decoded': self.raw.container.nbytes if isinstance(self.raw, ECGZArray) else 0,
+            'filtered': self.filtered_cache.nbytes if self.filtered_cache is not None else 0,
+            'pyramid': self.pyramid.nbytes if self.pyramid is not None else 0,
+            'stats': self.stats.nbytes if self.stats is not None else 0,
+            'beats': self.beats.nbytes if self.beats is not None else 0,
+        }
+
+
+class ECGProcessor:
+    """Стъпките на обработката с общите настройки - baseline, филтриране, heart rate, прозорци.
+    Backend-ът за всяка стъпка се избира от BackendDispatcher според размера на данните"""
+
+    def __init__(self, sampling_rate, band=(0.5, 40.0), notch_freq=50.0, notch_q=30.0, use_gpu=False,
+                 dispatcher=None):
+        self.sampling_rate = sampling_rate
+        self.band = band
+        self.notch_freq = notch_freq
+        self.notch_q = notch_q
+        self.use_gpu = use_gpu
+        self.dispatcher = dispatcher or BackendDispatcher.shared()
+
+    def filter_bank(self):
+        """Кеширан филтър за текущите параметри"""
+        return FilterBank.get(self.sampling_rate, self.band, self.notch_freq, self.notch_q)
+
+    def backend(self, kernel, size, use_gpu=None):
+        """Най-бързият наличен backend за ядрото при size кадъра"""
+        return self.dispatcher.select(kernel, size, self.use_gpu if use_gpu is None else use_gpu)
+
+    def _baseline_median(self, use_gpu):
+        """Медиани на блоковете за BlockBaseline. При числена грешка на GPU останалите блокове
+        се смятат на CPU; грешка на CPU backend се предава нагоре"""
+        def median(blocks):
+            nonlocal use_gpu
+            backend = self.backend('baseline', blocks.shape[0] * blocks.shape[1], use_gpu)
+            try:
+                return backend.median(blocks, axis=1)
+            except NUMERIC_ERRORS as e:
+                if backend.name != 'cupy':
+                    raise
+                print(f"GPU baseline failed: {e}, falling back to CPU")
+                use_gpu = False
+                return self.backend('baseline', blocks.shape[0] * blocks.shape[1], use_gpu).median(blocks, axis=1)
+        return median
+
+    def estimate_baseline(self, data, progress=None, use_gpu=None):
+        """Baseline по блокове - медианите на GPU, ако е активирано и по-бързо"""
+        block_size = int(BlockBaseline.BLOCK_SEC * self.sampling_rate)
+        with PerfTracer.shared().span('baseline'):
+            return BlockBaseline.estimate(data, block_size, median=self._baseline_median(use_gpu),
+                                          progress=progress)
+
+    def workers(self):
+        """Брой нишки за CPU изчисленията (BackendDispatcher.workers или всички ядра)"""
+        return self.dispatcher.workers or os.cpu_count() or 1
+
+    def extend_baseline(self, baseline, data, use_gpu=None):
+        """Baseline за дописан запис - само последният блок и новите"""
+        block_size = int(BlockBaseline.BLOCK_SEC * self.sampling_rate)
+        with PerfTracer.shared().span('live.baseline'):
+            return baseline.extended(data, block_size, self._baseline_median(use_gpu))
+
+    def filter(self, data, use_gpu=None):
+        """Филтрира ECG сигнал с GPU или CPU.
+        Дълги масиви на CPU се филтрират на части като FilteredCache - резултатът не зависи от броя нишки"""
+        with PerfTracer.shared().span('filter'):
+            return self._filter(data, use_gpu)
+
+    def _filter(self, data, use_gpu):
+        backend = self.backend('filter', len(data), use_gpu)
+        chunk_size = int(FilteredCache.CHUNK_SEC * self.sampling_rate)
+        try:
+            if backend.name != 'cupy' and len(data) > 2 * chunk_size:
+                result = np.empty(data.shape, dtype=np.result_type(data.dtype, np.float32))
+
+                def write(start, end, filtered):
+                    result[start:end] = filtered
+
+                runner = ChunkedFilter(self.filter_bank(), chunk_size, FilteredCache.pad_samples(self.sampling_rate),
+                                       self.workers())
+                runner.run(lambda start, end: data[start:end], write, len(data))
+                return result
+            return self.filter_bank().apply(data, backend)
+        except Exception as e:
+            if backend.name != 'cupy':
+                raise
+            print(f"GPU filtering failed: {e}, falling back to CPU")
+            return self.filter_bank().apply(data)
+
+    def segment(self, recording, start_sample, end_sample, filter_on, gain, use_gpu=None):
+        """Прозорец от данните - от кеша, ако е готов, иначе филтриран с padding от съседните семпли"""
+        if not filter_on or end_sample - start_sample <= 100:
+            return recording.window(start_sample, end_sample, gain)
+
+        cache = recording.filtered_cache
+        if (cache is not None and cache.ready and cache.matches(self.filter_bank())
+                and cache.covers(start_sample, end_sample)):
+            with PerfTracer.shared().span('slice'):
+                return cache.segment(start_sample, end_sample, gain)
+
+        # Филтърът получава padding от съседните семпли - веригата чете само този диапазон
+        pipeline = recording.transforms(gain).then(
+            FilterStage(lambda data: self.filter(data, use_gpu), FilteredCache.pad_samples(self.sampling_rate),
+                        self.filter_bank().key))
+        try:
+            return pipeline.evaluate(recording, start_sample, end_sample)
+        except NUMERIC_ERRORS as e:
+            print(f"Window filtering failed: {e}, showing unfiltered data")
+            return recording.window(start_sample, end_sample, gain)
+
+    def heart_rate(self, data_segment, is_filtered, use_gpu=None):
+        """Изчислява heart rate"""
+        with PerfTracer.shared().span('heart_rate'):
+            return self._heart_rate(data_segment, is_filtered, use_gpu)
+
+    def _heart_rate(self, data_segment, is_filtered, use_gpu):
+        try:
+            # Използваме Lead II ако съществува, иначе първото отвеждане
+            lead_idx = min(1, data_segment.shape[1] - 1)
+            lead_data = data_segment[:, lead_idx]
+
+            if not is_filtered:
+                lead_filtered = self.filter(data_segment, use_gpu)[:, lead_idx]
+            else:
+                lead_filtered = lead_data
+
+            threshold = np.std(lead_filtered) * 0.6
+            min_distance = int(0.4 * self.sampling_rate)
+
+            peaks = self.backend('peaks', len(lead_filtered), use_gpu).find_peaks(
+                lead_filtered, threshold, min_distance)
+
+            if len(peaks) > 1:
+                rr_intervals = np.diff(peaks) / self.sampling_rate
+                mean_rr = np.mean(rr_intervals)
+                heart_rate = 60.0 / mean_rr
+
+                return int(heart_rate)
+            else:
+                return None
+        except NUMERIC_ERRORS as e:
+            print(f"Heart rate estimation failed: {e}")
+            return None
+
+
+class LiveTail:
+    """Следене на запис, в който още се пише. poll() обработва само дописаните цели кадри -
+    baseline, каузално филтриран буфер за изгледа (sosfilt със запазено състояние), удари и
+    min/max пирамида. Цената на обновяване зависи от новите данни, не от размера на файла"""
+
+    # Филтриран буфер в края на записа, от който се рисува изгледът
+    TAIL_SEC = 120.0
+    # Максимален блок при наваксване (напр. след дълга пауза)
+    CHUNK_SEC = 60.0
+
+    def __init__(self, recording, processor):
+        if not recording.layout.interleaved:
+            raise ValueError("Следенето изисква interleaved подредба - при blocked отвежданията не растат в края")
+        self.recording = recording
+        self.processor = processor
+        self.sampling_rate = processor.sampling_rate
+        self.filter = StreamingFilter(processor.filter_bank())
+        self.detector = BeatDetector(self.sampling_rate)
+        self.capacity = int(self.TAIL_SEC * self.sampling_rate)
+        self.chunk = max(1, int(self.CHUNK_SEC * self.sampling_rate))
+
+        # Ударите след beats_final се откриват наново - близо до края им липсва контекст
+        self._beats = None
+        self.beats_final = 0
+        self.recent_amplitudes = np.zeros(0, dtype=np.float32)
+
+        # Състоянието на филтъра се загрява върху последните TAIL_SEC от наличните данни.
+        # tail е (начало, масив) - подменя се наведнъж, защото се чете и от други нишки
+        end = len(recording)
+        tail_start = max(0, end - self.capacity)
+        self.tail = (tail_start, self.filter.process(recording.window(tail_start, end, gain=1.0)))
+
+    def poll(self):
+        """Обработва дописаните кадри - връща (old_end, new_end) или None, ако файлът не е растял"""
+        recording = self.recording
+        old_end = len(recording)
+        if recording.refresh() == 0:
+            return None
+        new_end = len(recording)
+        tracer = PerfTracer.shared()
+
+        # Последният блок на baseline-а се преизчислява, а интерполацията към него започва
+        # от центъра на предходния - пирамидата се обновява оттам
+        positions = recording.baseline.positions
+        changed_from = min(old_end, int(positions[-2])) if len(positions) > 1 else 0
+        recording.baseline = self.processor.extend_baseline(recording.baseline, recording.raw)
+
+        with tracer.span('live.filter'):
+            for start in range(old_end, new_end, self.chunk):
+                end = min(start + self.chunk, new_end)
+                self._append_tail(self.filter.process(recording.window(start, end, gain=1.0)))
+
+        if recording.beats is not None:
+            with tracer.span('live.beats'):
+                recording.beats = self._extend_beats(recording.beats, new_end)
+
+        pyramid = recording.pyramid
+        if pyramid is not None and pyramid.ready:
+            with tracer.span('live.pyramid'):
+                pyramid.extend(recording, changed_from)
+
+        stats = recording.stats
+        if stats is not None and stats.ready:
+            with tracer.span('live.stats'):
+                stats.extend(recording, changed_from)
+
+        return old_end, new_end
+
+    def _append_tail(self, filtered):
+        tail_start, tail = self.tail
+        tail = np.concatenate([tail, filtered])
+        drop = max(0, len(tail) - self.capacity)
+        self.tail = (tail_start + drop, tail[drop:])
+
+    def _extend_beats(self, beats, new_end):
+        if beats is not self._beats:
+            # Таблица от пълната детекция - продължава се след последния ѝ удар
+            self.beats_final = int(beats.samples[-1]) + 1 if len(beats) else 0
+
+        samples, leads, amplitudes = self.detector.detect_range(self.recording, self.beats_final, new_end)
+        beats = self.detector.extend_table(beats.truncate(self.beats_final), samples, leads, amplitudes,
+                                           self.recent_amplitudes)
+        self.recent_amplitudes = np.concatenate([self.recent_amplitudes, amplitudes])[-self.detector.REFERENCE_BEATS:]
+        self.beats_final = max(self.beats_final, new_end - int(self.detector.PAD_SEC * self.sampling_rate))
+        self._beats = beats
+        return beats
+
+    def segment(self, start, end, gain=1.0):
+        """Филтриран прозорец от буфера в края или None, ако не е изцяло в него"""
+        tail_start, tail = self.tail
+        if start < tail_start or end > tail_start + len(tail):
+            return None
+        return tail[start - tail_start:end - tail_start] * np.float32(gain)
+
+
+class RecordingSession:
+    """Отворен запис в SessionManager - записът, състоянието на изгледа (пази го GUI-то) и
+    кога е ползван всеки артефакт. extra - допълнителни артефакти с nbytes и clear() (напр. кеш на прозорци)"""
+
+    def __init__(self, key, recording, name=None):
+        self.key = key
+        self.recording = recording
+        self.name = name or os.path.basename(recording.filename)
+        self.opened = time.monotonic()
+        self.view = {}
+        self.extra = {}
+        self._last_used = {}
+
+    def artifacts(self):
+        return ECGRecording.ARTIFACTS + tuple(self.extra)
+
+    def usage(self):
+        usage = self.recording.memory_usage()
+        for name, artifact in self.extra.items():
+            usage[name] = artifact.nbytes
+        return usage
+
+    def touch(self, *artifacts):
+        """Отбелязва използване - без аргументи всички артефакти (при активиране на записа)"""
+        now = time.monotonic()
+        for artifact in artifacts or self.artifacts():
+            self._last_used[artifact] = now
+
+    def last_used(self, artifact):
+        return self._last_used.get(artifact, 0.0)
+
+    def building(self, artifact):
+        return artifact not in self.extra and self.recording.building(artifact)
+
+    def release(self, artifact):
+        if artifact in self.extra:
+            self.extra[artifact].clear()
+        else:
+            self.recording.release(artifact)
+
+    def close(self):
+        for artifact in self.extra.values():
+            artifact.clear()
+        self.recording.close()
+
+
+class SessionManager:
+    """Няколко отворени записа с общ бюджет за паметта на производните им данни. При превишаване
+    се освобождават най-отдавна ползваните артефакти - първо на неактивните записи, накрая кешовете на
+    активния, които се попълват при четене. Производните данни на активния запис не се освобождават -
+    изгледът има нужда от тях веднага. Освободеното на неактивните се изчислява отново (или се зарежда
+    от дисковия кеш) при активиране"""
+
+    DEFAULT_LIMIT = 1 << 30
+    MAX_SESSIONS = 8
+    # При еднакво време на ползване - първо по-евтините за възстановяване
+    EVICTION_ORDER = ('windows', 'decoded', 'filtered', 'pyramid', 'stats', 'beats')
+    # Артефакти на активния запис, които остават в паметта и над лимита - освободени, те веднага
+    # биха се построили отново, а при твърде малък лимит това би се повтаряло безкрайно
+    ACTIVE_PINNED = ('filtered', 'pyramid', 'stats', 'beats')
+
+    def __init__(self, memory_limit=DEFAULT_LIMIT, max_sessions=MAX_SESSIONS):
+        self.memory_limit = memory_limit
+        self.max_sessions = max_sessions
+        # Байтове над лимита след последното enforce() - активният запис сам не се събира в лимита
+        self.over_limit = 0
+        # Подредени от най-отдавна до последно активирания
+        self.sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, key):
+        return key in self.sessions
+
+    def get(self, key):
+        return self.sessions.get(key)
+
+    @property
+    def active(self):
+        return next(reversed(self.sessions.values())) if self.sessions else None
+
+    def open(self, session):
+        """Добавя и активира запис; затваря записа със същия ключ и най-старите над max_sessions.
+        Връща затворените"""
+        closed = []
+        if session.key in self.sessions:
+            closed.append(self.close(session.key))
+        self.sessions[session.key] = session
+        self.activate(session.key)
+        while len(self.sessions) > self.max_sessions:
+            closed.append(self.close(next(iter(self.sessions))))
+        return closed
+
+    def activate(self, key):
+        session = self.sessions[key]
+        self.sessions.move_to_end(key)
+        session.touch()
+        return session
+
+    def close(self, key):
+        session = self.sessions.pop(key)
+        session.close()
+        return session
+
+    def usage(self):
+        return {key: session.usage() for key, session in self.sessions.items()}
+
+    def total_bytes(self):
+        return sum(sum(usage.values()) for usage in self.usage().values())
+
+    def enforce(self):
+        """Освобождава артефакти, докато общата памет е под лимита. Връща [(сесия, артефакт)];
+        ако и след това е над лимита, разликата е в over_limit"""
+        active = self.active
+        candidates = []
+        for session in self.sessions.values():
+            usage = session.usage()
+            for artifact in session.artifacts():
+                if session is active and (artifact in self.ACTIVE_PINNED or session.building(artifact)):
+                    continue
+                if usage.get(artifact, 0) > 0:
+                    order = self.EVICTION_ORDER.index(artifact) if artifact in self.EVICTION_ORDER else 0
+                    candidates.append((session is active, session.last_used(artifact), order,
+                                       usage[artifact], session, artifact))
+        candidates.sort(key=lambda candidate: candidate[:3])
+
+        total = self.total_bytes()
+        evicted = []
+        for *_, size, session, artifact in candidates:
+            if total <= self.memory_limit:
+                break
+            session.release(artifact)
+            total -= size
+            evicted.append((session, artifact))
+        self.over_limit = max(0, total - self.memory_limit)
+        return evicted
+
+
+def default_lead_names(num_leads):
+    """Стандартни имена на отвежданията за даден брой"""
+    if num_leads == 12:
+        return ['I', 'II', 'III', 'aVR', 'aVL', 'aVF',
+                'V1', 'V2', 'V3', 'V4', 'V5', 'V6']
+    elif num_leads == 3:
+        return ['I', 'II', 'III']
+    elif num_leads == 5:
+        return ['I', 'II', 'III', 'aVR', 'aVL']
+    return [f'Ch{i + 1}' for i in range(num_leads)]
+
+
+EXPORT_EXTENSIONS = {'csv': '.csv', 'npy': '.npy', 'hdf5': '.h5', 'edf': '.edf', 'ecgz': '.ecgz'}
+
+
+def process_file(filename, layout=None, sampling_rate=None, export=None, output_dir=None,
+                 heart_rate=False, use_gpu=False, profiles=None, threads=None):
+    """Обработва един файл без GUI - формат, baseline, удари, експорт.
+    Връща речник с резултатите и времената (s) по стъпки"""
+    timings = {}
+    step_start = time.perf_counter()
+
+    # Подредбата на .ecgz е в метаданните му - подадената (напр. --leads) е за raw файлове
+    if ECGZContainer.is_container(filename):
+        layout = ECGZContainer(filename).layout()
+    if layout is None:
+        matched = (profiles or FormatProfiles()).match(filename)
+        if matched is not None:
+            layout = matched[1]
+        else:
+            layout, _ = FormatDetector(filename).detect()
+            if layout is None:
+                raise ValueError(f"Неразпознат формат: {filename}")
+    sampling_rate = sampling_rate or layout.sampling_rate or 1000
+
+    recording = ECGRecording(filename, layout.num_leads, layout=layout)
+    timings['open'] = time.perf_counter() - step_start
+
+    step_start = time.perf_counter()
+    BackendDispatcher.shared().use_gpu = use_gpu
+    if threads:
+        BackendDispatcher.shared().workers = threads
+    processor = ECGProcessor(sampling_rate, use_gpu=use_gpu)
+    recording.baseline = processor.estimate_baseline(recording.raw)
+    timings['baseline'] = time.perf_counter() - step_start
+
+    result = {
+        'file': filename,
+        'layout': layout.describe(),
+        'samples': len(recording),
+        'duration': len(recording) / sampling_rate,
+    }
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    output_dir = output_dir or os.path.dirname(os.path.abspath(filename))
+    export_file = os.path.join(output_dir, stem + EXPORT_EXTENSIONS[export]) if export else None
+    if export_file is not None and os.path.abspath(export_file) == os.path.abspath(filename):
+        raise ValueError(f"Експортът би презаписал входния файл: {filename}")
+
+    if heart_rate:
+        step_start = time.perf_counter()
+        beats = BeatDetector(sampling_rate).detect(recording)
+        good = (beats.quality == BeatTable.QUALITY_OK) & np.isfinite(beats.rr)
+        result['beats'] = len(beats)
+        result['heart_rate'] = float(60.0 / np.mean(beats.rr[good])) if good.any() else None
+
+        beats_file = os.path.join(output_dir, f"{stem}.beats.csv")
+        np.savetxt(beats_file,
+                   np.column_stack([beats.samples, beats.samples / sampling_rate, beats.rr,
+                                    beats.lead, beats.quality]),
+                   fmt=['%d', '%.3f', '%.4f', '%d', '%d'], delimiter=',',
+                   header='Sample,Time(s),RR(s),Lead,Quality', comments='')
+        result['beats_file'] = beats_file
+        timings['beats'] = time.perf_counter() - step_start
+
+        # HRV по 5-минутни епохи и за целия запис
+        step_start = time.perf_counter()
+        analyzer = HRVAnalyzer(sampling_rate)
+        epochs = analyzer.epochs(beats, 0, len(recording))
+        analyzer.export_csv(os.path.join(output_dir, f"{stem}.hrv.csv"), epochs)
+        result['hrv'] = analyzer.summary(beats, epochs)
+        timings['hrv'] = time.perf_counter() - step_start
+
+    if export:
+        step_start = time.perf_counter()
+        exporter = ECGExporter(recording, sampling_rate,
+                               recording.layout.lead_names or default_lead_names(layout.num_leads))
+        # --threads важи за компресията на .ecgz; CSV остава в един процес
+        exporter.export(export_file, workers=threads if export == 'ecgz' else None)
+        result['export_file'] = export_file
+        timings['export'] = time.perf_counter() - step_start
+
+    result['timings'] = timings
+    return result
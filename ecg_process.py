@@ -0,0 +1,105 @@
+"""Пакетна обработка на ECG записи без GUI - по един файл на процес.
+
+Пример:
+    python ecg_process.py nights/*.BIN --leads 12 --fs 1000 --export npy --hr --out results/
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ecg_core import EXPORT_EXTENSIONS, BackendDispatcher, FileLayout, process_file
+
+INPUT_EXTENSIONS = ('.bin', '.dat', '.ecgz')
+
+
+def collect_inputs(paths):
+    """Файлове от аргументите - директориите се обхождат за .BIN/.DAT/.ecgz, шаблоните се разгъват"""
+    files = []
+    for path in paths:
+        matches = sorted(glob.glob(path)) or [path]
+        for match in matches:
+            if os.path.isdir(match):
+                files.extend(sorted(os.path.join(match, name) for name in os.listdir(match)
+                                    if name.lower().endswith(INPUT_EXTENSIONS)))
+            else:
+                files.append(match)
+    return files
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетна обработка на ECG записи без GUI")
+    parser.add_argument('inputs', nargs='+', help="файлове, директории или шаблони (напр. in/*.BIN)")
+    parser.add_argument('--leads', type=int, help="брой отвеждания (иначе - профил или разпознаване)")
+    parser.add_argument('--fs', type=float, help="честота на семплиране, Hz (по подразбиране 1000)")
+    parser.add_argument('--header', type=int, default=0, help="размер на header-а в байтове при --leads")
+    parser.add_argument('--bits', type=int, choices=[16, 24, 32], default=16, help="битове на стойност при --leads")
+    parser.add_argument('--big-endian', action='store_true', help="big-endian стойности при --leads")
+    parser.add_argument('--blocked', action='store_true', help="отвежданията последователно при --leads")
+    parser.add_argument('--export', choices=sorted(EXPORT_EXTENSIONS), help="формат на експорта")
+    parser.add_argument('--hr', action='store_true', help="детекция на удари, средна честота, <име>.beats.csv и HRV по епохи в <име>.hrv.csv")
+    parser.add_argument('--out', help="директория за резултатите (по подразбиране - до входния файл)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="брой паралелни процеси")
+    parser.add_argument('--threads', type=int, help="нишки за филтрирането във всеки процес (по подразбиране - всички ядра)")
+    parser.add_argument('--gpu', action='store_true', help="GPU за baseline и филтриране, ако е налично")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="измерва CPU/GPU backends преди обработката и запазва избора")
+    return parser.parse_args(argv)
+
+
+def format_result(result):
+    timings = ' '.join(f"{step}={seconds:.2f}s" for step, seconds in result['timings'].items())
+    line = f"{os.path.basename(result['file'])}: {result['duration'] / 3600:.2f}ч, {result['layout']}"
+    if 'heart_rate' in result:
+        heart_rate = result['heart_rate']
+        line += f", {result['beats']} удара, HR {heart_rate:.0f} bpm" if heart_rate else ", без удари"
+    if result.get('hrv'):
+        line += f", SDNN {result['hrv']['sdnn']:.0f} ms, RMSSD {result['hrv']['rmssd']:.0f} ms"
+    return f"{line} | {timings}"
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = collect_inputs(args.inputs)
+    if not files:
+        print("Няма входни файлове", file=sys.stderr)
+        return 2
+
+    layout = None
+    if args.leads:
+        layout = FileLayout(args.header, args.leads, args.bits // 8, '>' if args.big_endian else '<',
+                            not args.blocked, args.fs)
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    # Калибрирането се пази във файл - работниците го зареждат при стартиране
+    dispatcher = BackendDispatcher(use_gpu=args.gpu, workers=args.threads)
+    if args.calibrate or dispatcher.needs_calibration():
+        dispatcher.calibrate()
+        print(dispatcher.describe())
+
+    options = dict(layout=layout, sampling_rate=args.fs, export=args.export, output_dir=args.out,
+                   heart_rate=args.hr, use_gpu=args.gpu, threads=args.threads)
+
+    # spawn - работниците не наследяват състояние (и CUDA контекст) от родителя
+    start = time.perf_counter()
+    failures = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(files))), mp_context=context) as executor:
+        futures = {executor.submit(process_file, filename, **options): filename for filename in files}
+        for future in as_completed(futures):
+            try:
+                print(format_result(future.result()), flush=True)
+            except Exception as e:
+                failures += 1
+                print(f"{os.path.basename(futures[future])}: грешка - {e}", file=sys.stderr, flush=True)
+
+    print(f"Обработени {len(files) - failures}/{len(files)} файла за {time.perf_counter() - start:.1f}s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,25 +4,347 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
-from scipy import signal
+from matplotlib.ticker import MultipleLocator
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
 import struct
+import threading
 import time
 
-# GPU Support - глобална променлива
-GPU_AVAILABLE = False
-cp = None
+from ecg_core import (GPU_AVAILABLE, cp, BlockBaseline, FilterBank, FilteredCache, SidecarCache,
+                      MinMaxPyramid, JobCancelled, BeatTable, BeatDetector, ECGExporter, FileLayout,
+                      FormatDetector, FormatProfiles, ECGZContainer, ECGRecording, ECGProcessor, BackendDispatcher,
+                      StatsIndex, HRVAnalyzer, PerfTracer, LiveTail, RecordingSession, SessionManager,
+                      default_lead_names)
+
+
+class ECGPlotRenderer:
+    """Постоянна мрежа от оси - при навигация се обновяват само линиите и заглавието (blitting)"""
+
+    BG_COLOR = 'white'
+    GRID_MAJOR_COLOR = '#FF9999'
+    GRID_MINOR_COLOR = '#FFE5E5'
+    SIGNAL_COLOR = 'black'
+
+    def __init__(self, figure, canvas):
+        self.figure = figure
+        self.canvas = canvas
+        self.layout_key = None
+        self.axes = []
+        self.lines = []
+        self.title = None
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    @staticmethod
+    def grid_shape(num_leads):
+        """Динамичен layout базиран на броя отвеждания"""
+        if num_leads <= 6:
+            return num_leads, 1
+        elif num_leads <= 12:
+            return 6, 2
+        return int(np.ceil(num_leads / 4)), 4
+
+    def ensure_layout(self, lead_names, window_duration):
+        """Строи осите само при промяна на отвежданията, прозореца или размера на фигурата"""
+        key = (tuple(lead_names), window_duration,
+               tuple(self.figure.get_size_inches()), self.figure.dpi)
+        if key == self.layout_key:
+            return False
+
+        with PerfTracer.shared().span('plot.layout'):
+            self._build_layout(lead_names, window_duration)
+        self.layout_key = key
+        self.background = None
+        return True
+
+    def _build_layout(self, lead_names, window_duration):
+        self.figure.clear()
+        num_leads = len(lead_names)
+        rows, cols = self.grid_shape(num_leads)
+        self.axes = []
+        self.lines = []
+
+        for i in range(num_leads):
+            ax = self.figure.add_subplot(rows, cols, i + 1, facecolor=self.BG_COLOR)
+
+            ax.set_xlim(0, window_duration)
+            ax.grid(True, which='major', linestyle='-', linewidth=1.0,
+                    color=self.GRID_MAJOR_COLOR, alpha=0.8)
+
+            # ECG хартия (0.2s / 0.04s) има смисъл само за кратки прозорци
+            if window_duration <= 60:
+                ax.minorticks_on()
+                ax.grid(True, which='minor', linestyle='-', linewidth=0.5,
+                        color=self.GRID_MINOR_COLOR, alpha=0.6)
+                ax.xaxis.set_major_locator(MultipleLocator(0.2))
+                ax.xaxis.set_minor_locator(MultipleLocator(0.04))
+                ax.yaxis.set_minor_locator(MultipleLocator(0.1))
+            ax.yaxis.set_major_locator(MultipleLocator(0.5))
+
+            line, = ax.plot([], [], self.SIGNAL_COLOR, linewidth=1.2,
+                            antialiased=True, solid_capstyle='round', animated=True)
+
+            ax.set_ylabel(f'{lead_names[i]}', fontsize=10,
+                          fontweight='bold', rotation=0, ha='right', va='center')
+            ax.set_ylim(-1.5, 1.5)
+
+            ax.axhline(y=0, color='gray', linestyle='-', linewidth=0.5, alpha=0.3)
+            ax.tick_params(labelsize=8)
+
+            if i >= num_leads - cols:
+                ax.set_xlabel('Време (s)', fontsize=9)
+            else:
+                ax.set_xticklabels([])
+
+            for spine in ax.spines.values():
+                spine.set_edgecolor('#CCCCCC')
+                spine.set_linewidth(1)
+
+            self.axes.append(ax)
+            self.lines.append(line)
+
+        # Текстът е само за да се запази място при tight_layout
+        self.title = self.figure.suptitle('ECG', fontsize=11, fontweight='bold', animated=True)
+        with PerfTracer.shared().span('plot.tight_layout'):
+            self.figure.tight_layout()
+
+    def _on_draw(self, event):
+        """След пълно рисуване - запазва статичния фон и рисува динамичните елементи"""
+        if not self.lines:
+            return
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for ax, line in zip(self.axes, self.lines):
+            ax.draw_artist(line)
+        if self.title is not None:
+            self.figure.draw_artist(self.title)
+
+    def render(self, time, data_segment, ylims, title):
+        """Обновява данните; пълно рисуване само ако се сменят y-границите или фонът липсва"""
+        full_draw = self.background is None
+        for i, (ax, line) in enumerate(zip(self.axes, self.lines)):
+            line.set_data(time, data_segment[:, i])
+            if not self._keeps_ylim(ax.get_ylim(), ylims[i]):
+                ax.set_ylim(*ylims[i])
+                full_draw = True
+        self.title.set_text(title)
+
+        if full_draw:
+            with PerfTracer.shared().span('plot.draw'):
+                self.canvas.draw()
+        else:
+            with PerfTracer.shared().span('plot.blit'):
+                self.canvas.restore_region(self.background)
+                self._draw_animated()
+                self.canvas.blit(self.figure.bbox)
+
+    @staticmethod
+    def _keeps_ylim(current, wanted):
+        """Текущите граници остават, ако съдържат желаните и не са много по-широки"""
+        current_span = current[1] - current[0]
+        wanted_span = wanted[1] - wanted[0]
+        return (current[0] <= wanted[0] and current[1] >= wanted[1]
+                and current_span <= 1.5 * wanted_span)
+
+    def savefig(self, filename, **kwargs):
+        """Запис на фигурата - анимираните елементи временно стават статични"""
+        animated = self.lines + ([self.title] if self.title is not None else [])
+        for artist in animated:
+            artist.set_animated(False)
+        try:
+            self.figure.savefig(filename, **kwargs)
+        finally:
+            for artist in animated:
+                artist.set_animated(True)
+            self.canvas.draw()
+
+
+class Job:
+    """Фонова задача - прогрес, отмена и принадлежност към група"""
+
+    def __init__(self, runner, group, on_done, on_error, on_progress):
+        self.runner = runner
+        self.group = group
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self._cancelled = threading.Event()
+        self._last_progress = -1.0
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def report_progress(self, fraction, message=None):
+        """Извиква се от worker thread-а; прекъсва задачата, ако е отменена"""
+        self.check_cancelled()
+        if self.on_progress is not None and (fraction - self._last_progress >= 0.01 or fraction >= 1.0):
+            self._last_progress = fraction
+            self.runner._queue.put(('progress', self, (fraction, message)))
+
+
+class JobRunner:
+    """Изпълнява тежката numpy/scipy работа в thread pool; резултатите се връщат в Tk thread-а чрез root.after"""
+
+    POLL_MS = 15
+
+    def __init__(self, root, max_workers=None):
+        self.root = root
+        workers = max_workers or max(2, min(4, os.cpu_count() or 1))
+        # Отделни пулове - дългите фонови задачи не блокират интерактивните (прозорец, експорт)
+        self._interactive = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ecg-ui')
+        self._background = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ecg-bg')
+        self._queue = queue.Queue()
+        self._latest = {}
+        self._active = 0
+        self._polling = False
+
+    def submit(self, fn, *args, group=None, background=False, on_done=None, on_error=None,
+               on_progress=None, **kwargs):
+        """fn(job, *args, **kwargs) се изпълнява във worker; callback-ите - в Tk thread-а.
+        Нова задача в същата група отменя предишната и резултатът ѝ се изхвърля."""
+        job = Job(self, group, on_done, on_error, on_progress)
+        if group is not None:
+            previous = self._latest.get(group)
+            if previous is not None:
+                previous.cancel()
+            self._latest[group] = job
+
+        self._active += 1
+        executor = self._background if background else self._interactive
+        executor.submit(self._run, job, fn, args, kwargs)
+        self._schedule_poll()
+        return job
+
+    def cancel_group(self, group):
+        job = self._latest.pop(group, None)
+        if job is not None:
+            job.cancel()
+
+    def is_current(self, job):
+        if job.cancelled:
+            return False
+        return job.group is None or self._latest.get(job.group) is job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check_cancelled()
+            result = fn(job, *args, **kwargs)
+            self._queue.put(('done', job, result))
+        except JobCancelled:
+            self._queue.put(('cancelled', job, None))
+        except Exception as e:
+            self._queue.put(('error', job, e))
+
+    def _schedule_poll(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.POLL_MS, self._poll)
+
+    def _poll(self):
+        self._polling = False
+        while True:
+            try:
+                kind, job, payload = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind != 'progress':
+                self._active -= 1
+                if job.group is not None and self._latest.get(job.group) is job:
+                    del self._latest[job.group]
+
+            # Остарели резултати (отменени или заменени) се изхвърлят
+            if job.cancelled or (job.group is not None and kind == 'progress'
+                                 and self._latest.get(job.group) is not job):
+                continue
+
+            if kind == 'done' and job.on_done is not None:
+                job.on_done(payload)
+            elif kind == 'error':
+                if job.on_error is not None:
+                    job.on_error(payload)
+                else:
+                    print(f"Background job failed: {payload}")
+            elif kind == 'progress':
+                job.on_progress(*payload)
+
+        if self._active > 0:
+            self._schedule_poll()
+
+    def shutdown(self):
+        for job in list(self._latest.values()):
+            job.cancel()
+        self._interactive.shutdown(wait=False)
+        self._background.shutdown(wait=False)
 
-try:
-    import cupy as cp
-    from cupyx.scipy import signal as cusignal
 
-    GPU_AVAILABLE = True
-    print("✓ GPU (CUDA) Support Enabled")
-except ImportError:
-    print("✗ GPU Support Not Available - Install cupy for CUDA acceleration")
+class WindowCache:
+    """LRU кеш на подготвени прозорци (данни + HR) със статистика за попаданията"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def nbytes(self):
+        return sum(data.nbytes for data, _ in self._entries.values())
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self._entries),
+        }
 
 
 class ECGViewer:
+    # Период на проверка за дописани данни при следене на файла
+    FOLLOW_INTERVAL_MS = 1000
+    # Стъпка на HR тренда под графиката, s
+    TREND_BIN_SEC = 30
+    # Период на проверка на паметта на отворените записи
+    MEMORY_CHECK_MS = 5000
+    # Фонови задачи, свързани с активния запис - спират се при превключване
+    SESSION_JOB_GROUPS = ('baseline', 'prefilter', 'pyramid', 'stats', 'beats', 'hrv', 'window')
+
     def __init__(self, root):
         self.root = root
         self.root.title("Universal ECG Viewer with GPU Acceleration")
@@ -36,13 +358,26 @@ class ECGViewer:
 
         # Данни
         self.ecg_data = None
-        self.ecg_data_raw = None
         self.current_position = 0
         self.window_duration = 10
         self.current_gain = 1.0
+
+        # Параметри на филтъра
+        self.filter_band = (0.5, 40.0)  # Hz
+        self.notch_freq = 50.0  # Hz
+        self.notch_q = 30.0
+        self.prefilter_var = tk.BooleanVar(value=False)
+
+        # Дисков кеш на обработените данни
+        self.sidecar_var = tk.BooleanVar(value=True)
+        self.sidecar = SidecarCache()
         self.current_file = None
         self.file_info = {}
 
+        # Формат на файла - потвърдените подредби се пазят като именувани профили
+        self.format_profiles = FormatProfiles()
+        self.file_layout = None
+
         # GPU Settings
         global GPU_AVAILABLE
         self.use_gpu = tk.BooleanVar(value=GPU_AVAILABLE)
@@ -57,7 +392,49 @@ class ECGViewer:
                 GPU_AVAILABLE = False
                 self.use_gpu.set(False)
 
+        # Избор на CPU/GPU backend по ядро и размер - от калибрирането на машината
+        self.dispatcher = BackendDispatcher.shared()
+        self.dispatcher.use_gpu = self.use_gpu.get()
+
+        # Фонови задачи - Tk mainloop не се блокира от зареждане и филтриране
+        self.jobs = JobRunner(self.root)
+
+        # Предварително подготвени прозорци (напред N, назад 1)
+        self.window_cache = WindowCache()
+        self.prefetch_windows = 3
+        self._prefetch_jobs = {}
+
+        # Времена на стъпките - записват се само при включено профилиране
+        self.tracer = PerfTracer.shared()
+        self.perf_overlay_var = tk.BooleanVar(value=False)
+
+        # Следене на файл, в който още се пише
+        self.follow_var = tk.BooleanVar(value=False)
+        self.live_tail = None
+
+        # HR тренд и HRV по епохи за целия зареден диапазон
+        self.hrv = HRVAnalyzer(self.sampling_rate)
+        self.hrv_result = None
+        self.trend_var = tk.BooleanVar(value=False)
+
+        # Отворени записи - превключване без презареждане, общ бюджет за паметта им
+        self.sessions = SessionManager()
+        self._over_limit_reported = False
+        self.session = None
+        self.session_var = tk.StringVar(value='')
+        self.sync_position_var = tk.BooleanVar(value=False)
+
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(self.MEMORY_CHECK_MS, self._check_memory)
+
+        if self.dispatcher.needs_calibration():
+            self.calibrate_backends(quiet=True)
+
+    def on_close(self):
+        """Отменя фоновите задачи и затваря приложението"""
+        self.jobs.shutdown()
+        self.root.quit()
 
     def create_widgets(self):
         # Меню бар
@@ -68,16 +445,46 @@ class ECGViewer:
         menubar.add_cascade(label="Файл", menu=file_menu)
         file_menu.add_command(label="Отвори ECG файл", command=self.show_load_dialog)
         file_menu.add_command(label="Презареди сегмент...", command=self.reload_segment)
+        file_menu.add_checkbutton(label="Следене на файла (запис в реално време)",
+                                  variable=self.follow_var, command=self.toggle_follow)
         file_menu.add_separator()
-        file_menu.add_command(label="Експорт в CSV", command=self.export_csv)
+        file_menu.add_command(label="Експорт...", command=self.export_data)
         file_menu.add_command(label="Запази графика", command=self.save_plot)
         file_menu.add_separator()
-        file_menu.add_command(label="Изход", command=self.root.quit)
+        file_menu.add_command(label="Изход", command=self.on_close)
+
+        analysis_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Анализ", menu=analysis_menu)
+        analysis_menu.add_command(label="Следващ удар", command=self.next_beat)
+        analysis_menu.add_command(label="Предишен удар", command=self.prev_beat)
+        analysis_menu.add_separator()
+        analysis_menu.add_checkbutton(label="HR тренд (под графиката)",
+                                      variable=self.trend_var, command=self.toggle_trend)
+        analysis_menu.add_command(label="HRV по епохи...", command=self.show_hrv_dialog)
+
+        self.sessions_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Записи", menu=self.sessions_menu)
+        self._rebuild_sessions_menu()
+        self.root.bind('<Control-Tab>', lambda e: self.next_session())
 
         settings_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Настройки", menu=settings_menu)
         settings_menu.add_command(label="Конфигурация на отвеждания", command=self.configure_leads)
         settings_menu.add_command(label="Честота на семплиране", command=self.configure_sampling_rate)
+        settings_menu.add_separator()
+        settings_menu.add_checkbutton(label="Предварително филтриране на целия запис",
+                                      variable=self.prefilter_var, command=self.toggle_prefilter)
+        settings_menu.add_checkbutton(label="Дисков кеш на обработените данни",
+                                      variable=self.sidecar_var)
+        settings_menu.add_command(label="Предварително зареждане на прозорци...",
+                                  command=self.configure_prefetch)
+        settings_menu.add_command(label="Паралелно филтриране...", command=self.configure_workers)
+        settings_menu.add_command(label="Калибриране на CPU/GPU изчисленията",
+                                  command=self.calibrate_backends)
+        settings_menu.add_separator()
+        settings_menu.add_checkbutton(label="Профилиране (времена на стъпките върху графиката)",
+                                      variable=self.perf_overlay_var, command=self.toggle_perf_overlay)
+        settings_menu.add_command(label="Запази профила (Chrome trace)...", command=self.save_perf_trace)
 
         # Контролен панел
         control_frame = ttk.Frame(self.root, padding="10")
@@ -95,7 +502,7 @@ class ECGViewer:
         ttk.Label(control_frame, text="Прозорец (сек):").pack(side=tk.LEFT, padx=20)
         self.window_var = tk.StringVar(value="10")
         window_combo = ttk.Combobox(control_frame, textvariable=self.window_var,
-                                    values=['5', '10', '30', '60'], width=5)
+                                    values=['5', '10', '30', '60', '300', '600', '1800', '3600'], width=5)
         window_combo.pack(side=tk.LEFT, padx=5)
         window_combo.bind('<<ComboboxSelected>>', lambda e: self.update_plot())
 
@@ -111,8 +518,9 @@ class ECGViewer:
 
         # Филтър контроли
         self.filter_var = tk.BooleanVar(value=True)
-        ttk.Checkbutton(control_frame, text="Филтър", variable=self.filter_var,
-                        command=self.update_plot).pack(side=tk.LEFT, padx=20)
+        self.filter_check = ttk.Checkbutton(control_frame, text="Филтър", variable=self.filter_var,
+                                            command=self.update_plot)
+        self.filter_check.pack(side=tk.LEFT, padx=20)
 
         # GPU контрол
         if GPU_AVAILABLE and cp is not None:
@@ -144,6 +552,17 @@ class ECGViewer:
         self.figure = Figure(figsize=(14, 8), dpi=100)
         self.canvas = FigureCanvasTkAgg(self.figure, master=self.root)
         self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        self.renderer = ECGPlotRenderer(self.figure, self.canvas)
+
+        # HR тренд за целия запис - показва се под графиката при включване; клик скача до мястото
+        self.trend_figure = Figure(figsize=(14, 1.6), dpi=100)
+        self.trend_canvas = FigureCanvasTkAgg(self.trend_figure, master=self.root)
+        self.trend_canvas.mpl_connect('button_press_event', self._on_trend_click)
+        self.trend_marker = None
+
+        # Overlay с последното време и p95 по стъпки - показва се при профилиране
+        self.perf_label = tk.Label(self.canvas.get_tk_widget(), font=('Courier', 9), justify=tk.LEFT,
+                                   background='#FFFFE0', relief=tk.SOLID, borderwidth=1)
 
         # Toolbar
         toolbar = NavigationToolbar2Tk(self.canvas, self.root)
@@ -155,8 +574,13 @@ class ECGViewer:
                                relief=tk.SUNKEN, anchor=tk.W)
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
+    def gpu_active(self):
+        """GPU е наличен и включен от потребителя"""
+        return GPU_AVAILABLE and cp is not None and self.use_gpu.get()
+
     def toggle_gpu(self):
         """Превключва GPU режим"""
+        self.dispatcher.use_gpu = self.gpu_active()
         if not GPU_AVAILABLE or cp is None or self.gpu_label is None:
             return
 
@@ -199,18 +623,7 @@ class ECGViewer:
                     messagebox.showerror("Грешка", "Броят отвеждания трябва да е между 1 и 32")
                     return
 
-                self.num_leads = num
-                # Генерираме имена на отвеждания
-                if num == 12:
-                    self.lead_names = ['I', 'II', 'III', 'aVR', 'aVL', 'aVF',
-                                       'V1', 'V2', 'V3', 'V4', 'V5', 'V6']
-                elif num == 3:
-                    self.lead_names = ['I', 'II', 'III']
-                elif num == 5:
-                    self.lead_names = ['I', 'II', 'III', 'aVR', 'aVL']
-                else:
-                    self.lead_names = [f'Ch{i + 1}' for i in range(num)]
-
+                self.set_num_leads(num)
                 messagebox.showinfo("Успех", f"Конфигурирани {num} отвеждания")
                 dialog.destroy()
 
@@ -219,6 +632,11 @@ class ECGViewer:
 
         ttk.Button(dialog, text="Приложи", command=apply_config).pack(pady=20)
 
+    def set_num_leads(self, num):
+        """Задава броя отвеждания и генерира имената им"""
+        self.num_leads = num
+        self.lead_names = default_lead_names(num)
+
     def configure_sampling_rate(self):
         """Диалог за промяна на честотата на семплиране"""
         dialog = tk.Toplevel(self.root)
@@ -244,11 +662,112 @@ class ECGViewer:
 
         ttk.Button(dialog, text="Приложи", command=apply_rate).pack(pady=20)
 
+    def configure_prefetch(self):
+        """Диалог за броя предварително подготвени прозорци и статистика на кеша"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Предварително зареждане")
+        dialog.geometry("320x330")
+        dialog.transient(self.root)
+
+        stats = self.window_cache.stats()
+        stats_frame = ttk.LabelFrame(dialog, text="Статистика", padding=10)
+        stats_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Label(stats_frame, text=f"Попадения: {stats['hits']}").pack(anchor=tk.W)
+        ttk.Label(stats_frame, text=f"Пропуски: {stats['misses']}").pack(anchor=tk.W)
+        ttk.Label(stats_frame, text=f"Успеваемост: {stats['hit_rate'] * 100:.0f}%").pack(anchor=tk.W)
+        ttk.Label(stats_frame, text=f"Прозорци в кеша: {stats['entries']}").pack(anchor=tk.W)
+
+        ttk.Label(dialog, text="Прозорци напред:", font=('Arial', 10, 'bold')).pack(pady=5)
+
+        count_var = tk.StringVar(value=str(self.prefetch_windows))
+        for count in [0, 1, 2, 3, 5, 8]:
+            ttk.Radiobutton(dialog, text=str(count), variable=count_var, value=str(count)).pack(anchor=tk.W, padx=20)
+
+        def apply_count():
+            self.prefetch_windows = int(count_var.get())
+            dialog.destroy()
+
+        ttk.Button(dialog, text="Приложи", command=apply_count).pack(pady=10)
+
+    def configure_workers(self):
+        """Диалог за броя нишки при CPU филтрирането (по отвеждания и по части от записа)"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Паралелно филтриране")
+        dialog.geometry("300x300")
+        dialog.transient(self.root)
+
+        cores = os.cpu_count() or 1
+        ttk.Label(dialog, text=f"Нишки (ядра: {cores}):", font=('Arial', 10, 'bold')).pack(pady=10)
+
+        workers_var = tk.StringVar(value=str(self.dispatcher.workers or 0))
+        ttk.Radiobutton(dialog, text="Всички ядра", variable=workers_var, value='0').pack(anchor=tk.W, padx=20)
+        for count in [1, 2, 4, 8, 16]:
+            ttk.Radiobutton(dialog, text=str(count), variable=workers_var, value=str(count)).pack(anchor=tk.W, padx=20)
+
+        def apply_workers():
+            self.dispatcher.workers = int(workers_var.get()) or None
+            # Готовият кеш е валиден - резултатът не зависи от броя нишки
+            self.status_var.set(f"Нишки за филтриране: {self.get_processor().workers()}")
+            dialog.destroy()
+
+        ttk.Button(dialog, text="Приложи", command=apply_workers).pack(pady=10)
+
+    def toggle_perf_overlay(self):
+        """Включва профилирането и overlay-а с времената на стъпките"""
+        enabled = self.perf_overlay_var.get()
+        self.tracer.enabled = enabled
+        if enabled:
+            self.perf_label.place(relx=1.0, x=-10, y=10, anchor=tk.NE)
+            self._refresh_perf_overlay()
+        else:
+            self.perf_label.place_forget()
+
+    def _refresh_perf_overlay(self):
+        if not self.tracer.enabled:
+            return
+        text = self.tracer.describe() if self.tracer.events else "Профилиране - няма измервания"
+        self.perf_label.config(text=text)
+        self.root.after(1000, self._refresh_perf_overlay)
+
+    def save_perf_trace(self):
+        """Записва измерванията като Chrome trace (chrome://tracing или Perfetto)"""
+        if not self.tracer.events:
+            messagebox.showwarning("Внимание", "Няма измервания - включете профилирането")
+            return
+
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json"), ("All files", "*.*")]
+        )
+        if filename:
+            count = self.tracer.export_chrome_trace(filename)
+            self.status_var.set(f"Профилът е записан ({count} събития)")
+
+    def calibrate_backends(self, quiet=False):
+        """Измерва backends във фонова задача и запазва избора по ядра и размери"""
+        def on_done(ranking):
+            if quiet:
+                return
+            self.status_var.set("Калибрирането завърши")
+            messagebox.showinfo("Калибриране", self.dispatcher.describe())
+
+        def on_error(e):
+            print(f"Backend calibration failed: {e}")
+            if not quiet:
+                self.status_var.set(f"Грешка при калибриране: {e}")
+
+        def on_progress(fraction, message=None):
+            if not quiet:
+                self.status_var.set(f"Калибриране... {fraction * 100:.0f}%")
+
+        self.jobs.submit(lambda job: self.dispatcher.calibrate(job.report_progress), group='calibration',
+                         background=True, on_done=on_done, on_error=on_error, on_progress=on_progress)
+
     def show_load_dialog(self):
         """Показва диалог за избор на файл и опции за зареждане"""
         filename = filedialog.askopenfilename(
             title="Изберете ECG файл",
-            filetypes=[("Binary files", "*.BIN *.bin *.dat *.DAT"),
+            filetypes=[("Binary files", "*.BIN *.bin *.dat *.DAT"), ("ECGZ (компресиран)", "*.ecgz"),
                        ("All files", "*.*")]
         )
 
@@ -256,18 +775,20 @@ class ECGViewer:
             return
 
         try:
-            import os
             file_size = os.path.getsize(filename)
             file_size_mb = file_size / (1024 * 1024)
 
-            # Опит за определяне на общата продължителност
-            estimated_samples = (file_size - 512) // 2 // self.num_leads
-            estimated_duration_hours = estimated_samples / self.sampling_rate / 3600
+            layout, format_source = self.resolve_layout(filename)
+            sampling_rate = layout.sampling_rate or self.sampling_rate
+
+            # Продължителност според разпознатата подредба
+            estimated_samples = layout.total_samples(file_size)
+            estimated_duration_hours = estimated_samples / sampling_rate / 3600
 
             # Показваме диалог с опции
             dialog = tk.Toplevel(self.root)
             dialog.title("Опции за зареждане")
-            dialog.geometry("500x450")
+            dialog.geometry("500x640")
             dialog.transient(self.root)
             dialog.grab_set()
 
@@ -279,11 +800,47 @@ class ECGViewer:
             ttk.Label(info_frame, text=f"Размер: {file_size_mb:.1f} MB").pack(anchor=tk.W)
             ttk.Label(info_frame, text=f"Приблизителна продължителност: {estimated_duration_hours:.1f} часа").pack(
                 anchor=tk.W)
-            ttk.Label(info_frame, text=f"Конфигурация: {self.num_leads} отвеждания @ {self.sampling_rate}Hz").pack(
-                anchor=tk.W)
+            ttk.Label(info_frame, text=f"Формат: {format_source}").pack(anchor=tk.W)
+
+            # Подредба - може да се коригира и да се запази като профил
+            format_frame = ttk.LabelFrame(dialog, text="Формат на файла", padding=10)
+            format_frame.pack(fill=tk.X, padx=10)
+
+            format_vars = {
+                'header_size': tk.StringVar(value=str(layout.header_size)),
+                'num_leads': tk.StringVar(value=str(layout.num_leads)),
+                'sampling_rate': tk.StringVar(value=str(sampling_rate)),
+                'sample_width': tk.StringVar(value=str(layout.sample_width * 8)),
+            }
+            labels = {'header_size': "Header (B):", 'num_leads': "Отвеждания:",
+                      'sampling_rate': "Честота (Hz):", 'sample_width': "Битове:"}
+            for row, (key, var) in enumerate(format_vars.items()):
+                ttk.Label(format_frame, text=labels[key]).grid(row=row // 2, column=(row % 2) * 2,
+                                                               sticky=tk.W, padx=5)
+                if key == 'sample_width':
+                    ttk.Combobox(format_frame, textvariable=var, values=['16', '24', '32'],
+                                 width=8, state='readonly').grid(row=row // 2, column=(row % 2) * 2 + 1)
+                else:
+                    ttk.Entry(format_frame, textvariable=var, width=10).grid(row=row // 2,
+                                                                              column=(row % 2) * 2 + 1)
+
+            big_endian_var = tk.BooleanVar(value=layout.byteorder == '>')
+            ttk.Checkbutton(format_frame, text="Big-endian",
+                            variable=big_endian_var).grid(row=2, column=0, columnspan=2, sticky=tk.W)
+            blocked_var = tk.BooleanVar(value=not layout.interleaved)
+            ttk.Checkbutton(format_frame, text="Отвежданията последователно (blocked)",
+                            variable=blocked_var).grid(row=2, column=2, columnspan=2, sticky=tk.W)
+
+            save_profile_var = tk.BooleanVar(value=False)
+            ttk.Checkbutton(format_frame, text="Запази като профил:",
+                            variable=save_profile_var).grid(row=3, column=0, columnspan=2, sticky=tk.W)
+            profile_name_var = tk.StringVar(value=os.path.splitext(os.path.basename(filename))[1].lstrip('.').upper()
+                                            + f" {layout.num_leads} отв.")
+            ttk.Entry(format_frame, textvariable=profile_name_var, width=20).grid(row=3, column=2, columnspan=2,
+                                                                                  sticky=tk.W)
 
             # GPU Info
-            if GPU_AVAILABLE and cp is not None and self.use_gpu.get():
+            if self.gpu_active():
                 ttk.Label(info_frame, text="🚀 GPU ускорение: Активно", foreground='green').pack(anchor=tk.W)
 
             # Опции за зареждане
@@ -333,6 +890,23 @@ class ECGViewer:
             button_frame.pack(fill=tk.X, padx=10, pady=10)
 
             def on_load():
+                try:
+                    chosen = FileLayout(int(format_vars['header_size'].get()),
+                                        int(format_vars['num_leads'].get()),
+                                        int(format_vars['sample_width'].get()) // 8,
+                                        '>' if big_endian_var.get() else '<',
+                                        not blocked_var.get(),
+                                        float(format_vars['sampling_rate'].get()),
+                                        layout.scale)
+                except ValueError:
+                    messagebox.showerror("Грешка", "Невалиден формат на файла")
+                    return
+                if not 1 <= chosen.num_leads <= 32 or chosen.header_size < 0 or chosen.sampling_rate <= 0:
+                    messagebox.showerror("Грешка", "Невалиден формат на файла")
+                    return
+                if chosen.sampling_rate.is_integer():
+                    chosen.sampling_rate = int(chosen.sampling_rate)
+
                 option = load_option.get()
                 start_min = 0
                 end_min = None
@@ -357,8 +931,14 @@ class ECGViewer:
                         messagebox.showerror("Грешка", "Невалидни стойности за диапазон")
                         return
 
+                if save_profile_var.get() and profile_name_var.get().strip():
+                    try:
+                        self.format_profiles.save(profile_name_var.get().strip(), filename, chosen)
+                    except OSError as e:
+                        messagebox.showwarning("Внимание", f"Профилът не е запазен:\n{str(e)}")
+
                 dialog.destroy()
-                self.load_file(filename, start_min, end_min)
+                self.load_file(filename, start_min, end_min, layout=chosen)
 
             ttk.Button(button_frame, text="✓ Зареди", command=on_load).pack(side=tk.LEFT, padx=5)
             ttk.Button(button_frame, text="✗ Отказ", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
@@ -368,60 +948,62 @@ class ECGViewer:
         except Exception as e:
             messagebox.showerror("Грешка", f"Грешка при анализ на файла:\n{str(e)}")
 
-    def load_file(self, filename, start_min=0, end_min=None):
-        """Зарежда файл с опционален диапазон и GPU ускорение"""
+    def resolve_layout(self, filename):
+        """Подредба на файла - от профил, ако има съвпадение, иначе статистическо разпознаване.
+        Връща (FileLayout, описание на източника)"""
+        if filename == self.current_file and self.file_layout is not None:
+            return self.file_layout, f"текущ ({self.file_layout.describe()})"
+
+        if ECGZContainer.is_container(filename):
+            layout = ECGZContainer(filename).layout()
+            return layout, f"контейнер ({layout.describe()})"
+
+        matched = self.format_profiles.match(filename)
+        if matched is not None:
+            name, layout = matched
+            return layout, f"профил '{name}' ({layout.describe()})"
+
+        layout, confidence = FormatDetector(filename).detect()
+        if layout is None:
+            layout = FileLayout(0, self.num_leads)
+            return layout, f"неразпознат - {layout.describe()}"
+        return layout, f"разпознат {layout.describe()} (сигурност {confidence * 100:.0f}%)"
+
+    def load_file(self, filename, start_min=0, end_min=None, layout=None):
+        """Зарежда файл с опционален диапазон - тежката обработка е във фонови задачи"""
         try:
             start_time = time.time()
             self.status_var.set("Зареждане на файл...")
-            self.root.update()
+            # Предишният запис остава отворен - пазим изгледа му и спираме задачите му
+            self._suspend_session()
 
+            # Подредбата се разпознава по няколко малки проби от файла
+            if layout is None:
+                with self.tracer.span('load.layout'):
+                    layout, _ = self.resolve_layout(filename)
             self.current_file = filename
-
-            # Четене на файла
-            with open(filename, 'rb') as f:
-                data = f.read()
-
-            file_size = len(data)
-
-            # Опит за разпознаване на header
-            header_sizes = [0, 64, 128, 256, 512, 1024]
-            best_header = 0
-
-            for header_size in header_sizes:
-                try:
-                    payload_size = file_size - header_size
-                    bytes_per_sample = 2
-                    total_values = payload_size // bytes_per_sample
-
-                    if total_values % self.num_leads == 0:
-                        best_header = header_size
-                        break
-                except:
-                    continue
-
-            offset = best_header
-            payload = data[offset:]
-
-            # Преобразуване в 16-bit integers
-            num_samples = len(payload) // 2
-            raw_data = np.frombuffer(payload[:num_samples * 2], dtype=np.int16)
-
-            # Пресъстояване в канали
-            samples_per_lead = len(raw_data) // self.num_leads
-            full_data = raw_data[:samples_per_lead * self.num_leads].reshape(
-                samples_per_lead, self.num_leads
-            )
+            self.file_layout = layout
+            if layout.num_leads != self.num_leads:
+                self.set_num_leads(layout.num_leads)
+            if layout.sampling_rate:
+                self.sampling_rate = layout.sampling_rate
 
             # Изчисляваме диапазона за зареждане
             start_sample = int(start_min * 60 * self.sampling_rate)
-            if end_min is not None:
-                end_sample = int(end_min * 60 * self.sampling_rate)
-                end_sample = min(end_sample, samples_per_lead)
-            else:
-                end_sample = samples_per_lead
-
-            # Извличаме желания диапазон
-            self.ecg_data = full_data[start_sample:end_sample].copy()
+            end_sample = int(end_min * 60 * self.sampling_rate) if end_min is not None else None
+
+            # Memory-mapped запис - данните се четат от диска при нужда
+            with self.tracer.span('load.open'):
+                recording = ECGRecording(filename, self.num_leads, start_sample=start_sample,
+                                         end_sample=end_sample, layout=layout)
+            samples_per_lead = recording.total_samples
+            start_sample, end_sample = recording.start_sample, recording.end_sample
+            # При .ecgz подредбата и имената на отвежданията са от метаданните на контейнера
+            layout = self.file_layout = recording.layout
+            if layout.num_leads != self.num_leads:
+                self.set_num_leads(layout.num_leads)
+            if layout.lead_names:
+                self.lead_names = list(layout.lead_names)
 
             # Запазваме информация
             self.file_info = {
@@ -431,16 +1013,31 @@ class ECGViewer:
                 'loaded_duration': (end_sample - start_sample) / self.sampling_rate
             }
 
-            # Преобразуване с GPU ако е активирано
-            if GPU_AVAILABLE and cp is not None and self.use_gpu.get():
-                self.status_var.set("GPU обработка...")
-                self.root.update()
-                self.ecg_data = self._process_data_gpu(self.ecg_data)
+            # Baseline от дисковия кеш, ако файлът вече е обработван
+            sidecar = self._get_sidecar()
+            if sidecar is not None:
+                try:
+                    recording.sidecar_key = sidecar.make_key(
+                        filename, layout=layout.key(),
+                        sampling_rate=self.sampling_rate, start=start_sample, end=end_sample)
+                except OSError as e:
+                    print(f"Sidecar cache unavailable: {e}")
+
+            with self.tracer.span('load.sidecar'):
+                cached_baseline = self._load_cached_baseline(recording)
+            if cached_baseline is not None:
+                recording.baseline = cached_baseline
             else:
-                self.ecg_data = self._process_data_cpu(self.ecg_data)
+                # Временен baseline от първата минута, докато фоновата оценка завърши
+                preview = recording.raw[:int(60 * self.sampling_rate)]
+                recording.baseline = self._process_data_cpu(preview)
 
-            # Запазваме raw версия
-            self.ecg_data_raw = self.ecg_data.copy()
+            recording.gain = self.current_gain
+            self.hrv = HRVAnalyzer(self.sampling_rate)
+            self.hrv_result = None
+            self.window_cache = WindowCache()
+            self.ecg_data = recording
+            self._draw_trend()
 
             load_time = time.time() - start_time
             duration_sec = len(self.ecg_data) / self.sampling_rate
@@ -449,7 +1046,8 @@ class ECGViewer:
 
             loaded_range = f"{start_min:.0f}-{end_min if end_min else 'край'}мин" if end_min else "пълен"
 
-            gpu_info = "🚀 GPU" if (GPU_AVAILABLE and cp is not None and self.use_gpu.get()) else "CPU"
+            use_gpu = self.gpu_active()
+            gpu_info = "🚀 GPU" if use_gpu else "CPU"
 
             self.info_label.config(
                 text=f"Файл: {filename.split('/')[-1]} | "
@@ -459,49 +1057,303 @@ class ECGViewer:
             )
 
             self.current_position = 0
+            session = RecordingSession(f"{os.path.abspath(filename)}|{start_sample}|{end_sample}", recording,
+                                       f"{os.path.basename(filename)} ({loaded_range})")
+            session.extra['windows'] = self.window_cache
+            self.sessions.open(session)
+            self.session = session
+            self._save_view()
+            self._rebuild_sessions_menu()
             self.update_plot()
 
-            self.root.after(500, self.auto_scale)
-
-            self.status_var.set(f"Файлът е зареден успешно за {load_time:.2f}s")
+            if cached_baseline is not None:
+                self._on_baseline_ready(recording, start_time)
+                return
+            self._start_baseline(recording, start_time)
 
         except Exception as e:
             messagebox.showerror("Грешка", f"Грешка при зареждане:\n{str(e)}")
             self.status_var.set("Грешка при зареждане")
+            # Връщаме се към последния отворен запис
+            if self.session is not None and self.session.key in self.sessions:
+                self._resume_session(self.session)
 
-    def _process_data_gpu(self, data):
-        """Обработва данните с GPU"""
-        if cp is None:
-            return self._process_data_cpu(data)
+    def _start_baseline(self, recording, start_time):
+        """Поточна baseline оценка по блокове, с GPU ако е активирано"""
+        use_gpu = self.gpu_active()
 
-        try:
-            # Прехвърляме към GPU
-            gpu_data = cp.array(data, dtype=cp.float32)
+        def estimate_baseline(job):
+            if use_gpu:
+                return self._process_data_gpu(recording.raw, job.report_progress)
+            return self._process_data_cpu(recording.raw, job.report_progress)
 
-            # Премахваме baseline offset
-            for i in range(self.num_leads):
-                baseline = cp.median(gpu_data[:, i])
-                gpu_data[:, i] -= baseline
+        def on_done(baseline):
+            recording.baseline = baseline
+            self._store_cached_baseline(recording)
+            self._on_baseline_ready(recording, start_time)
 
-            # Нормализираме amplitude
-            gpu_data = gpu_data / 200.0
+        def on_error(e):
+            messagebox.showerror("Грешка", f"Грешка при обработка:\n{str(e)}")
+            self.status_var.set("Грешка при обработка")
 
-            # Връщаме на CPU
-            return cp.asnumpy(gpu_data)
-        except Exception as e:
-            print(f"GPU processing failed: {e}, falling back to CPU")
-            return self._process_data_cpu(data)
+        def on_progress(fraction, message=None):
+            self.status_var.set(f"{'GPU' if use_gpu else 'CPU'} обработка... {fraction * 100:.0f}%")
+
+        self.jobs.submit(estimate_baseline, group='baseline', background=True,
+                         on_done=on_done, on_error=on_error, on_progress=on_progress)
+
+    def _on_baseline_ready(self, recording, start_time):
+        """Окончателният baseline е готов - стартират производните фонови задачи"""
+        if recording is not self.ecg_data:
+            return
+
+        self.session.view['baseline_ready'] = True
+        # Подготвените с временния baseline прозорци вече не са валидни
+        self._cancel_prefetch()
+        self.window_cache.clear()
+        self.update_plot()
+        self.root.after(500, self.auto_scale)
+        self._start_derived(recording)
+
+        load_time = time.time() - start_time
+        self.status_var.set(f"Файлът е зареден успешно за {load_time:.2f}s")
+
+    def _start_derived(self, recording):
+        """Стартира производните задачи само за липсващите (или освободени) данни на записа"""
+        if self.prefilter_var.get():
+            self.start_prefilter()
+        if recording.pyramid is None:
+            self.start_pyramid()
+        if recording.stats is None:
+            self.start_stats()
+        if recording.beats is None:
+            self.start_beat_detection()
+        elif self.hrv_result is None:
+            self.start_hrv()
+
+    def _save_view(self):
+        """Състоянието на изгледа на текущия запис - възстановява се при превключване обратно"""
+        self.session.view.update({
+            'current_file': self.current_file,
+            'file_layout': self.file_layout,
+            'file_info': self.file_info,
+            'sampling_rate': self.sampling_rate,
+            'num_leads': self.num_leads,
+            'lead_names': list(self.lead_names),
+            'position': self.current_position,
+            'window': self.window_var.get(),
+            'info': self.info_label.cget('text'),
+            'hrv': self.hrv,
+            'hrv_result': self.hrv_result,
+        })
+
+    def _suspend_session(self):
+        """Запазва изгледа на текущия запис и спира фоновите му задачи - данните му остават в паметта"""
+        session = self.session
+        if session is None:
+            return
+
+        self.stop_follow()
+        self._save_view()
+        for group in self.SESSION_JOB_GROUPS:
+            self.jobs.cancel_group(group)
+        self._cancel_prefetch()
+
+        # Недовършените артефакти са отменени заедно със задачите си - строят се наново при връщане
+        recording = session.recording
+        if recording.filtered_cache is not None and not recording.filtered_cache.ready:
+            recording.release_caches()
+        if recording.pyramid is not None and not recording.pyramid.ready:
+            recording.release_pyramid()
+        if recording.stats is not None and not recording.stats.ready:
+            recording.release_stats()
+
+    def _resume_session(self, session, position=None):
+        """Прави записа текущ - изгледът се възстановява, липсващите производни данни се достроят"""
+        view = session.view
+        self.sessions.activate(session.key)
+        self.session = session
+        self.ecg_data = recording = session.recording
+        self.current_file = view['current_file']
+        self.file_layout = view['file_layout']
+        self.file_info = view['file_info']
+        self.sampling_rate = view['sampling_rate']
+        self.num_leads = view['num_leads']
+        self.lead_names = list(view['lead_names'])
+        self.hrv = view['hrv']
+        self.hrv_result = view['hrv_result']
+        self.window_cache = session.extra['windows']
+        self.window_var.set(view['window'])
+        self.info_label.config(text=view['info'])
+        self.session_var.set(session.key)
+
+        recording.gain = self.current_gain
+        if position is None:
+            position = view['position']
+        self.current_position = max(0, min(position, len(recording) - 1))
+
+        self._draw_trend()
+        self.update_plot()
+        if view.get('baseline_ready'):
+            self._start_derived(recording)
+        else:
+            self._start_baseline(recording, time.time())
+        self._enforce_memory()
+
+    def switch_session(self, key):
+        """Превключва към друг отворен запис - без презареждане"""
+        session = self.sessions.get(key)
+        if session is None or session is self.session:
+            self.session_var.set(self.session.key if self.session is not None else '')
+            return
+
+        # Синхронна позиция - същото време от началото на заредения диапазон
+        position = None
+        if self.sync_position_var.get():
+            position = int(self.current_position / self.sampling_rate * session.view['sampling_rate'])
+
+        self._suspend_session()
+        self._resume_session(session, position)
+        self.status_var.set(f"Текущ запис: {session.name}")
+
+    def next_session(self):
+        if self.session is None or len(self.sessions) < 2:
+            return
+        ordered = sorted(self.sessions.sessions.values(), key=lambda session: session.opened)
+        index = ordered.index(self.session)
+        self.switch_session(ordered[(index + 1) % len(ordered)].key)
+
+    def close_session(self):
+        """Затваря текущия запис и освобождава данните му; изгледът минава към последно ползвания"""
+        if self.session is None:
+            return
+        if len(self.sessions) < 2:
+            self.status_var.set("Това е единственият отворен запис")
+            return
+
+        closed = self.session
+        self._suspend_session()
+        self.sessions.close(closed.key)
+        self._resume_session(self.sessions.active)
+        self._rebuild_sessions_menu()
+        self.status_var.set(f"Затворен: {closed.name}")
+
+    def _rebuild_sessions_menu(self):
+        menu = self.sessions_menu
+        menu.delete(0, tk.END)
+        for session in sorted(self.sessions.sessions.values(), key=lambda session: session.opened):
+            menu.add_radiobutton(label=session.name, variable=self.session_var, value=session.key,
+                                 command=lambda key=session.key: self.switch_session(key))
+        if len(self.sessions):
+            menu.add_separator()
+        menu.add_command(label="Следващ запис (Ctrl+Tab)", command=self.next_session)
+        menu.add_command(label="Затвори текущия запис", command=self.close_session)
+        menu.add_checkbutton(label="Синхронна позиция при превключване", variable=self.sync_position_var)
+        menu.add_separator()
+        menu.add_command(label="Памет на записите...", command=self.configure_memory)
+        if self.session is not None:
+            self.session_var.set(self.session.key)
+
+    def _enforce_memory(self):
+        """Освобождава най-отдавна ползваните производни данни над лимита на паметта"""
+        evicted = self.sessions.enforce()
+        current = [artifact for session, artifact in evicted if session is self.session]
+        if current:
+            self.status_var.set(f"Лимит на паметта - освободени данни на текущия запис: {', '.join(current)}")
+        # Производните данни на текущия запис остават - съобщава се веднъж, че лимитът не стига за тях
+        over_limit = self.sessions.over_limit > 0
+        if over_limit and not self._over_limit_reported:
+            needed = (self.sessions.memory_limit + self.sessions.over_limit) >> 20
+            self.status_var.set(f"Лимитът на паметта ({self.sessions.memory_limit >> 20} MB) е твърде малък - "
+                                f"отворените записи заемат {needed} MB")
+        self._over_limit_reported = over_limit
+
+    def _check_memory(self):
+        self._enforce_memory()
+        self.root.after(self.MEMORY_CHECK_MS, self._check_memory)
+
+    def configure_memory(self):
+        """Диалог с паметта по записи и артефакти и лимита за всички отворени записи"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Памет на записите")
+        dialog.geometry("560x420")
+        dialog.transient(self.root)
+
+        usage_frame = ttk.LabelFrame(dialog, text="Отворени записи (MB)", padding=10)
+        usage_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        for key, usage in self.sessions.usage().items():
+            session = self.sessions.get(key)
+            parts = ', '.join(f"{name} {size / 2**20:.1f}" for name, size in usage.items() if size)
+            marker = "► " if session is self.session else ""
+            ttk.Label(usage_frame, text=f"{marker}{session.name}: {sum(usage.values()) / 2**20:.1f} MB"
+                                        f"{f' ({parts})' if parts else ''}").pack(anchor=tk.W)
+        ttk.Label(usage_frame, text=f"Общо: {self.sessions.total_bytes() / 2**20:.1f} MB",
+                  font=('Arial', 10, 'bold')).pack(anchor=tk.W, pady=5)
+
+        limit_frame = ttk.LabelFrame(dialog, text="Лимит", padding=10)
+        limit_frame.pack(fill=tk.X, padx=10)
+        limit_var = tk.StringVar(value=str(self.sessions.memory_limit >> 20))
+        ttk.Combobox(limit_frame, textvariable=limit_var, width=8,
+                     values=['256', '512', '1024', '2048', '4096', '8192']).pack(side=tk.LEFT, padx=5)
+        ttk.Label(limit_frame, text="MB").pack(side=tk.LEFT)
+
+        def apply_limit():
+            try:
+                limit = int(float(limit_var.get()) * 2**20)
+            except ValueError:
+                messagebox.showerror("Грешка", "Невалиден лимит")
+                return
+            self.sessions.memory_limit = max(64 << 20, limit)
+            self._enforce_memory()
+            dialog.destroy()
+
+        def release_inactive():
+            for session in list(self.sessions.sessions.values()):
+                if session is not self.session:
+                    for artifact in session.artifacts():
+                        session.release(artifact)
+            self.status_var.set("Данните на неактивните записи са освободени")
+            dialog.destroy()
+
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(button_frame, text="Приложи", command=apply_limit).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Освободи неактивните записи",
+                   command=release_inactive).pack(side=tk.LEFT, padx=5)
+
+    def _process_data_gpu(self, data, progress=None):
+        """Изчислява baseline по блокове с GPU"""
+        return self.get_processor(use_gpu=True).estimate_baseline(data, progress)
+
+    def _process_data_cpu(self, data, progress=None):
+        """Изчислява baseline по блокове с CPU"""
+        return self.get_processor(use_gpu=False).estimate_baseline(data, progress)
 
-    def _process_data_cpu(self, data):
-        """Обработва данните с CPU"""
-        data = data.astype(np.float32)
+    def _get_sidecar(self):
+        return self.sidecar if self.sidecar_var.get() else None
 
-        for i in range(self.num_leads):
-            baseline = np.median(data[:, i])
-            data[:, i] -= baseline
+    def _load_cached_baseline(self, recording):
+        """Baseline от дисковия кеш или None"""
+        sidecar = self._get_sidecar()
+        if sidecar is None or recording.sidecar_key is None:
+            return None
+
+        positions = sidecar.load(recording.sidecar_key, 'baseline_positions', mmap=False)
+        values = sidecar.load(recording.sidecar_key, 'baseline_values', mmap=False)
+        if positions is None or values is None or values.shape[1:] != (recording.num_leads,):
+            return None
+        return BlockBaseline(positions, values)
+
+    def _store_cached_baseline(self, recording):
+        sidecar = self._get_sidecar()
+        if sidecar is None or recording.sidecar_key is None:
+            return
 
-        data = data / 200.0
-        return data
+        try:
+            sidecar.store(recording.sidecar_key, 'baseline_positions', recording.baseline.positions)
+            sidecar.store(recording.sidecar_key, 'baseline_values', recording.baseline.values)
+        except OSError as e:
+            print(f"Sidecar cache write failed: {e}")
 
     def reload_segment(self):
         """Презарежда различен сегмент от текущия файл"""
@@ -579,6 +1431,11 @@ class ECGViewer:
         ttk.Button(button_frame, text="Зареди", command=on_load).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Отказ", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
 
+    def window_samples(self, window_duration=None):
+        """Дължина на прозореца в цели семпли - за дробна честота на дискретизация също"""
+        duration = self.window_duration if window_duration is None else window_duration
+        return int(round(duration * self.sampling_rate))
+
     def update_plot(self):
         if self.ecg_data is None:
             return
@@ -588,108 +1445,634 @@ class ECGViewer:
         except:
             self.window_duration = 10
 
-        window_samples = self.window_duration * self.sampling_rate
+        window_duration = self.window_duration
+        window_samples = self.window_samples(window_duration)
         start_sample = self.current_position
         end_sample = min(start_sample + window_samples, len(self.ecg_data))
 
-        data_segment = self.ecg_data[start_sample:end_sample]
+        self.position_var.set(f"{self.current_position / self.sampling_rate:.1f}")
 
-        # Прилагаме филтър
-        if self.filter_var.get() and len(data_segment) > 100:
-            try:
-                data_segment = self.filter_ecg_signal(data_segment)
-            except:
-                pass
+        _, cols = ECGPlotRenderer.grid_shape(self.num_leads)
+
+        # Дългите прозорци (над 60 s) се рисуват от min/max пирамидата - до ~2 точки на пиксел.
+        # По-кратките се рисуват семпъл по семпъл, за да се виждат филтърът и HR
+        axes_width_px = int(self.figure.get_figwidth() * self.figure.dpi / cols)
+        overview = (window_duration > 60
+                    and end_sample - start_sample > 2 * axes_width_px)
+        if self.session is not None:
+            self.session.touch('windows', 'decoded', 'stats', 'beats', 'pyramid' if overview else 'filtered')
+        # Пирамидата е от нефилтрирания сигнал - при преглед филтърът не се прилага
+        self.filter_check.state(['disabled'] if overview else ['!disabled'])
+        if overview:
+            self.jobs.cancel_group('window')
+            with self.tracer.span('plot.overview'):
+                time, data_segment = self.get_overview_segment(start_sample, end_sample, axes_width_px)
+            beats = self.ecg_data.beats
+            hr = beats.heart_rate(start_sample, end_sample) if beats is not None else None
+            self._draw_segment(start_sample, window_duration, time, data_segment, hr, overview=True)
+            return
 
-        time = np.arange(len(data_segment)) / self.sampling_rate
+        recording = self.ecg_data
+        filter_on = self.filter_var.get()
+        use_gpu = self.use_gpu.get()
+        gain = self.current_gain
+
+        def draw(result):
+            data_segment, hr = result
+            time = np.arange(len(data_segment)) / self.sampling_rate
+            self._draw_segment(start_sample, window_duration, time, data_segment, hr)
+
+        key = self._window_key(start_sample, window_samples, filter_on, gain)
+        cached = self.window_cache.get(key)
+        if cached is not None:
+            self.jobs.cancel_group('window')
+            draw(cached)
+            self.prefetch_around(start_sample, window_samples)
+            return
 
-        self.figure.clear()
+        # Филтрирането и HR са във фонова задача; незавършен по-стар прозорец се изхвърля
+        def on_done(result):
+            if recording is not self.ecg_data:
+                return
+            self.window_cache.put(key, result)
+            draw(result)
+            self.prefetch_around(start_sample, window_samples)
+
+        def on_error(e):
+            self.status_var.set(f"Грешка при подготовка на прозореца: {e}")
+
+        self.jobs.submit(self._prepare_window, recording, start_sample, end_sample,
+                         filter_on, use_gpu, gain, group='window', on_done=on_done, on_error=on_error)
+
+    def _window_key(self, start_sample, window_samples, filter_on, gain):
+        """Ключ за кеша на прозорци - позиция, дължина, филтър и мащаб"""
+        filter_key = self.get_filter_bank().key if filter_on else None
+        return start_sample, window_samples, filter_key, gain
+
+    def _prepare_window(self, job, recording, start_sample, end_sample, filter_on, use_gpu, gain):
+        """Филтриран прозорец и HR - изпълнява се във фонова задача"""
+        data_segment = self.get_segment(recording, start_sample, end_sample,
+                                        filter_on, use_gpu, gain)
+        job.check_cancelled()
+        # HR от таблицата на ударите, ако е готова - иначе детекция само в прозореца
+        if recording.beats is not None:
+            hr = recording.beats.heart_rate(start_sample, end_sample)
+        else:
+            hr = self.calculate_heart_rate(data_segment, filter_on, use_gpu)
+        return data_segment, hr
+
+    def prefetch_around(self, start_sample, window_samples):
+        """Подготвя във фонов режим следващите N прозореца и предходния"""
+        recording = self.ecg_data
+        if recording is None or self.prefetch_windows <= 0:
+            self._cancel_prefetch()
+            return
+
+        filter_on = self.filter_var.get()
+        use_gpu = self.use_gpu.get()
+        gain = self.current_gain
+        last_start = max(0, len(recording) - window_samples)
+
+        wanted = {}
+        for step in list(range(1, self.prefetch_windows + 1)) + [-1]:
+            position = min(max(0, start_sample + step * window_samples), last_start)
+            if position == start_sample:
+                continue
+            key = self._window_key(position, window_samples, filter_on, gain)
+            if key not in self.window_cache:
+                wanted[key] = position
+
+        # Отменяме подготовката на прозорци, които вече не са около текущата позиция
+        for key in list(self._prefetch_jobs):
+            if key not in wanted:
+                self._prefetch_jobs.pop(key).cancel()
+
+        for key, position in wanted.items():
+            if key in self._prefetch_jobs:
+                continue
+
+            def on_done(result, key=key):
+                self._prefetch_jobs.pop(key, None)
+                if recording is self.ecg_data:
+                    self.window_cache.put(key, result)
+
+            def on_error(e, key=key):
+                self._prefetch_jobs.pop(key, None)
+
+            end_sample = min(position + window_samples, len(recording))
+            self._prefetch_jobs[key] = self.jobs.submit(
+                self._prepare_window, recording, position, end_sample, filter_on, use_gpu, gain,
+                background=True, on_done=on_done, on_error=on_error)
+
+    def _cancel_prefetch(self):
+        for job in self._prefetch_jobs.values():
+            job.cancel()
+        self._prefetch_jobs.clear()
+
+    def _draw_segment(self, position, window_duration, time, data_segment, hr, overview=False):
+        """Рисува подготвен прозорец - изпълнява се в Tk thread-а"""
+        with self.tracer.span('plot.update'):
+            self._render_segment(position, window_duration, time, data_segment, hr, overview)
+
+    def _render_segment(self, position, window_duration, time, data_segment, hr, overview=False):
+        # Осите се строят наново само при промяна на layout-а
+        self.renderer.ensure_layout(self.lead_names[:self.num_leads], window_duration)
+
+        ylims = self._ylims(position, window_duration, data_segment)
+
+        loaded_time_info = ""
+        if self.file_info:
+            abs_time_sec = self.file_info['loaded_start'] + (position / self.sampling_rate)
+            loaded_time_info = f" | Абс. време: {abs_time_sec / 60:.1f}мин"
 
-        bg_color = 'white'
-        grid_major_color = '#FF9999'
-        grid_minor_color = '#FFE5E5'
-        signal_color = 'black'
+        title = (f'{self.num_leads}-Lead ECG - Position: {position / self.sampling_rate:.1f}s '
+                 f'({(position / self.sampling_rate) / 60:.1f}min){loaded_time_info}')
+        if overview and self.filter_var.get():
+            title += " | Преглед min/max - без филтър"
 
-        # Динамичен layout базиран на броя отвеждания
-        if self.num_leads <= 6:
-            rows, cols = self.num_leads, 1
-        elif self.num_leads <= 12:
-            rows, cols = 6, 2
+        self.renderer.render(time, data_segment, ylims, title)
+        self._update_trend_marker(position, window_duration)
+
+        if hr:
+            self.hr_label.config(text=f"HR: {hr} bpm")
         else:
-            rows, cols = int(np.ceil(self.num_leads / 4)), 4
+            self.hr_label.config(text="HR: -- bpm")
 
-        for i in range(self.num_leads):
-            ax = self.figure.add_subplot(rows, cols, i + 1, facecolor=bg_color)
+    def _ylims(self, position, window_duration, data_segment):
+        """Y-граници по отвеждания - от индекса на статистиките, ако е готов, иначе от данните"""
+        if len(data_segment) == 0:
+            return [(-1.5, 1.5)] * self.num_leads
 
-            ax.set_xlim(time[0], time[-1])
-            ax.grid(True, which='major', linestyle='-', linewidth=1.0,
-                    color=grid_major_color, alpha=0.8)
-            ax.minorticks_on()
-            ax.grid(True, which='minor', linestyle='-', linewidth=0.5,
-                    color=grid_minor_color, alpha=0.6)
-
-            from matplotlib.ticker import MultipleLocator
-            ax.xaxis.set_major_locator(MultipleLocator(0.2))
-            ax.xaxis.set_minor_locator(MultipleLocator(0.04))
-            ax.yaxis.set_major_locator(MultipleLocator(0.5))
-            ax.yaxis.set_minor_locator(MultipleLocator(0.1))
+        stats = self.ecg_data.stats
+        window = stats.query(position, position + self.window_samples(window_duration),
+                             self.current_gain) if stats is not None else None
+        if window is not None:
+            data_mean, data_std = window['mean'], window['std']
+        else:
+            data_mean, data_std = data_segment.mean(axis=0), data_segment.std(axis=0)
+
+        ylims = []
+        for mean, std in zip(data_mean[:self.num_leads], data_std[:self.num_leads]):
+            ylim = (-1.5, 1.5)
+            if std > 0.01:
+                y_range = max(std * 4, 1.0)
+                # Закръгляме до мрежата (0.5 mV) - границите рядко се сменят и се ползва blitting
+                ylim = (np.floor((mean - y_range) * 2) / 2, np.ceil((mean + y_range) * 2) / 2)
+            ylims.append(ylim)
+        return ylims
+
+    def get_segment(self, recording, start_sample, end_sample, filter_on, use_gpu, gain):
+        """Прозорец от данните - от кеша, ако е готов, иначе филтриран с padding от съседните семпли.
+        Параметрите се подават явно, защото се извиква и от фонови задачи"""
+        live_tail = self.live_tail
+        if filter_on and live_tail is not None and live_tail.recording is recording:
+            data_segment = live_tail.segment(start_sample, end_sample, gain)
+            if data_segment is not None:
+                return data_segment
+        return self.get_processor(use_gpu).segment(recording, start_sample, end_sample, filter_on, gain)
+
+    def get_overview_segment(self, start_sample, end_sample, max_bins):
+        """Min/max точки за дълъг прозорец - време спрямо началото на прозореца и данни"""
+        pyramid = self.ecg_data.pyramid
+        if pyramid is not None and pyramid.ready:
+            positions, data_segment = pyramid.query(start_sample, end_sample, max_bins)
+            data_segment = data_segment * np.float32(self.current_gain)
+        else:
+            # Докато пирамидата се строи - разреден сигнал
+            step = max(1, (end_sample - start_sample) // (2 * max_bins))
+            data_segment = self.ecg_data.strided(start_sample, end_sample, step)
+            positions = np.arange(start_sample, end_sample, step)[:len(data_segment)]
+
+        return (positions - start_sample) / self.sampling_rate, data_segment
+
+    def start_pyramid(self):
+        """Зарежда min/max пирамидата от дисковия кеш или я строи във фонова задача"""
+        recording = self.ecg_data
+        recording.release_pyramid()
+
+        sidecar = self._get_sidecar()
+        if sidecar is not None and recording.sidecar_key is not None:
+            pyramid = MinMaxPyramid.load(sidecar, recording.sidecar_key)
+            if pyramid is not None:
+                pyramid.length = len(recording)
+                recording.pyramid = pyramid
+                return
+
+        pyramid = MinMaxPyramid()
+        recording.pyramid = pyramid
+
+        def build(job):
+            pyramid.build(recording, job.report_progress)
+            if pyramid.ready and sidecar is not None and recording.sidecar_key is not None:
+                try:
+                    pyramid.save(sidecar, recording.sidecar_key)
+                except OSError as e:
+                    print(f"Sidecar cache write failed: {e}")
+            return pyramid
+
+        def on_done(result):
+            # Прерисува текущия дълъг прозорец, когато пирамидата е готова
+            if self.ecg_data is recording and recording.pyramid is pyramid and self.window_duration > 60:
+                self.update_plot()
+
+        self.jobs.submit(build, group='pyramid', background=True, on_done=on_done,
+                         on_error=lambda e: print(f"Min/max pyramid failed: {e}"))
+
+    def start_stats(self):
+        """Индекс на статистиките за auto scale и y-границите - от дисковия кеш или във фонова задача"""
+        recording = self.ecg_data
+        recording.release_stats()
+
+        sidecar = self._get_sidecar()
+        if sidecar is not None and recording.sidecar_key is not None:
+            stats = StatsIndex.load(sidecar, recording.sidecar_key, self.sampling_rate)
+            if stats is not None:
+                stats.length = len(recording)
+                recording.stats = stats
+                return
+
+        stats = StatsIndex(self.sampling_rate)
+        recording.stats = stats
+
+        def build(job):
+            stats.build(recording, job.report_progress)
+            if stats.ready and sidecar is not None and recording.sidecar_key is not None:
+                try:
+                    stats.save(sidecar, recording.sidecar_key)
+                except OSError as e:
+                    print(f"Sidecar cache write failed: {e}")
+            return stats
+
+        self.jobs.submit(build, group='stats', background=True,
+                         on_error=lambda e: print(f"Statistics index failed: {e}"))
+
+    def start_beat_detection(self):
+        """Таблица на ударите за целия зареден диапазон - от дисковия кеш или във фонова задача"""
+        recording = self.ecg_data
+        sidecar = self._get_sidecar()
+        beats_key = None
+        if sidecar is not None and recording.sidecar_key is not None:
+            beats_key = sidecar.derive_key(recording.sidecar_key, ('beats', BeatDetector.__name__))
+            beats = BeatTable.load(sidecar, beats_key, self.sampling_rate)
+            if beats is not None:
+                self._on_beats_ready(recording, beats)
+                return
+
+        detector = BeatDetector(self.sampling_rate)
+
+        def detect(job):
+            beats = detector.detect(recording, job.report_progress)
+            if beats_key is not None:
+                try:
+                    beats.save(sidecar, beats_key)
+                except OSError as e:
+                    print(f"Sidecar cache write failed: {e}")
+            return beats
 
-            ax.plot(time, data_segment[:, i], signal_color, linewidth=1.2,
-                    antialiased=True, solid_capstyle='round')
+        self.jobs.submit(detect, group='beats', background=True,
+                         on_done=lambda beats: self._on_beats_ready(recording, beats),
+                         on_error=lambda e: print(f"Beat detection failed: {e}"))
 
-            ax.set_ylabel(f'{self.lead_names[i]}', fontsize=10,
-                          fontweight='bold', rotation=0, ha='right', va='center')
+    def _on_beats_ready(self, recording, beats):
+        if recording is not self.ecg_data:
+            return
 
-            lead_data = data_segment[:, i]
-            if len(lead_data) > 0:
-                data_std = np.std(lead_data)
-                data_mean = np.mean(lead_data)
+        recording.beats = beats
+        # HR в кешираните прозорци е изчислен без таблицата
+        self.window_cache.clear()
+        self.update_plot()
+        self.start_hrv()
+
+    def start_hrv(self):
+        """HR тренд и HRV по епохи от таблицата на ударите - във фонова задача.
+        Спектрите на непроменените епохи се вземат от кеша на анализатора"""
+        recording = self.ecg_data
+        beats = recording.beats
+        if beats is None:
+            return
+        analyzer = self.hrv
+        end = len(recording)
+
+        def analyze(job):
+            with self.tracer.span('hrv'):
+                epochs = analyzer.epochs(beats, 0, end, job.report_progress)
+                return {
+                    'epochs': epochs,
+                    'summary': analyzer.summary(beats, epochs, 0, end),
+                    'trend': analyzer.tachogram(beats, 0, end, bin_sec=self.TREND_BIN_SEC),
+                }
+
+        def on_done(result):
+            if recording is not self.ecg_data:
+                return
+            self.hrv_result = result
+            self._draw_trend()
+
+        self.jobs.submit(analyze, group='hrv', background=True, on_done=on_done,
+                         on_error=lambda e: print(f"HRV analysis failed: {e}"))
+
+    def toggle_trend(self):
+        """Показва/скрива HR тренда под графиката"""
+        widget = self.trend_canvas.get_tk_widget()
+        if self.trend_var.get():
+            widget.pack(side=tk.TOP, fill=tk.X, after=self.canvas.get_tk_widget())
+            self._draw_trend()
+        else:
+            widget.pack_forget()
 
-                if data_std > 0.01:
-                    y_range = max(data_std * 4, 1.0)
-                    ax.set_ylim(data_mean - y_range, data_mean + y_range)
-                else:
-                    ax.set_ylim(-1.5, 1.5)
+    def _draw_trend(self):
+        """HR (по TREND_BIN_SEC) и RMSSD по епохи за целия запис; маркер на текущия прозорец"""
+        if not self.trend_var.get():
+            return
 
-            ax.axhline(y=0, color='gray', linestyle='-', linewidth=0.5, alpha=0.3)
-            ax.tick_params(labelsize=8)
+        self.trend_figure.clear()
+        self.trend_marker = None
+        ax = self.trend_figure.add_subplot(111)
+        result = self.hrv_result
+        if result is None or len(result['trend'][0]) == 0:
+            ax.text(0.5, 0.5, "HR тренд - таблицата на ударите още не е готова",
+                    ha='center', va='center', transform=ax.transAxes, color='gray')
+            ax.set_xticks([])
+            ax.set_yticks([])
+        else:
+            times, hr = result['trend']
+            ax.plot(times / 3600, hr, color='red', linewidth=0.8)
+            ax.set_ylabel('HR', fontsize=8)
+            ax.set_xlabel('ч', fontsize=8)
+            ax.tick_params(labelsize=7)
+            ax.set_xlim(0, len(self.ecg_data) / self.sampling_rate / 3600)
+            ax.grid(True, alpha=0.3)
+
+            epochs = result['epochs']
+            if len(epochs['start']):
+                rmssd_ax = ax.twinx()
+                # Последната стойност се повтаря в края - стъпката на последната епоха се вижда цяла
+                edges = np.append(epochs['start'], len(self.ecg_data)) / self.sampling_rate / 3600
+                rmssd_ax.step(edges, np.append(epochs['rmssd'], epochs['rmssd'][-1]),
+                              where='post', color='steelblue', linewidth=0.8)
+                rmssd_ax.set_ylabel('RMSSD', fontsize=8, color='steelblue')
+                rmssd_ax.tick_params(labelsize=7, colors='steelblue')
+
+            self.trend_marker = ax.axvline(self.current_position / self.sampling_rate / 3600,
+                                           color='black', linewidth=1.2)
+
+        self.trend_figure.tight_layout(pad=0.3)
+        self.trend_canvas.draw_idle()
+
+    def _update_trend_marker(self, position, window_duration):
+        if self.trend_marker is None or not self.trend_var.get():
+            return
+        center = (position / self.sampling_rate + window_duration / 2) / 3600
+        self.trend_marker.set_xdata([center, center])
+        self.trend_canvas.draw_idle()
 
-            if i >= self.num_leads - cols:
-                ax.set_xlabel('Време (s)', fontsize=9)
-            else:
-                ax.set_xticklabels([])
+    def _on_trend_click(self, event):
+        """Клик върху тренда центрира прозореца на избраното място"""
+        if event.xdata is None or self.ecg_data is None:
+            return
+        window_samples = self.window_samples()
+        center = int(event.xdata * 3600 * self.sampling_rate)
+        self.current_position = max(0, min(center - window_samples // 2,
+                                           len(self.ecg_data) - window_samples))
+        self.update_plot()
 
-            for spine in ax.spines.values():
-                spine.set_edgecolor('#CCCCCC')
-                spine.set_linewidth(1)
+    def show_hrv_dialog(self):
+        """Таблица с HRV метриките по епохи и за целия запис, с експорт в CSV"""
+        if self.ecg_data is None:
+            messagebox.showwarning("Внимание", "Няма заредени данни")
+            return
+        result = self.hrv_result
+        if result is None:
+            self.status_var.set("HRV анализът още не е готов")
+            return
 
-        loaded_time_info = ""
-        if self.file_info:
-            abs_time_sec = self.file_info['loaded_start'] + (self.current_position / self.sampling_rate)
-            loaded_time_info = f" | Абс. време: {abs_time_sec / 60:.1f}мин"
+        dialog = tk.Toplevel(self.root)
+        dialog.title("HRV по епохи")
+        dialog.geometry("760x480")
+        dialog.transient(self.root)
 
-        self.figure.suptitle(
-            f'{self.num_leads}-Lead ECG - Position: {self.current_position / self.sampling_rate:.1f}s '
-            f'({(self.current_position / self.sampling_rate) / 60:.1f}min){loaded_time_info}',
-            fontsize=11, fontweight='bold'
-        )
+        summary = result['summary']
+        if summary is not None:
+            text = (f"Удари: {summary['beats']:,} | HR: {summary['hr']:.0f} bpm | "
+                    f"SDNN: {summary['sdnn']:.0f} ms | RMSSD: {summary['rmssd']:.0f} ms | "
+                    f"pNN50: {summary['pnn50']:.1f}% | SDANN: {summary['sdann']:.0f} ms | "
+                    f"SDNN index: {summary['sdnn_index']:.0f} ms")
+        else:
+            text = "Недостатъчно удари за HRV"
+        ttk.Label(dialog, text=text, font=('Arial', 10, 'bold')).pack(padx=10, pady=10)
+
+        columns = ('start', 'beats', 'hr', 'sdnn', 'rmssd', 'pnn50', 'lf', 'hf', 'lf_hf')
+        headings = ('Начало', 'Удари', 'HR', 'SDNN', 'RMSSD', 'pNN50 %', 'LF', 'HF', 'LF/HF')
+        frame = ttk.Frame(dialog)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10)
+        tree = ttk.Treeview(frame, columns=columns, show='headings')
+        for column, heading in zip(columns, headings):
+            tree.heading(column, text=heading)
+            tree.column(column, width=75, anchor=tk.E)
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        epochs = result['epochs']
+        for i, start in enumerate(epochs['start']):
+            seconds = int(start / self.sampling_rate)
+            values = [f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}", int(epochs['beats'][i])]
+            values += ['' if not np.isfinite(epochs[name][i]) else f"{epochs[name][i]:.{digits}f}"
+                       for name, digits in (('hr', 0), ('sdnn', 1), ('rmssd', 1), ('pnn50', 1),
+                                            ('lf', 0), ('hf', 0), ('lf_hf', 2))]
+            tree.insert('', tk.END, values=values)
+
+        def select_epoch(event):
+            selection = tree.selection()
+            if not selection:
+                return
+            self.current_position = min(int(epochs['start'][tree.index(selection[0])]),
+                                        max(0, len(self.ecg_data) - self.window_samples()))
+            self.update_plot()
 
-        self.figure.tight_layout()
-        self.canvas.draw()
+        tree.bind('<Double-1>', select_epoch)
 
-        hr = self.calculate_heart_rate(data_segment)
-        if hr:
-            self.hr_label.config(text=f"HR: {hr} bpm")
+        def export():
+            filename = filedialog.asksaveasfilename(defaultextension=".csv",
+                                                    filetypes=[("CSV files", "*.csv")])
+            if not filename:
+                return
+            try:
+                self.hrv.export_csv(filename, epochs)
+                self.status_var.set(f"HRV експортиран: {filename}")
+            except OSError as e:
+                messagebox.showerror("Грешка", f"Грешка при експорт:\n{str(e)}")
+
+        ttk.Button(dialog, text="Експорт CSV", command=export).pack(pady=10)
+
+    def next_beat(self):
+        """Центрира прозореца върху следващия удар"""
+        self._jump_to_beat(forward=True)
+
+    def prev_beat(self):
+        """Центрира прозореца върху предишния удар"""
+        self._jump_to_beat(forward=False)
+
+    def _jump_to_beat(self, forward):
+        if self.ecg_data is None or self.ecg_data.beats is None:
+            self.status_var.set("Таблицата на ударите още не е готова")
+            return
+
+        window_samples = self.window_samples()
+        center = self.current_position + window_samples // 2
+        beats = self.ecg_data.beats
+        beat = beats.next_beat(center) if forward else beats.prev_beat(center)
+        if beat is None:
+            return
+
+        self.current_position = max(0, min(beat - window_samples // 2,
+                                           len(self.ecg_data) - window_samples))
+        self.update_plot()
+
+    def toggle_prefilter(self):
+        """Включва/изключва предварителното филтриране на целия запис"""
+        if self.ecg_data is None:
+            return
+
+        if self.prefilter_var.get():
+            self.start_prefilter()
         else:
-            self.hr_label.config(text="HR: -- bpm")
+            self.jobs.cancel_group('prefilter')
+            self.ecg_data.release_caches()
+            self.status_var.set("Предварителното филтриране е изключено")
+
+    def start_prefilter(self):
+        """Стартира фоново филтриране на целия зареден диапазон"""
+        recording = self.ecg_data
+        bank = self.get_filter_bank()
+        cache = recording.filtered_cache
+        if cache is not None and cache.matches(bank) and cache.error is None:
+            return
 
-        self.position_var.set(f"{self.current_position / self.sampling_rate:.1f}")
+        recording.release_caches()
+        chunk_frames = int((FilteredCache.CHUNK_SEC + 2 * FilteredCache.PAD_SEC) * self.sampling_rate)
+        processor = self.get_processor()
+        backend = processor.backend('filter', chunk_frames)
+        workers = 1 if backend.name == 'cupy' else processor.workers()
+
+        sidecar = self._get_sidecar()
+        sidecar_key = None
+        if sidecar is not None and recording.sidecar_key is not None:
+            sidecar_key = sidecar.derive_key(recording.sidecar_key, bank.key)
+            recording.filtered_cache = FilteredCache.from_sidecar(recording, bank, sidecar, sidecar_key)
+            if recording.filtered_cache is not None:
+                self.status_var.set("Целият запис е филтриран - навигацията използва кеша")
+                return
+
+        try:
+            cache = FilteredCache(recording, bank, self.sampling_rate,
+                                  sidecar if sidecar_key else None, sidecar_key, backend, workers)
+        except OSError as e:
+            print(f"Sidecar cache write failed: {e}")
+            cache = FilteredCache(recording, bank, self.sampling_rate, backend=backend, workers=workers)
+        recording.filtered_cache = cache
+
+        def is_current():
+            return self.ecg_data is recording and recording.filtered_cache is cache
+
+        def on_done(result):
+            if is_current() and cache.ready:
+                self.status_var.set("Целият запис е филтриран - навигацията използва кеша")
+
+        def on_error(e):
+            if is_current():
+                self.status_var.set(f"Грешка при предварително филтриране: {e}")
+
+        def on_progress(fraction, message=None):
+            if is_current():
+                self.status_var.set(f"Предварително филтриране... {fraction * 100:.0f}%")
+
+        self.jobs.submit(lambda job: cache.build(job.report_progress), group='prefilter',
+                         background=True, on_done=on_done, on_error=on_error, on_progress=on_progress)
+
+    def toggle_follow(self):
+        """Включва/изключва следенето на дописвания файл"""
+        if not self.follow_var.get():
+            self.stop_follow()
+            self.status_var.set("Следенето на файла е спряно")
+            return
+
+        recording = self.ecg_data
+        if recording is None:
+            self.follow_var.set(False)
+            messagebox.showwarning("Внимание", "Няма заредени данни")
+            return
+        if recording.end_sample < recording.total_samples:
+            self.follow_var.set(False)
+            messagebox.showwarning("Внимание", "Следенето изисква зареден диапазон до края на файла")
+            return
+
+        try:
+            self.live_tail = LiveTail(recording, self.get_processor(use_gpu=False))
+        except ValueError as e:
+            self.follow_var.set(False)
+            messagebox.showerror("Грешка", str(e))
+            return
+
+        self.status_var.set("Следене на файла...")
+        self._schedule_follow()
+
+    def stop_follow(self):
+        self.jobs.cancel_group('follow')
+        self.live_tail = None
+        self.follow_var.set(False)
+
+    def _schedule_follow(self):
+        live_tail = self.live_tail
+        if live_tail is not None:
+            self.root.after(self.FOLLOW_INTERVAL_MS, self._poll_follow, live_tail)
+
+    def _poll_follow(self, live_tail):
+        """Проверка за нови данни във фонова задача - обработват се само дописаните кадри"""
+        if live_tail is not self.live_tail:
+            return
+
+        def on_done(result):
+            if live_tail is not self.live_tail:
+                return
+            if result is not None:
+                self._on_follow_update(*result)
+            self._schedule_follow()
+
+        def on_error(e):
+            print(f"Live tail update failed: {e}")
+            self.status_var.set(f"Грешка при следене на файла: {e}")
+            self._schedule_follow()
+
+        self.jobs.submit(lambda job: live_tail.poll(), group='follow', background=True,
+                         on_done=on_done, on_error=on_error)
+
+    def _on_follow_update(self, old_end, new_end):
+        recording = self.ecg_data
+        self.file_info['total_duration'] = recording.total_samples / self.sampling_rate
+        self.file_info['loaded_end'] = recording.end_sample / self.sampling_rate
+        self.file_info['loaded_duration'] = len(recording) / self.sampling_rate
+
+        # Прозорците в края са подготвени без новите данни
+        self._cancel_prefetch()
+        self.window_cache.clear()
+
+        # Изгледът следва края само ако вече е бил там
+        window_samples = self.window_samples()
+        if self.current_position + window_samples >= old_end:
+            self.current_position = max(0, new_end - window_samples)
+        self.update_plot()
+        self.start_hrv()
+
+        added = (new_end - old_end) / self.sampling_rate
+        self.status_var.set(f"Следене: +{added:.1f}s, записът е {new_end / self.sampling_rate / 60:.1f}мин")
 
     def next_window(self):
         if self.ecg_data is None:
             return
 
-        window_samples = self.window_duration * self.sampling_rate
+        window_samples = self.window_samples()
         self.current_position = min(
             self.current_position + window_samples,
             len(self.ecg_data) - window_samples
@@ -700,7 +2083,7 @@ class ECGViewer:
         if self.ecg_data is None:
             return
 
-        window_samples = self.window_duration * self.sampling_rate
+        window_samples = self.window_samples()
         self.current_position = max(0, self.current_position - window_samples)
         self.update_plot()
 
@@ -716,43 +2099,114 @@ class ECGViewer:
         except ValueError:
             messagebox.showerror("Грешка", "Невалидна позиция")
 
-    def export_csv(self):
+    def export_data(self):
+        """Експорт в CSV (mV) или компактно raw - NPY + JSON, HDF5, EDF+, компресиран .ecgz"""
         if self.ecg_data is None:
             messagebox.showwarning("Внимание", "Няма заредени данни")
             return
 
+        options = self._ask_export_range()
+        if options is None:
+            return
+        start_sample, end_sample, workers = options
+
         filename = filedialog.asksaveasfilename(
             defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+            filetypes=[("CSV files", "*.csv"), ("NumPy + JSON", "*.npy"),
+                       ("HDF5 files", "*.h5 *.hdf5"), ("EDF+ files", "*.edf"),
+                       ("ECGZ (компресиран)", "*.ecgz"), ("All files", "*.*")]
         )
 
         if not filename:
             return
 
-        try:
-            self.status_var.set("Експортиране в CSV...")
-            self.root.update()
-
-            max_rows = 100000
-            export_data = self.ecg_data[:max_rows]
+        fmt = ECGExporter.EXPORT_FORMATS.get(os.path.splitext(filename)[1].lower(), 'csv').upper()
+        self.status_var.set(f"Експортиране в {fmt}...")
 
-            header = ','.join(['Time(s)'] + self.lead_names)
-            time_col = np.arange(len(export_data)) / self.sampling_rate
+        exporter = ECGExporter(self.ecg_data, self.sampling_rate, self.lead_names, self.current_gain)
 
-            with open(filename, 'w') as f:
-                f.write(header + '\n')
-                for i, t in enumerate(time_col):
-                    row = [f"{t:.3f}"] + [f"{export_data[i, j]:.6f}"
-                                          for j in range(self.num_leads)]
-                    f.write(','.join(row) + '\n')
+        def export(job):
+            exporter.export(filename, start_sample, end_sample,
+                            progress=job.report_progress, workers=workers)
 
-            self.status_var.set("CSV експортиран успешно")
+        def on_done(result):
+            self.status_var.set(f"{fmt} експортиран успешно")
             messagebox.showinfo("Успех", f"Данните са експортирани в:\n{filename}")
 
-        except Exception as e:
+        def on_error(e):
             messagebox.showerror("Грешка", f"Грешка при експорт:\n{str(e)}")
             self.status_var.set("Грешка при експорт")
 
+        def on_progress(fraction, message=None):
+            self.status_var.set(f"Експортиране в {fmt}... {fraction * 100:.0f}%")
+
+        self.jobs.submit(export, group='export', on_done=on_done, on_error=on_error,
+                         on_progress=on_progress)
+
+    def _ask_export_range(self):
+        """Диалог за диапазона на експорта - връща (start_sample, end_sample, workers) или None"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Експорт")
+        dialog.geometry("400x300")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        options_frame = ttk.LabelFrame(dialog, text="Диапазон", padding=10)
+        options_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        range_option = tk.StringVar(value="full")
+        ttk.Radiobutton(options_frame, text="Целият зареден диапазон",
+                        variable=range_option, value="full").pack(anchor=tk.W, pady=2)
+        ttk.Radiobutton(options_frame, text="Текущият прозорец",
+                        variable=range_option, value="window").pack(anchor=tk.W, pady=2)
+        ttk.Radiobutton(options_frame, text="Персонализиран диапазон:",
+                        variable=range_option, value="custom").pack(anchor=tk.W, pady=2)
+
+        custom_frame = ttk.Frame(options_frame)
+        custom_frame.pack(fill=tk.X, padx=20)
+        ttk.Label(custom_frame, text="От (сек):").pack(side=tk.LEFT, padx=5)
+        start_var = tk.StringVar(value="0")
+        ttk.Entry(custom_frame, textvariable=start_var, width=10).pack(side=tk.LEFT, padx=5)
+        ttk.Label(custom_frame, text="До (сек):").pack(side=tk.LEFT, padx=5)
+        end_var = tk.StringVar(value=f"{len(self.ecg_data) / self.sampling_rate:.0f}")
+        ttk.Entry(custom_frame, textvariable=end_var, width=10).pack(side=tk.LEFT, padx=5)
+
+        parallel_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text=f"Паралелно форматиране/компресия ({os.cpu_count() or 1} ядра)",
+                        variable=parallel_var).pack(anchor=tk.W, pady=10)
+
+        result = {}
+
+        def on_ok():
+            option = range_option.get()
+            if option == "full":
+                start, end = 0, len(self.ecg_data)
+            elif option == "window":
+                start = self.current_position
+                end = start + self.window_samples()
+            else:
+                try:
+                    start = int(float(start_var.get()) * self.sampling_rate)
+                    end = int(float(end_var.get()) * self.sampling_rate)
+                except ValueError:
+                    messagebox.showerror("Грешка", "Невалидни стойности за диапазон")
+                    return
+                if end <= start:
+                    messagebox.showerror("Грешка", "Крайната позиция трябва да е по-голяма от началната")
+                    return
+
+            result['options'] = (start, min(end, len(self.ecg_data)),
+                                 (os.cpu_count() or 1) if parallel_var.get() else 1)
+            dialog.destroy()
+
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(button_frame, text="Продължи", command=on_ok).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Отказ", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+
+        dialog.wait_window()
+        return result.get('options')
+
     def save_plot(self):
         if self.ecg_data is None:
             messagebox.showwarning("Внимание", "Няма заредени данни")
@@ -765,17 +2219,18 @@ class ECGViewer:
         )
 
         if filename:
-            self.figure.savefig(filename, dpi=300, bbox_inches='tight')
+            self.renderer.savefig(filename, dpi=300, bbox_inches='tight')
             messagebox.showinfo("Успех", f"Графиката е запазена в:\n{filename}")
 
     def apply_gain(self):
-        if self.ecg_data_raw is None:
+        if self.ecg_data is None:
             return
 
         try:
             gain = float(self.gain_var.get())
             self.current_gain = gain
-            self.ecg_data = self.ecg_data_raw * gain
+            # Gain е стъпка от веригата на прозореца - записът не се копира
+            self.ecg_data.gain = gain
             self.update_plot()
             self.status_var.set(f"Мащаб приложен: {gain}x")
         except ValueError:
@@ -785,15 +2240,19 @@ class ECGViewer:
         if self.ecg_data is None:
             return
 
-        sample_size = min(10000, len(self.ecg_data))
-        sample_data = self.ecg_data[:sample_size]
-
-        amplitudes = []
-        for i in range(self.num_leads):
-            lead_data = sample_data[:, i]
-            amp = np.percentile(lead_data, 95) - np.percentile(lead_data, 5)
-            if amp > 0:
-                amplitudes.append(amp)
+        # Амплитуди (p95 - p5, mV при gain 1) в текущия прозорец - от индекса на статистиките,
+        # докато той се строи - директно от данните
+        with self.tracer.span('auto_scale'):
+            recording = self.ecg_data
+            start = self.current_position
+            end = min(start + self.window_samples(), len(recording))
+            window = recording.stats.query(start, end) if recording.stats is not None else None
+            if window is not None:
+                low, high = window['quantiles'][0], window['quantiles'][-1]
+            else:
+                sample_end = min(end, start + 60 * self.sampling_rate)
+                low, high = np.percentile(recording.window(start, sample_end, gain=1.0), [5, 95], axis=0)
+            amplitudes = [amp for amp in high - low if amp > 0]
 
         if amplitudes:
             median_amp = np.median(amplitudes)
@@ -806,98 +2265,25 @@ class ECGViewer:
             self.gain_var.set(str(suggested_gain))
             self.apply_gain()
 
-    def filter_ecg_signal(self, data):
-        """Филтрира ECG сигнал с GPU или CPU"""
-        if GPU_AVAILABLE and cp is not None and self.use_gpu.get() and len(data) > 10000:
-            return self._filter_gpu(data)
-        else:
-            return self._filter_cpu(data)
+    def get_processor(self, use_gpu=None):
+        """Обработката от ecg_core с текущите настройки"""
+        if use_gpu is None:
+            use_gpu = self.use_gpu.get()
+        return ECGProcessor(self.sampling_rate, self.filter_band, self.notch_freq, self.notch_q, use_gpu)
 
-    def _filter_gpu(self, data):
-        """GPU-ускорено филтриране"""
-        if cp is None:
-            return self._filter_cpu(data)
-
-        try:
-            # Прехвърляме към GPU
-            gpu_data = cp.array(data)
-            filtered_data = cp.zeros_like(gpu_data)
-
-            nyquist = self.sampling_rate / 2
-            low_freq = 0.5 / nyquist
-            high_freq = 40.0 / nyquist
-
-            # Bandpass filter
-            b, a = signal.butter(4, [low_freq, high_freq], btype='band')
-            b_gpu = cp.array(b)
-            a_gpu = cp.array(a)
-
-            # Notch filter
-            notch_freq = 50.0 / nyquist
-            b_notch, a_notch = signal.iirnotch(notch_freq, 30)
-            b_notch_gpu = cp.array(b_notch)
-            a_notch_gpu = cp.array(a_notch)
-
-            for i in range(self.num_leads):
-                # За GPU filtering използваме scipy на CPU, но паралелно
-                lead_cpu = cp.asnumpy(gpu_data[:, i])
-                filtered_lead = signal.filtfilt(b, a, lead_cpu)
-                filtered_lead = signal.filtfilt(b_notch, a_notch, filtered_lead)
-                filtered_data[:, i] = cp.array(filtered_lead)
-
-            return cp.asnumpy(filtered_data)
-        except Exception as e:
-            print(f"GPU filtering failed: {e}, falling back to CPU")
-            return self._filter_cpu(data)
-
-    def _filter_cpu(self, data):
-        """CPU филтриране"""
-        filtered_data = np.zeros_like(data)
-
-        nyquist = self.sampling_rate / 2
-        low_freq = 0.5 / nyquist
-        high_freq = 40.0 / nyquist
-
-        b, a = signal.butter(4, [low_freq, high_freq], btype='band')
-        notch_freq = 50.0 / nyquist
-        b_notch, a_notch = signal.iirnotch(notch_freq, 30)
-
-        for i in range(self.num_leads):
-            filtered_lead = signal.filtfilt(b, a, data[:, i])
-            filtered_lead = signal.filtfilt(b_notch, a_notch, filtered_lead)
-            filtered_data[:, i] = filtered_lead
+    def filter_ecg_signal(self, data, use_gpu=None):
+        """Филтрира ECG сигнал с GPU или CPU"""
+        return self.get_processor(use_gpu).filter(data)
 
-        return filtered_data
+    def get_filter_bank(self):
+        """Кеширан филтър за текущите параметри"""
+        return FilterBank.get(self.sampling_rate, self.filter_band, self.notch_freq, self.notch_q)
 
-    def calculate_heart_rate(self, data_segment):
+    def calculate_heart_rate(self, data_segment, is_filtered=None, use_gpu=None):
         """Изчислява heart rate"""
-        try:
-            # Използваме Lead II ако съществува, иначе първото отвеждане
-            lead_idx = min(1, self.num_leads - 1)
-            lead_data = data_segment[:, lead_idx]
-
-            if not self.filter_var.get():
-                lead_filtered = self.filter_ecg_signal(data_segment)[:, lead_idx]
-            else:
-                lead_filtered = lead_data
-
-            threshold = np.std(lead_filtered) * 0.6
-            min_distance = int(0.4 * self.sampling_rate)
-
-            peaks, _ = signal.find_peaks(lead_filtered,
-                                         height=threshold,
-                                         distance=min_distance)
-
-            if len(peaks) > 1:
-                rr_intervals = np.diff(peaks) / self.sampling_rate
-                mean_rr = np.mean(rr_intervals)
-                heart_rate = 60.0 / mean_rr
-
-                return int(heart_rate)
-            else:
-                return None
-        except:
-            return None
+        if is_filtered is None:
+            is_filtered = self.filter_var.get()
+        return self.get_processor(use_gpu).heart_rate(data_segment, is_filtered)
 
 
 if __name__ == "__main__":
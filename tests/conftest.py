@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def ecg_signal():
+    """(samples, leads) float32 - синтетичен ECG с удари, дишане и шум, 1000 Hz"""
+    def make(seconds=30.0, num_leads=3, sampling_rate=1000, seed=0):
+        rng = np.random.default_rng(seed)
+        t = np.arange(int(seconds * sampling_rate)) / sampling_rate
+        beats = np.zeros_like(t)
+        for peak in np.arange(0.4, seconds, 60.0 / 72):
+            beats += 1.2 * np.exp(-0.5 * ((t - peak) / 0.012) ** 2)
+        gains = np.linspace(0.5, 1.2, num_leads)
+        data = beats[:, None] * gains[None, :] + 0.2 * np.sin(2 * np.pi * 0.25 * t)[:, None]
+        data += 0.02 * rng.standard_normal(data.shape)
+        return data.astype(np.float32)
+    return make
+
+
+@pytest.fixture
+def write_recording(tmp_path, ecg_signal):
+    """Записва int16 interleaved файл (стойност = mV * scale) след header - връща пътя"""
+    def write(name='recording.BIN', data=None, header=b'', scale=200.0, **signal_args):
+        data = ecg_signal(**signal_args) if data is None else data
+        path = tmp_path / name
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.write(np.round(data * scale).astype('<i2').tobytes())
+        return str(path)
+    return write
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from scipy import signal
+
+from ecg_core import GPU_AVAILABLE, ComputeBackend, FilterBank, NumpyBackend, ThreadedNumpyBackend
+
+# Грешка спрямо NumPy, отнесена към стандартното отклонение на сигнала - като ComputeBackend.check()
+TOLERANCE = ComputeBackend.TOLERANCE
+
+
+def assert_close(actual, expected, scale=1.0):
+    assert actual.shape == expected.shape
+    assert actual.dtype == expected.dtype
+    assert np.max(np.abs(actual - expected)) / scale <= TOLERANCE
+
+
+def compare(backend, reference, data):
+    """Сравнява всички ядра на backend с референтния (NumPy)"""
+    raw = (data * 200).astype(np.int16)
+    offset = raw.mean(axis=0)
+    assert_close(backend.decode(raw, offset, 0.005), reference.decode(raw, offset, 0.005))
+
+    sos = FilterBank.get(1000).sos
+    expected = reference.sosfiltfilt(sos, data)
+    assert_close(backend.sosfiltfilt(sos, data), expected, float(np.std(expected)))
+
+    blocks = data[:len(data) // 250 * 250].reshape(-1, 250, data.shape[1])
+    assert_close(backend.median(blocks, axis=1), reference.median(blocks, axis=1), float(np.std(data)))
+
+    envelope = expected[:, 0] ** 2
+    height = float(np.percentile(envelope, 90))
+    np.testing.assert_array_equal(backend.find_peaks(envelope, height, 250),
+                                  reference.find_peaks(envelope, height, 250))
+
+    # Последният bin е непълен
+    for actual, wanted in zip(backend.minmax(data, 64), reference.minmax(data, 64)):
+        assert_close(actual, wanted, float(np.std(data)))
+
+
+def test_numpy_backend_matches_scipy(ecg_signal):
+    data = ecg_signal(seconds=20.0, num_leads=12)
+    backend = NumpyBackend()
+    sos = FilterBank.get(1000).sos
+
+    filtered = backend.sosfiltfilt(sos, data)
+    assert filtered.dtype == np.float32
+    np.testing.assert_allclose(filtered, signal.sosfiltfilt(sos, data, axis=0), rtol=1e-5, atol=1e-6)
+    blocks = data.reshape(-1, 500, 12)
+    np.testing.assert_array_equal(backend.median(blocks, axis=1), np.median(blocks, axis=1))
+    assert backend.check() == 0.0
+
+
+def test_gpu_request_without_cupy_falls_back():
+    if GPU_AVAILABLE:
+        pytest.skip("CuPy е наличен")
+    assert ComputeBackend.get(use_gpu=True).name == 'numpy'
+
+
+@pytest.mark.parametrize('workers', [1, 3, 4])
+def test_threaded_matches_numpy(ecg_signal, workers):
+    data = ecg_signal(seconds=20.0, num_leads=12)[:19999]
+    compare(ThreadedNumpyBackend(workers), NumpyBackend(), data)
+
+
+def test_threaded_more_workers_than_leads(ecg_signal):
+    data = ecg_signal(seconds=5.0, num_leads=2)
+    compare(ThreadedNumpyBackend(8), NumpyBackend(), data)
+
+
+def test_cupy_matches_numpy(ecg_signal):
+    pytest.importorskip('cupy')
+    backend = ComputeBackend.get(use_gpu=True)
+    if backend.name != 'cupy':
+        pytest.skip("CuPy backend не е наличен или не мина проверката")
+    compare(backend, NumpyBackend(), ecg_signal(seconds=20.0, num_leads=12))
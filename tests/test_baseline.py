@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from ecg_core import BlockBaseline
+
+# 2 s блокове при 1000 Hz - стъпката на децимацията (7) не дели блока
+BLOCK_SIZE = 2000
+
+
+def block_medians(raw, block_size=BLOCK_SIZE):
+    """Медиана на всеки блок по всички семпли (последният може да е непълен)"""
+    return np.array([np.median(raw[i:i + block_size], axis=0) for i in range(0, len(raw), block_size)])
+
+
+@pytest.fixture
+def raw():
+    # Рампа и бавна синусоида - изместване на точките в блока променя медианата
+    t = np.arange(401500, dtype=np.float64)
+    return np.stack([t / 10.0, 500.0 * np.sin(2 * np.pi * t / 60000.0)], axis=1)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Няколко части при оценката - проверява и границите им
+    monkeypatch.setattr(BlockBaseline, 'CHUNK_FRAMES', 50000)
+
+
+def assert_matches_blocks(baseline, raw):
+    expected = block_medians(raw)
+    assert len(baseline.positions) == len(expected)
+    np.testing.assert_allclose(baseline.positions[:-1], BLOCK_SIZE * (np.arange(len(expected) - 1) + 0.5))
+    # Децимираната медиана се отклонява от пълната с не повече от една стъпка по наклона
+    step = BLOCK_SIZE // BlockBaseline.MAX_BLOCK_POINTS
+    slope = np.max(np.abs(np.diff(raw, axis=0)), axis=0)
+    assert np.all(np.abs(baseline.values - expected) <= step * slope + 1e-3)
+
+
+def test_estimate_matches_full_resolution_medians(raw):
+    assert BLOCK_SIZE % (BLOCK_SIZE // BlockBaseline.MAX_BLOCK_POINTS) != 0
+    assert_matches_blocks(BlockBaseline.estimate(raw, BLOCK_SIZE), raw)
+
+
+def test_extended_matches_full_resolution_medians(raw):
+    # Първата част свършва по средата на блок
+    baseline = BlockBaseline.estimate(raw[:250700], BLOCK_SIZE)
+    assert_matches_blocks(baseline.extended(raw, BLOCK_SIZE), raw)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from ecg_core import BeatDetector, BeatTable, ECGRecording, SidecarCache
+
+SECONDS = 150.0
+
+
+def true_peaks(seconds=SECONDS, fs=1000):
+    """Позиции на ударите в ecg_signal - 72 bpm от 0.4 s"""
+    return np.round(np.arange(0.4, seconds, 60.0 / 72) * fs).astype(np.int64)
+
+
+@pytest.fixture(scope='module')
+def table(tmp_path_factory):
+    # 150 s - няколко блока по CHUNK_SEC, ударите по границите не се дублират
+    t = np.arange(int(SECONDS * 1000)) / 1000
+    beats = np.zeros_like(t)
+    for peak in true_peaks() / 1000:
+        beats += 1.2 * np.exp(-0.5 * ((t - peak) / 0.012) ** 2)
+    noise = 0.02 * np.random.default_rng(0).standard_normal((len(t), 3))
+    data = beats[:, None] * np.array([0.5, 1.0, 0.8]) + 0.2 * np.sin(2 * np.pi * 0.25 * t)[:, None] + noise
+    filename = tmp_path_factory.mktemp('beats') / 'train.BIN'
+    filename.write_bytes(np.round(data * 200).astype('<i2').tobytes())
+    return BeatDetector(1000).detect(ECGRecording(str(filename), 3))
+
+
+def test_detects_synthetic_train(table):
+    expected = true_peaks()
+    assert len(table) == len(expected)
+    assert np.max(np.abs(table.samples - expected)) <= 3
+    assert np.all(np.diff(table.samples) > 0)
+    assert np.isnan(table.rr[0])
+    np.testing.assert_allclose(table.rr[1:], 60.0 / 72, atol=0.005)
+    assert table.heart_rate(0, int(table.samples[-1]) + 1) in (71, 72)
+
+
+def test_next_and_prev_beat(table):
+    first, second = int(table.samples[0]), int(table.samples[1])
+
+    assert table.next_beat(0) == first
+    assert table.next_beat(first) == second
+    assert table.prev_beat(second) == first
+    assert table.prev_beat(first) is None
+    assert table.next_beat(int(table.samples[-1])) is None
+    assert table.between(first, second + 1) == (0, 2)
+
+
+def test_sidecar_round_trip(tmp_path, table):
+    sidecar = SidecarCache(root=str(tmp_path))
+    table.save(sidecar, 'key')
+    loaded = BeatTable.load(sidecar, 'key', 1000)
+
+    np.testing.assert_array_equal(loaded.samples, table.samples)
+    np.testing.assert_array_equal(loaded.quality, table.quality)
+    assert BeatTable.load(sidecar, 'missing', 1000) is None
+
+
+def test_truncate(table):
+    position = int(table.samples[10])
+    truncated = table.truncate(position)
+
+    assert len(truncated) == 10
+    np.testing.assert_array_equal(truncated.samples, table.samples[:10])
+    np.testing.assert_array_equal(truncated.rr, table.rr[:10])
+    assert len(table.truncate(0)) == 0
+    assert len(table.truncate(int(table.samples[-1]) + 1)) == len(table)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from ecg_core import ChunkedFilter, FilterBank
+
+
+def run_filter(data, bank, chunk_size, pad, workers):
+    out = np.full(data.shape, np.nan, dtype=np.float32)
+
+    def write(start, end, filtered):
+        out[start:end] = filtered
+
+    chunked = ChunkedFilter(bank, chunk_size, pad, workers)
+    assert chunked.run(lambda start, end: data[start:end], write, len(data))
+    return out
+
+
+@pytest.mark.parametrize('workers', [2, 4, 7])
+@pytest.mark.parametrize('chunk_size, pad', [
+    (4000, 1500),   # padding-ът стига само до съседната част
+    (1000, 2500),   # padding-ът прескача границите на няколко части
+])
+def test_result_independent_of_workers(ecg_signal, workers, chunk_size, pad):
+    # 30.5 s - последната част е непълна
+    data = ecg_signal(seconds=30.5, num_leads=4)
+    bank = FilterBank.get(1000)
+    assert len(data) % chunk_size != 0
+    # Достатъчно части за паралелния път (цели части в нишките)
+    assert len(ChunkedFilter(bank, chunk_size, pad).chunks(len(data))) >= workers
+
+    serial = run_filter(data, bank, chunk_size, pad, workers=1)
+    parallel = run_filter(data, bank, chunk_size, pad, workers=workers)
+
+    assert not np.isnan(serial).any()
+    assert np.array_equal(serial, parallel)
+
+
+def test_fewer_chunks_than_workers(ecg_signal):
+    # По-малко части от нишките - нишките делят отвежданията
+    data = ecg_signal(seconds=10.0, num_leads=12)
+    bank = FilterBank.get(1000)
+
+    serial = run_filter(data, bank, 4000, 1500, workers=1)
+    parallel = run_filter(data, bank, 4000, 1500, workers=8)
+
+    assert np.array_equal(serial, parallel)
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from ecg_core import BackendDispatcher
+
+
+@pytest.fixture
+def small_sizes(monkeypatch):
+    # Калибриране само с малки размери - бързо и без GPU
+    monkeypatch.setattr(BackendDispatcher, 'SIZES', (1 << 10, 1 << 12))
+    monkeypatch.setattr(BackendDispatcher, 'REPEATS', 1)
+
+
+def test_calibrate_writes_ranking(tmp_path, small_sizes):
+    path = tmp_path / 'backends.json'
+    dispatcher = BackendDispatcher(path=str(path), use_gpu=False, workers=2)
+    assert dispatcher.needs_calibration()
+
+    steps = []
+    ranking = dispatcher.calibrate(progress=steps.append)
+
+    assert steps[-1] == pytest.approx(1.0)
+    assert set(ranking) == set(BackendDispatcher.KERNELS)
+    for entries in ranking.values():
+        assert entries[0][0] == 0
+        for _, order in entries:
+            assert sorted(order) == ['numpy', 'threads']
+
+    saved = json.loads(path.read_text(encoding='utf-8'))
+    assert saved['backends'] == ['numpy', 'threads']
+    assert not list(tmp_path.glob('*.partial'))
+    assert not dispatcher.needs_calibration()
+
+
+def test_persisted_ranking_is_loaded(tmp_path, small_sizes):
+    path = str(tmp_path / 'backends.json')
+    ranking = BackendDispatcher(path=path, workers=2).calibrate()
+
+    loaded = BackendDispatcher(path=path, workers=2)
+    assert loaded.ranking == ranking
+    assert not loaded.needs_calibration()
+    for kernel, entries in ranking.items():
+        for min_size, order in entries:
+            assert loaded.select(kernel, min_size).name == order[0]
+
+
+def test_missing_or_broken_config_uses_defaults(tmp_path):
+    assert BackendDispatcher(path=str(tmp_path / 'missing.json')).ranking == BackendDispatcher.DEFAULT_RANKING
+
+    broken = tmp_path / 'broken.json'
+    broken.write_text('{', encoding='utf-8')
+    dispatcher = BackendDispatcher(path=str(broken))
+    assert dispatcher.ranking == BackendDispatcher.DEFAULT_RANKING
+    assert dispatcher.needs_calibration()
+
+
+def test_select_switches_at_threshold(tmp_path):
+    path = str(tmp_path / 'backends.json')
+    dispatcher = BackendDispatcher(path=path, workers=2)
+    dispatcher.ranking = {'filter': [[0, ['numpy', 'threads']], [50000, ['threads', 'numpy']]]}
+    dispatcher.save()
+
+    loaded = BackendDispatcher(path=path, workers=2)
+    assert loaded.select('filter', 1000).name == 'numpy'
+    assert loaded.select('filter', 49999).name == 'numpy'
+    assert loaded.select('filter', 50000).name == 'threads'
+    assert loaded.select('filter', 1 << 20).name == 'threads'
+    # Ядро без измерване - NumPy
+    assert loaded.select('peaks', 1 << 20).name == 'numpy'
+
+
+def test_unavailable_backend_falls_back(tmp_path):
+    dispatcher = BackendDispatcher(path=str(tmp_path / 'backends.json'), use_gpu=False, workers=2)
+    dispatcher.ranking = {'filter': [[0, ['cupy', 'threads', 'numpy']]]}
+    assert dispatcher.select('filter', 1 << 16).name == 'threads'
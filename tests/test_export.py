@@ -0,0 +1,138 @@
+import json
+
+import numpy as np
+import pytest
+
+from ecg_core import ECGExporter, ECGRecording, ECGZContainer, JobCancelled
+
+
+@pytest.fixture
+def exporter(write_recording, monkeypatch):
+    # Малки блокове - експортът минава през няколко
+    monkeypatch.setattr(ECGExporter, 'CHUNK_FRAMES', 4096)
+    recording = ECGRecording(write_recording(seconds=20.0), 3)
+    return ECGExporter(recording, 1000, ['I', 'II', 'III'], gain=2.0)
+
+
+
+def cancel_halfway(fraction):
+    if fraction >= 0.5:
+        raise JobCancelled()
+
+def test_csv_matches_window(tmp_path, exporter):
+    target = tmp_path / 'out.csv'
+    fractions = []
+    exporter.export_csv(str(target), 1500, 11000, progress=fractions.append)
+
+    lines = target.read_text().splitlines()
+    assert lines[0] == 'Time(s),I,II,III'
+    table = np.loadtxt(target, delimiter=',', skiprows=1)
+    np.testing.assert_allclose(table[:, 0], np.arange(1500, 11000) / 1000)
+    np.testing.assert_allclose(table[:, 1:], exporter.recording.window(1500, 11000, 2.0), atol=1e-6)
+    assert fractions[-1] == 1.0
+
+
+def test_parallel_csv_is_identical(tmp_path, exporter):
+    serial, parallel = tmp_path / 'serial.csv', tmp_path / 'parallel.csv'
+    exporter.export_csv(str(serial), 0, 15000)
+    exporter.export_csv(str(parallel), 0, 15000, workers=2)
+
+    assert parallel.read_bytes() == serial.read_bytes()
+
+
+def read_edf(filename, num_leads, fs):
+    """Данните от EDF+ файл като (samples, leads) int16 - без annotation сигнала"""
+    content = open(filename, 'rb').read()
+    header_bytes = int(content[184:192])
+    num_records = int(content[236:244])
+    signals = int(content[252:256])
+    assert signals == num_leads + 1
+    labels = [content[256 + 16 * i:256 + 16 * (i + 1)].decode('ascii').strip() for i in range(signals)]
+    records = np.frombuffer(content[header_bytes:], dtype='<i2').reshape(num_records, -1)
+    data = records[:, :num_leads * fs].reshape(num_records, num_leads, fs).transpose(0, 2, 1)
+    return labels, data.reshape(-1, num_leads)
+
+
+def test_npy_export_with_metadata(tmp_path, exporter):
+    target = tmp_path / 'out.npy'
+    exporter.export(str(target), 1000, 9000)
+
+    np.testing.assert_array_equal(np.load(target), exporter.recording.raw[1000:9000])
+    metadata = json.loads((tmp_path / 'out.json').read_text(encoding='utf-8'))
+    assert metadata['num_samples'] == 8000 and metadata['start_sample'] == 1000
+    assert metadata['lead_names'] == ['I', 'II', 'III'] and metadata['sampling_rate'] == 1000
+
+
+def test_hdf5_export(tmp_path, exporter):
+    h5py = pytest.importorskip('h5py')
+    target = tmp_path / 'out.h5'
+    exporter.export(str(target), 1000, 9000)
+
+    with h5py.File(target, 'r') as f:
+        np.testing.assert_array_equal(f['ecg'][:], exporter.recording.raw[1000:9000])
+        assert f['ecg'].attrs['scale'] == exporter.recording.scale
+
+
+def test_edf_export(tmp_path, exporter):
+    target = tmp_path / 'out.edf'
+    exporter.export(str(target), 1000, 9500)
+
+    labels, data = read_edf(target, 3, 1000)
+    assert labels == ['I', 'II', 'III', 'EDF Annotations']
+    # Последният 1-секунден запис е допълнен с нули
+    assert len(data) == 9000
+    np.testing.assert_array_equal(data[:8500], exporter.recording.raw[1000:9500])
+    assert not data[8500:].any()
+
+
+def test_ecgz_export_round_trip(tmp_path, exporter):
+    target = str(tmp_path / 'out.ecgz')
+    exporter.export(target, 1000, 19000, workers=2)
+
+    container = ECGZContainer(target)
+    assert ECGZContainer.is_container(target)
+    assert container.metadata['lead_names'] == ['I', 'II', 'III']
+    np.testing.assert_array_equal(container.array()[:], exporter.recording.raw[1000:19000])
+    # Четене на части - през границите на блоковете
+    np.testing.assert_array_equal(container.array(9500, 10500)[:], exporter.recording.raw[10500:11500])
+
+    # Контейнерът се отваря като запис със същите стойности
+    recording = ECGRecording(target, 3, layout=container.layout())
+    np.testing.assert_allclose(recording.window(0, 5000, 1.0), exporter.recording.window(1000, 6000, 1.0))
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.npy', '.h5', '.edf', '.ecgz'])
+def test_export_replaces_destination(tmp_path, exporter, extension):
+    if extension == '.h5':
+        pytest.importorskip('h5py')
+    target = tmp_path / f'out{extension}'
+
+    exporter.export(str(target), 0, 5000)
+
+    assert target.exists()
+    assert not list(tmp_path.glob('*.partial'))
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.npy', '.h5', '.edf', '.ecgz'])
+def test_cancelled_export_leaves_no_files(tmp_path, exporter, extension):
+    if extension == '.h5':
+        pytest.importorskip('h5py')
+    target = tmp_path / f'out{extension}'
+
+    with pytest.raises(JobCancelled):
+        exporter.export(str(target), progress=cancel_halfway)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['recording.BIN']
+
+
+def test_cancelled_export_keeps_previous_file(tmp_path, exporter):
+    target = tmp_path / 'out.npy'
+    exporter.export(str(target), 0, 2000)
+    previous = target.read_bytes()
+
+    with pytest.raises(JobCancelled):
+        exporter.export(str(target), progress=cancel_halfway)
+
+    assert target.read_bytes() == previous
+    assert json.loads((tmp_path / 'out.json').read_text(encoding='utf-8'))['num_samples'] == 2000
+    assert not list(tmp_path.glob('*.partial'))
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+from ecg_core import ECGRecording, FilterBank, FilteredCache, SidecarCache
+
+
+def test_cache_matches_full_filtering(write_recording):
+    # 150 s - три части по CHUNK_SEC, последната непълна
+    recording = ECGRecording(write_recording(seconds=150.0), 3)
+    bank = FilterBank.get(1000)
+    cache = FilteredCache(recording, bank, 1000)
+    cache.build()
+
+    assert cache.ready and cache.error is None
+    assert cache.matches(bank) and not cache.matches(FilterBank.get(1000, band=(1.0, 40.0)))
+    expected = bank.apply(recording.window(0, len(recording), gain=1.0))
+    # На границите на частите остава само затихналият след PAD_SEC преходен процес
+    assert np.max(np.abs(cache.data[:] - expected)) / np.std(expected) < 2e-3
+
+
+def test_segment_and_close(write_recording):
+    recording = ECGRecording(write_recording(seconds=20.0), 3)
+    cache = FilteredCache(recording, FilterBank.get(1000), 1000)
+    cache.build()
+
+    np.testing.assert_array_equal(cache.segment(1000, 3000, gain=2.0), cache.data[1000:3000] * np.float32(2.0))
+    path = cache.path
+    cache.close()
+    assert cache.data is None and not cache.ready
+    assert not os.path.exists(path)
+
+
+def test_sidecar_round_trip(tmp_path, write_recording):
+    filename = write_recording(seconds=20.0)
+    recording = ECGRecording(filename, 3)
+    bank = FilterBank.get(1000)
+    sidecar = SidecarCache(root=str(tmp_path / 'cache'))
+    key = sidecar.derive_key(sidecar.make_key(filename, num_leads=3), bank.key)
+
+    assert FilteredCache.from_sidecar(recording, bank, sidecar, key) is None
+    built = FilteredCache(recording, bank, 1000, sidecar, key)
+    built.build()
+    assert built.ready
+
+    loaded = FilteredCache.from_sidecar(recording, bank, sidecar, key)
+    assert loaded is not None and loaded.ready and loaded.matches(bank)
+    np.testing.assert_array_equal(loaded.data, built.data)
+
+    # Друг диапазон на записа - кешираният сигнал не пасва
+    shorter = ECGRecording(filename, 3, start_sample=0, end_sample=10000)
+    assert FilteredCache.from_sidecar(shorter, bank, sidecar, key) is None
+
+
+def test_covers_loaded_range_only(tmp_path, ecg_signal):
+    frames = np.round(ecg_signal(seconds=20.0) * 200).astype('<i2')
+    path = tmp_path / 'growing.BIN'
+    path.write_bytes(frames[:15000].tobytes())
+    recording = ECGRecording(str(path), 3)
+    cache = FilteredCache(recording, FilterBank.get(1000), 1000)
+    cache.build()
+
+    # Дописаните след филтрирането кадри не са в кеша
+    with open(path, 'ab') as f:
+        f.write(frames[15000:].tobytes())
+    recording.refresh()
+    assert cache.covers(0, 15000)
+    assert cache.covers(14000, 15000)
+    assert not cache.covers(14000, 16000)
+    cache.close()
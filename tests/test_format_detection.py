@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from ecg_benchmark import synthesize
+from ecg_core import BeatDetector, ECGRecording, FileLayout, FormatDetector, FormatProfiles
+
+
+def write_layout(path, data, header=b'', width=2, byteorder='<', interleaved=True):
+    """Записва (samples, leads) mV като цели стойности (x200) в дадената подредба"""
+    values = np.round(data * 200).astype(np.int64)
+    if not interleaved:
+        values = values.T
+    values = values.ravel()
+    if width == 3:
+        raw = (values & 0xFFFFFF).astype('<u4').view(np.uint8).reshape(-1, 4)[:, :3]
+        payload = (raw[:, ::-1] if byteorder == '>' else raw).tobytes()
+    else:
+        payload = values.astype(f'{byteorder}i{width}').tobytes()
+    path.write_bytes(header + payload)
+    return str(path)
+
+
+def text_header(size):
+    text = b'ECG RECORDER v2.1 PATIENT 0001 ' * (size // 31 + 1)
+    return text[:size]
+
+
+@pytest.mark.parametrize('header_size, num_leads, width, byteorder, interleaved', [
+    (0, 12, 2, '<', True),
+    (512, 12, 2, '<', True),
+    (256, 8, 2, '>', True),
+    (128, 3, 3, '<', True),
+    (0, 4, 2, '<', False),
+])
+def test_detects_layout(tmp_path, ecg_signal, header_size, num_leads, width, byteorder, interleaved):
+    # Различно ниво по отвеждания - при последователна подредба границите им са скокове
+    data = ecg_signal(seconds=30.0, num_leads=num_leads) + 0.5 * np.arange(num_leads, dtype=np.float32)
+    filename = write_layout(tmp_path / 'recording.BIN', data, text_header(header_size), width, byteorder,
+                            interleaved)
+
+    layout, confidence = FormatDetector(filename).detect()
+
+    assert layout is not None and confidence > 0
+    assert (layout.header_size, layout.num_leads, layout.sample_width, layout.byteorder, layout.interleaved) == \
+        (header_size, num_leads, width, byteorder, interleaved)
+    recording = ECGRecording(filename, num_leads, layout=layout)
+    np.testing.assert_allclose(recording.window(0, len(recording), gain=1.0),
+                               np.round(data * 200) / 200, atol=1e-6)
+
+
+def test_profiles_match_same_device(tmp_path, ecg_signal):
+    data = ecg_signal(seconds=5.0, num_leads=8)
+    first = write_layout(tmp_path / 'first.BIN', data, text_header(256))
+    second = write_layout(tmp_path / 'second.BIN', data[:3000], text_header(256))
+    other = write_layout(tmp_path / 'other.BIN', data, b'X' * 256)
+    profiles = FormatProfiles(path=str(tmp_path / 'formats.json'))
+    layout = FileLayout(header_size=256, num_leads=8)
+
+    assert profiles.match(first) is None
+    profiles.save('Holter', first, layout)
+
+    name, matched = profiles.match(second)
+    assert name == 'Holter'
+    assert (matched.header_size, matched.num_leads) == (256, 8)
+    # Друго начало на header-а - друго устройство
+    assert profiles.match(other) is None
+
+
+@pytest.mark.parametrize('header_size', [256, 512, 1024])
+def test_zero_filled_header_detected_exactly(tmp_path, header_size):
+    filename = str(tmp_path / f'zero_header_{header_size}.BIN')
+    peaks = synthesize(filename, num_leads=12, sampling_rate=1000, duration=60.0, header_size=header_size)
+
+    layout, _ = FormatDetector(filename).detect()
+
+    assert layout is not None
+    assert (layout.header_size, layout.num_leads, layout.sample_width) == (header_size, 12, 2)
+
+    # Ударите не са изместени с фалшиви начални кадри
+    recording = ECGRecording(filename, layout.num_leads, layout=layout)
+    beats = BeatDetector(1000).detect(recording)
+    inner = peaks[(peaks > 2000) & (peaks < len(recording) - 2000)]
+    matched = beats.samples[(beats.samples > 2000) & (beats.samples < len(recording) - 2000)]
+    assert len(matched) == len(inner)
+    assert abs(int(round(float((matched - inner).mean())))) < 3
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from ecg_core import BeatTable, HRVAnalyzer
+
+
+def modulated_table(frequency, seconds=900.0, mean_rr=0.8, depth=0.04, fs=1000):
+    """Удари с RR, модулиран синусоидално с frequency (Hz) - 3 епохи по 5 мин"""
+    times = [0.5]
+    while times[-1] < seconds:
+        times.append(times[-1] + mean_rr + depth * np.sin(2 * np.pi * frequency * times[-1]))
+    samples = np.round(np.array(times[:-1]) * fs).astype(np.int64)
+    rr = np.concatenate([[np.nan], np.diff(samples) / fs])
+    return BeatTable(samples, rr, np.zeros(len(samples)), np.zeros(len(samples)), fs)
+
+
+@pytest.mark.parametrize('frequency, dominant', [(0.1, 'lf'), (0.25, 'hf')])
+def test_band_power_at_modulation_frequency(frequency, dominant):
+    epochs = HRVAnalyzer(1000).epochs(modulated_table(frequency))
+    other = 'hf' if dominant == 'lf' else 'lf'
+
+    assert len(epochs['start']) == 3
+    assert np.all(epochs[dominant] > 10 * epochs[other])
+    # Почти цялата дисперсия на RR е в лентата на модулацията - за синусоида depth²/2
+    np.testing.assert_allclose(epochs[dominant] + epochs[other], (40.0 ** 2) / 2, rtol=0.2)
+    if dominant == 'lf':
+        assert np.all(epochs['lf_hf'] > 10)
+    else:
+        assert np.all(epochs['lf_hf'] < 0.1)
+
+
+def test_time_domain_metrics_match_numpy():
+    table = modulated_table(0.1)
+    analyzer = HRVAnalyzer(1000)
+    epochs = analyzer.epochs(table)
+
+    epoch_len = 300 * 1000
+    for i, start in enumerate(epochs['start']):
+        first, last = table.between(start, start + epoch_len)
+        rr_ms = table.rr[first:last].astype(np.float64) * 1000
+        rr_ms = rr_ms[np.isfinite(rr_ms)]
+        diffs = np.diff(rr_ms)
+        assert epochs['beats'][i] == len(rr_ms)
+        np.testing.assert_allclose(epochs['mean_rr'][i], rr_ms.mean(), rtol=1e-6)
+        np.testing.assert_allclose(epochs['sdnn'][i], rr_ms.std(ddof=1), rtol=1e-6)
+        np.testing.assert_allclose(epochs['rmssd'][i], np.sqrt(np.mean(diffs ** 2)), rtol=1e-6)
+        np.testing.assert_allclose(epochs['pnn50'][i], 100 * np.mean(np.abs(diffs) > 50))
+
+
+def test_short_epoch_is_nan():
+    # Последната епоха е с по-малко от MIN_BEATS удара
+    table = modulated_table(0.1, seconds=610.0)
+    epochs = HRVAnalyzer(1000).epochs(table)
+
+    assert len(epochs['start']) == 3
+    assert np.all(np.isfinite(epochs['sdnn'][:2]))
+    assert np.isnan(epochs['sdnn'][2]) and np.isnan(epochs['lf'][2])
+
+
+def test_spectra_are_cached_per_epoch(monkeypatch):
+    analyzer = HRVAnalyzer(1000)
+    table = modulated_table(0.1)
+    first = analyzer.epochs(table)
+
+    calls = []
+    original = analyzer.band_powers
+    monkeypatch.setattr(analyzer, 'band_powers', lambda *args: calls.append(1) or original(*args))
+    again = analyzer.epochs(table)
+
+    assert not calls
+    np.testing.assert_array_equal(again['lf'], first['lf'])
+
+
+def test_zero_hf_gives_nan_ratio(monkeypatch):
+    analyzer = HRVAnalyzer(1000)
+    monkeypatch.setattr(analyzer, 'band_powers', lambda times, rr_ms: (120.0, 0.0))
+
+    with np.errstate(all='raise'):
+        epochs = analyzer.epochs(modulated_table(0.1))
+
+    assert np.all(epochs['hf'] == 0.0)
+    assert np.all(np.isnan(epochs['lf_hf']))
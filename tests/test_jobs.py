@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from ecg_core import JobCancelled
+from ecg_viewerGPU import JobRunner
+
+
+class FakeRoot:
+    """Вместо Tk - root.after() само запомня callback-а; pump() ги изпълнява в теста"""
+
+    def __init__(self):
+        self.pending = []
+
+    def after(self, ms, callback):
+        self.pending.append(callback)
+
+    def pump(self, until, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not until():
+            assert time.monotonic() < deadline, "callback-ът не пристигна"
+            callbacks, self.pending = self.pending, []
+            for callback in callbacks:
+                callback()
+            time.sleep(0.005)
+
+
+@pytest.fixture
+def runner():
+    root = FakeRoot()
+    runner = JobRunner(root)
+    yield runner
+    runner.shutdown()
+
+
+def test_result_delivered_in_caller_thread(runner):
+    results = []
+    runner.submit(lambda job, x: x * 2, 21,
+                  on_done=lambda result: results.append((result, threading.current_thread())))
+    runner.root.pump(lambda: results)
+
+    assert results == [(42, threading.current_thread())]
+
+
+def test_error_goes_to_on_error(runner):
+    errors = []
+
+    def fail(job):
+        raise ValueError("bad window")
+
+    runner.submit(fail, on_done=lambda result: pytest.fail("on_done"), on_error=errors.append)
+    runner.root.pump(lambda: errors)
+
+    assert isinstance(errors[0], ValueError)
+
+
+def test_newer_job_in_group_replaces_older(runner):
+    release = threading.Event()
+    results = []
+
+    def slow(job, value):
+        release.wait(5)
+        job.check_cancelled()
+        return value
+
+    first = runner.submit(slow, 'first', group='window', on_done=results.append)
+    second = runner.submit(slow, 'second', group='window', on_done=results.append)
+    release.set()
+    runner.root.pump(lambda: results and runner._active == 0)
+
+    assert first.cancelled and not runner.is_current(first)
+    assert results == ['second']
+
+
+def test_progress_and_cancel(runner):
+    progress = []
+    started = threading.Event()
+    stop = threading.Event()
+    outcome = []
+
+    def work(job):
+        job.report_progress(0.5, 'half')
+        started.set()
+        stop.wait(5)
+        try:
+            job.report_progress(0.9)
+        except JobCancelled:
+            outcome.append('cancelled')
+            raise
+
+    runner.submit(work, group='export', on_progress=lambda *args: progress.append(args),
+                  on_done=lambda result: pytest.fail("on_done"))
+    started.wait(5)
+    runner.root.pump(lambda: progress)
+    runner.cancel_group('export')
+    stop.set()
+    runner.root.pump(lambda: runner._active == 0)
+
+    assert progress == [(0.5, 'half')]
+    assert outcome == ['cancelled']
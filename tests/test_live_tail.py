@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from scipy import signal
+
+from ecg_core import BeatDetector, ECGProcessor, ECGRecording, FileLayout, FilterBank, LiveTail
+
+
+def true_peaks(seconds, fs=1000):
+    """Позиции на ударите в ecg_signal - 72 bpm от 0.4 s"""
+    return np.round(np.arange(0.4, seconds, 60.0 / 72) * fs).astype(np.int64)
+
+
+@pytest.fixture
+def frames(ecg_signal):
+    # 100 s, от които при отварянето са записани първите 60 s
+    return np.round(ecg_signal(seconds=100.0) * 200).astype('<i2')
+
+
+def append(path, frames):
+    with open(path, 'ab') as f:
+        f.write(frames.tobytes())
+
+
+def test_poll_follows_appended_frames(write_recording, frames, monkeypatch):
+    path = write_recording(data=frames[:60000], scale=1.0)
+    recording = ECGRecording(path, 3)
+    recording.beats = BeatDetector(1000).detect(recording)
+    processor = ECGProcessor(1000)
+    # Baseline-ът остава нулев - сравнява се само филтърът
+    monkeypatch.setattr(processor, 'extend_baseline', lambda baseline, data, use_gpu=None: baseline)
+    live = LiveTail(recording, processor)
+
+    assert live.poll() is None
+
+    # Непълният последен кадър се изчаква
+    append(path, frames[60000:80000])
+    append(path, frames[80000, :1])
+    assert live.poll() == (60000, 80000)
+    assert len(recording) == 80000
+
+    append(path, frames[80000, 1:])
+    append(path, frames[80001:])
+    assert live.poll() == (80000, 100000)
+    assert len(recording) == 100000
+
+    # Пренесеното състояние дава същото като еднократен sosfilt от началото на буфера
+    tail_start, tail = live.tail
+    data = recording.window(tail_start, len(recording), gain=1.0)
+    sos = FilterBank.get(1000).sos
+    zi = signal.sosfilt_zi(sos)[:, :, np.newaxis] * data[0][np.newaxis, np.newaxis, :]
+    expected = signal.sosfilt(sos, data, axis=0, zi=zi)[0].astype(np.float32)
+    np.testing.assert_allclose(tail, expected, atol=1e-5)
+    np.testing.assert_allclose(live.segment(90000, 95000, gain=2.0), expected[90000 - tail_start:95000 - tail_start] * 2,
+                               atol=1e-5)
+
+    # Ударите покрай шевовете не се дублират и не липсват
+    samples = recording.beats.samples
+    assert np.all(np.diff(samples) >= BeatDetector(1000).refractory)
+    expected_peaks = true_peaks(100.0)
+    expected_peaks = expected_peaks[expected_peaks < 99000]
+    found = samples[samples < 99000]
+    assert len(found) == len(expected_peaks)
+    assert np.max(np.abs(found - expected_peaks)) <= 3
+
+
+def test_blocked_layout_is_rejected(write_recording):
+    recording = ECGRecording(write_recording(seconds=5.0), 3, layout=FileLayout(num_leads=3, interleaved=False))
+    with pytest.raises(ValueError):
+        LiveTail(recording, ECGProcessor(1000))
@@ -0,0 +1,50 @@
+import json
+import threading
+
+import pytest
+
+from ecg_core import PerfTracer
+
+
+def test_disabled_records_nothing():
+    tracer = PerfTracer()
+    with tracer.span('filter'):
+        pass
+    assert len(tracer.events) == 0
+    assert tracer.stats() == {}
+
+
+def test_stats_and_ring_buffer():
+    tracer = PerfTracer(capacity=4, enabled=True)
+    for _ in range(3):
+        with tracer.span('filter'):
+            pass
+    tracer.record('draw', 0.0, 0.25)
+    tracer.record('draw', 0.0, 0.5)
+
+    stats = tracer.stats()
+    # Най-старото събитие е изместено
+    assert len(tracer.events) == 4
+    assert list(stats) == ['filter', 'draw']
+    assert stats['filter']['count'] == 2
+    assert (stats['draw']['count'], stats['draw']['last'], stats['draw']['mean']) == (2, 0.5, 0.375)
+    assert 0.25 < stats['draw']['p95'] <= 0.5
+
+
+def test_chrome_trace_is_valid_json(tmp_path):
+    tracer = PerfTracer(enabled=True)
+    with tracer.span('load'):
+        pass
+    worker = threading.Thread(target=lambda: tracer.record('export.write', tracer.epoch + 0.001, 0.002))
+    worker.start()
+    worker.join()
+
+    filename = tmp_path / 'trace.json'
+    assert tracer.export_chrome_trace(str(filename)) == 2
+
+    trace = json.loads(filename.read_text())
+    events = trace['traceEvents']
+    assert [event['name'] for event in events] == ['load', 'export.write']
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+    assert (events[1]['ts'], events[1]['dur']) == (pytest.approx(1000.0), pytest.approx(2000.0))
+    assert events[0]['tid'] != events[1]['tid']
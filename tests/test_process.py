@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+
+import ecg_process
+from ecg_core import ECGExporter, ECGRecording, FileLayout, process_file
+
+
+def test_collect_inputs(tmp_path):
+    for name in ('b.BIN', 'a.bin', 'c.DAT', 'd.ecgz', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    extra = tmp_path / 'extra.raw'
+    extra.write_bytes(b'')
+
+    files = ecg_process.collect_inputs([str(tmp_path), str(extra)])
+
+    assert [os.path.basename(f) for f in files] == ['a.bin', 'b.BIN', 'c.DAT', 'd.ecgz', 'extra.raw']
+
+
+def test_process_file(tmp_path, write_recording):
+    filename = write_recording(seconds=60.0)
+    result = process_file(filename, layout=FileLayout(0, 3), sampling_rate=1000, export='npy',
+                          output_dir=str(tmp_path), heart_rate=True)
+
+    assert result['samples'] == 60000 and result['duration'] == 60.0
+    assert 71 <= result['heart_rate'] <= 73
+    beats = np.loadtxt(result['beats_file'], delimiter=',', skiprows=1)
+    assert len(beats) == result['beats']
+    assert result['hrv']['beats'] > 0
+    assert np.load(result['export_file']).shape == (60000, 3)
+    assert set(result['timings']) == {'open', 'baseline', 'beats', 'hrv', 'export'}
+
+
+def test_cli(tmp_path, write_recording, capsys):
+    write_recording('night.BIN', seconds=30.0)
+    out = tmp_path / 'results'
+
+    code = ecg_process.main([str(tmp_path), '--leads', '3', '--fs', '1000', '--hr', '--export', 'csv',
+                             '--out', str(out), '--workers', '1'])
+
+    assert code == 0
+    assert sorted(path.name for path in out.iterdir()) == ['night.beats.csv', 'night.csv', 'night.hrv.csv']
+    assert 'Обработени 1/1' in capsys.readouterr().out
+
+
+def write_container(write_recording, tmp_path, name):
+    """Записва .ecgz контейнер от синтетичен 3-отвеждащ запис - връща пътя"""
+    source = ECGRecording(write_recording('source.BIN', seconds=30.0), 3)
+    target = str(tmp_path / name)
+    ECGExporter(source, 1000, ['I', 'II', 'III']).export(target)
+    os.remove(source.filename)
+    return target
+
+
+def test_cli_processes_containers(tmp_path, write_recording, capsys):
+    inputs = tmp_path / 'in'
+    inputs.mkdir()
+    write_recording('in/night.BIN', seconds=30.0)
+    write_container(write_recording, inputs, 'archive.ecgz')
+    out = tmp_path / 'results'
+
+    code = ecg_process.main([str(inputs), '--leads', '3', '--fs', '1000', '--hr', '--export', 'csv',
+                             '--out', str(out), '--workers', '1'])
+
+    assert code == 0
+    assert sorted(path.name for path in out.iterdir()) == [
+        'archive.beats.csv', 'archive.csv', 'archive.hrv.csv', 'night.beats.csv', 'night.csv', 'night.hrv.csv']
+    assert 'Обработени 2/2' in capsys.readouterr().out
+    # Контейнерът дава същите удари като суровия запис
+    np.testing.assert_array_equal(np.loadtxt(out / 'archive.beats.csv', delimiter=',', skiprows=1),
+                                  np.loadtxt(out / 'night.beats.csv', delimiter=',', skiprows=1))
+
+
+def test_export_does_not_overwrite_input(tmp_path, write_recording):
+    filename = write_container(write_recording, tmp_path, 'archive.ecgz')
+    before = open(filename, 'rb').read()
+
+    with pytest.raises(ValueError):
+        process_file(filename, export='ecgz')
+    assert open(filename, 'rb').read() == before
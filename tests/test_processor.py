@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from ecg_benchmark import synthesize
+from ecg_core import ECGProcessor, ECGRecording, JobCancelled
+
+
+@pytest.fixture
+def recording(tmp_path):
+    filename = str(tmp_path / 'short.BIN')
+    synthesize(filename, num_leads=3, sampling_rate=1000, duration=20.0, header_size=0)
+    return ECGRecording(filename, 3)
+
+
+def fail_with(error):
+    def fail(data, use_gpu=None):
+        raise error
+    return fail
+
+
+def test_heart_rate(ecg_signal):
+    processor = ECGProcessor(1000)
+    assert processor.heart_rate(ecg_signal(seconds=10.0), is_filtered=False) in range(70, 75)
+
+
+def test_heart_rate_numeric_error_returns_none(ecg_signal, monkeypatch, capsys):
+    processor = ECGProcessor(1000)
+    monkeypatch.setattr(processor, 'filter', fail_with(np.linalg.LinAlgError('singular')))
+
+    assert processor.heart_rate(ecg_signal(seconds=10.0), is_filtered=False) is None
+    assert 'Heart rate estimation failed' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('error', [JobCancelled(), KeyboardInterrupt()])
+def test_heart_rate_propagates_cancel(ecg_signal, monkeypatch, error):
+    processor = ECGProcessor(1000)
+    monkeypatch.setattr(processor, 'filter', fail_with(error))
+
+    with pytest.raises(type(error)):
+        processor.heart_rate(ecg_signal(seconds=10.0), is_filtered=False)
+
+
+def test_segment_numeric_error_falls_back_to_raw(recording, monkeypatch, capsys):
+    processor = ECGProcessor(1000)
+    monkeypatch.setattr(processor, 'filter', fail_with(ValueError('bad sos')))
+
+    data = processor.segment(recording, 2000, 6000, filter_on=True, gain=1.0)
+    np.testing.assert_array_equal(data, recording.window(2000, 6000, 1.0))
+    assert 'Window filtering failed' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('error', [JobCancelled(), KeyboardInterrupt()])
+def test_segment_propagates_cancel(recording, monkeypatch, error):
+    processor = ECGProcessor(1000)
+    monkeypatch.setattr(processor, 'filter', fail_with(error))
+
+    with pytest.raises(type(error)):
+        processor.segment(recording, 2000, 6000, filter_on=True, gain=1.0)
+
+
+class FailingMedian:
+    """Backend, чиято медиана хвърля error"""
+
+    def __init__(self, name, error):
+        self.name = name
+        self.error = error
+
+    def median(self, blocks, axis):
+        raise self.error
+
+
+def fail_backend(processor, name, error):
+    select = processor.backend
+
+    def backend(kernel, size, use_gpu=None):
+        if kernel == 'baseline' and use_gpu is not False:
+            return FailingMedian(name, error)
+        return select(kernel, size, use_gpu)
+    return backend
+
+
+def test_baseline_gpu_error_falls_back_to_cpu(recording, monkeypatch, capsys):
+    processor = ECGProcessor(1000)
+    expected = processor.estimate_baseline(recording.raw, use_gpu=False)
+    monkeypatch.setattr(processor, 'backend', fail_backend(processor, 'cupy', RuntimeError('CUDA error')))
+
+    baseline = processor.estimate_baseline(recording.raw)
+    np.testing.assert_array_equal(baseline.values, expected.values)
+    assert 'GPU baseline failed' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('name, error', [
+    ('numpy', ValueError('bad blocks')),
+    ('cupy', JobCancelled()),
+    ('cupy', KeyboardInterrupt()),
+])
+def test_baseline_error_propagates(recording, monkeypatch, name, error):
+    processor = ECGProcessor(1000)
+    monkeypatch.setattr(processor, 'backend', fail_backend(processor, name, error))
+
+    with pytest.raises(type(error)):
+        processor.estimate_baseline(recording.raw)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from ecg_core import ECGRecording, MinMaxPyramid, SidecarCache
+
+
+def direct_minmax(data, size):
+    """Min/max на всеки bin от `size` семпли директно с NumPy (последният може да е непълен)"""
+    bins = range(0, len(data), size)
+    return (np.array([data[i:i + size].min(axis=0) for i in bins]),
+            np.array([data[i:i + size].max(axis=0) for i in bins]))
+
+
+@pytest.fixture
+def recording(write_recording):
+    return ECGRecording(write_recording(seconds=70.0), 3)
+
+
+@pytest.fixture
+def pyramid(recording, monkeypatch):
+    # Няколко части при строенето - проверява и слепването им
+    monkeypatch.setattr(MinMaxPyramid, 'CHUNK_FRAMES', 1 << 14)
+    pyramid = MinMaxPyramid()
+    pyramid.build(recording)
+    return pyramid
+
+
+def test_levels_match_numpy(recording, pyramid):
+    data = recording.window(0, len(recording), gain=1.0)
+
+    assert pyramid.ready
+    assert len(pyramid.mins[-1]) == 1
+    for level in range(len(pyramid.mins)):
+        mins, maxs = direct_minmax(data, pyramid.bin_size(level))
+        np.testing.assert_array_equal(pyramid.mins[level], mins)
+        np.testing.assert_array_equal(pyramid.maxs[level], maxs)
+
+
+@pytest.mark.parametrize('start, end, max_bins', [(0, 70000, 500), (12345, 54321, 300), (1000, 5000, 2000)])
+def test_query_matches_numpy(recording, pyramid, start, end, max_bins):
+    data = recording.window(0, len(recording), gain=1.0)
+    x, y = pyramid.query(start, end, max_bins)
+
+    # Най-финото ниво с не повече от max_bins bin-а в прозореца
+    level = next(level for level in range(len(pyramid.mins))
+                 if (end - start) / pyramid.bin_size(level) <= max_bins)
+    size = pyramid.bin_size(level)
+    # Крайните bin-ове се взимат цели - могат да излизат извън прозореца
+    first, last = start // size, -(-end // size)
+    mins, maxs = direct_minmax(data[first * size:last * size], size)
+
+    assert np.all((x >= start) & (x < end))
+    np.testing.assert_array_equal(y[0::2], mins)
+    np.testing.assert_array_equal(y[1::2], maxs)
+
+
+def test_sidecar_round_trip(tmp_path, pyramid):
+    sidecar = SidecarCache(root=str(tmp_path))
+    pyramid.save(sidecar, 'key')
+
+    loaded = MinMaxPyramid.load(sidecar, 'key')
+    assert loaded.ready
+    for level in range(len(pyramid.mins)):
+        np.testing.assert_array_equal(loaded.mins[level], pyramid.mins[level])
+        np.testing.assert_array_equal(loaded.maxs[level], pyramid.maxs[level])
+    assert MinMaxPyramid.load(sidecar, 'missing') is None
+
+
+def test_extend_matches_rebuild(tmp_path, ecg_signal, monkeypatch):
+    monkeypatch.setattr(MinMaxPyramid, 'CHUNK_FRAMES', 1 << 14)
+    frames = np.round(ecg_signal(seconds=70.0) * 200).astype('<i2')
+    path = tmp_path / 'growing.BIN'
+    path.write_bytes(frames[:40000].tobytes())
+    recording = ECGRecording(str(path), 3)
+    pyramid = MinMaxPyramid()
+    pyramid.build(recording)
+
+    with open(path, 'ab') as f:
+        f.write(frames[40000:].tobytes())
+    recording.refresh()
+    pyramid.extend(recording)
+
+    rebuilt = MinMaxPyramid()
+    rebuilt.build(recording)
+    assert len(pyramid.mins) == len(rebuilt.mins)
+    for level in range(len(rebuilt.mins)):
+        np.testing.assert_array_equal(pyramid.mins[level], rebuilt.mins[level])
+        np.testing.assert_array_equal(pyramid.maxs[level], rebuilt.maxs[level])
@@ -0,0 +1,79 @@
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from ecg_viewerGPU import ECGPlotRenderer
+
+LEADS = ['I', 'II', 'III']
+
+
+class CountingCanvas(FigureCanvasAgg):
+    """Agg canvas, който брои пълните рисувания"""
+
+    draws = 0
+
+    def draw(self):
+        self.draws += 1
+        super().draw()
+
+
+def make_renderer():
+    figure = Figure(figsize=(8, 6), dpi=50)
+    return ECGPlotRenderer(figure, CountingCanvas(figure))
+
+
+def window(seconds=10, fs=100, amplitude=1.0):
+    time = np.arange(seconds * fs) / fs
+    data = amplitude * np.sin(2 * np.pi * time)[:, None] * np.ones(len(LEADS), dtype=np.float32)
+    return time, data
+
+
+def test_layout_built_once_per_key():
+    renderer = make_renderer()
+    assert renderer.ensure_layout(LEADS, 10)
+    axes, lines = list(renderer.axes), list(renderer.lines)
+
+    assert not renderer.ensure_layout(LEADS, 10)
+    assert renderer.axes == axes and renderer.lines == lines
+
+    assert renderer.ensure_layout(LEADS, 20)
+    assert renderer.axes[0] is not axes[0]
+    assert renderer.axes[0].get_xlim() == (0, 20)
+
+
+def test_navigation_blits_without_full_draw():
+    renderer = make_renderer()
+    renderer.ensure_layout(LEADS, 10)
+    ylims = [(-1.5, 1.5)] * len(LEADS)
+
+    renderer.render(*window(), ylims, 'first')
+    assert renderer.canvas.draws == 1 and renderer.background is not None
+
+    time, data = window(amplitude=0.5)
+    renderer.render(time, data, ylims, 'second')
+    assert renderer.canvas.draws == 1
+    np.testing.assert_array_equal(renderer.lines[1].get_ydata(), data[:, 1])
+    assert renderer.title.get_text() == 'second'
+
+    # Нови y-граници - пълно рисуване
+    renderer.render(time, data, [(-5.0, 5.0)] * len(LEADS), 'third')
+    assert renderer.canvas.draws == 2
+
+
+def test_keeps_ylim():
+    assert ECGPlotRenderer._keeps_ylim((-1.5, 1.5), (-1.0, 1.0))
+    assert not ECGPlotRenderer._keeps_ylim((-1.5, 1.5), (-2.0, 1.0))
+    # Много по-широки от нужното - сменят се
+    assert not ECGPlotRenderer._keeps_ylim((-5.0, 5.0), (-1.0, 1.0))
+
+
+def test_savefig_includes_animated_artists(tmp_path):
+    renderer = make_renderer()
+    renderer.ensure_layout(LEADS, 10)
+    renderer.render(*window(), [(-1.5, 1.5)] * len(LEADS), 'ECG')
+
+    filename = tmp_path / 'plot.png'
+    renderer.savefig(str(filename))
+
+    assert filename.stat().st_size > 0
+    assert all(line.get_animated() for line in renderer.lines)
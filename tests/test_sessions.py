@@ -0,0 +1,94 @@
+import pytest
+
+from ecg_core import ECGRecording, RecordingSession, SessionManager
+
+MB = 1 << 20
+
+
+class FakeRecording:
+    """Запис с зададена памет по артефакти - release() я нулира"""
+
+    def __init__(self, name, **usage):
+        self.filename = name
+        self.usage = {artifact: 0 for artifact in ECGRecording.ARTIFACTS}
+        self.usage.update(usage)
+        self.released = []
+
+    def memory_usage(self):
+        return dict(self.usage)
+
+    def building(self, artifact):
+        return False
+
+    def release(self, artifact):
+        self.usage[artifact] = 0
+        self.released.append(artifact)
+
+    def close(self):
+        pass
+
+
+def open_session(manager, name, **usage):
+    session = RecordingSession(name, FakeRecording(name, **usage))
+    manager.open(session)
+    return session
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Детерминирано време на ползване - всяко извикване е с една секунда по-късно
+    now = [0.0]
+
+    def monotonic():
+        now[0] += 1.0
+        return now[0]
+    monkeypatch.setattr('ecg_core.time.monotonic', monotonic)
+
+
+def test_enforce_evicts_least_recently_used_inactive_first(clock):
+    manager = SessionManager(memory_limit=100 * MB)
+    old = open_session(manager, 'old', pyramid=40 * MB, beats=10 * MB)
+    open_session(manager, 'recent', filtered=40 * MB, stats=20 * MB)
+    active = open_session(manager, 'active', decoded=30 * MB, pyramid=30 * MB)
+    # Пирамидата на old е ползвана по-късно от beats
+    old.touch('pyramid')
+
+    evicted = manager.enforce()
+
+    # 170 MB -> под 100 MB: първо beats на old, после при еднакво време filtered преди stats на recent
+    assert [(session.key, artifact) for session, artifact in evicted] == [
+        ('old', 'beats'), ('recent', 'filtered'), ('recent', 'stats')]
+    assert manager.total_bytes() <= manager.memory_limit
+    assert manager.over_limit == 0
+    assert active.recording.released == []
+
+
+def test_active_caches_go_last_in_eviction_order(clock):
+    manager = SessionManager(memory_limit=40 * MB)
+    open_session(manager, 'inactive', beats=20 * MB)
+    active = open_session(manager, 'active', decoded=40 * MB, pyramid=10 * MB)
+
+    evicted = manager.enforce()
+
+    assert [(session.key, artifact) for session, artifact in evicted] == [('inactive', 'beats'),
+                                                                         ('active', 'decoded')]
+    assert active.recording.usage['pyramid'] == 10 * MB
+
+
+def test_active_derived_data_stays_when_limit_is_too_small(clock):
+    manager = SessionManager(memory_limit=64 * MB)
+    open_session(manager, 'inactive', pyramid=10 * MB)
+    active = open_session(manager, 'active', filtered=50 * MB, pyramid=20 * MB, stats=5 * MB, beats=5 * MB)
+
+    manager.enforce()
+
+    # Производните данни на активния запис не се освобождават - лимитът е твърде малък
+    assert active.recording.released == []
+    assert manager.over_limit == 80 * MB - 64 * MB
+    # Повторните проверки не освобождават нищо - няма цикъл освобождаване/строене
+    assert manager.enforce() == [] and manager.enforce() == []
+    assert manager.over_limit == 16 * MB
+
+    manager.memory_limit = 100 * MB
+    manager.enforce()
+    assert manager.over_limit == 0
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+from ecg_core import SidecarCache
+
+
+def test_store_and_load(tmp_path):
+    sidecar = SidecarCache(root=str(tmp_path))
+    values = np.arange(12, dtype=np.float32).reshape(4, 3)
+    sidecar.store('key', 'baseline_values', values)
+
+    np.testing.assert_array_equal(sidecar.load('key', 'baseline_values', mmap=False), values)
+    assert sidecar.load('key', 'missing') is None
+    assert sidecar.load('other', 'baseline_values') is None
+    assert not [name for name in os.listdir(tmp_path / 'key') if name.endswith('.partial')]
+
+
+def test_key_follows_file_and_params(tmp_path):
+    filename = tmp_path / 'recording.BIN'
+    filename.write_bytes(bytes(4096))
+    sidecar = SidecarCache(root=str(tmp_path / 'cache'))
+
+    key = sidecar.make_key(str(filename), num_leads=12)
+    assert sidecar.make_key(str(filename), num_leads=12) == key
+    assert sidecar.make_key(str(filename), num_leads=8) != key
+
+    filename.write_bytes(bytes(4095) + b'\x01')
+    assert sidecar.make_key(str(filename), num_leads=12) != key
+
+
+def test_evicts_least_recently_used(tmp_path):
+    sidecar = SidecarCache(root=str(tmp_path), budget_bytes=3000)
+    block = np.zeros(1000, dtype=np.uint8)
+    for key in ('old', 'middle'):
+        sidecar.store(key, 'data', block)
+    # 'old' е прочетен след 'middle' - изтрива се 'middle'
+    os.utime(tmp_path / 'middle', (1, 1))
+    sidecar.load('old', 'data')
+
+    sidecar.store('new', 'data', block)
+
+    assert sorted(os.listdir(tmp_path)) == ['new', 'old']
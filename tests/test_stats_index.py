@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from ecg_core import ECGRecording, SidecarCache, StatsIndex
+
+
+@pytest.fixture
+def recording(write_recording):
+    # 31 s - последният блок от CHUNK_SEC е непълен
+    return ECGRecording(write_recording(seconds=31.0), 3)
+
+
+@pytest.fixture
+def index(recording, monkeypatch):
+    # Няколко четения при строенето - проверява и слепването им
+    monkeypatch.setattr(StatsIndex, 'READ_FRAMES', 1 << 13)
+    index = StatsIndex(1000)
+    index.build(recording)
+    return index
+
+
+@pytest.mark.parametrize('start, end', [(0, 31000), (4000, 12000), (3000, 7500), (30000, 31000)])
+@pytest.mark.parametrize('gain', [1.0, 2.0])
+def test_query_matches_numpy(recording, index, start, end, gain):
+    stats = index.query(start, end, gain)
+
+    # Заявката обхваща целите блокове, които пресича прозорецът
+    size = index.chunk_size
+    data = recording.window(start // size * size, min(-(-end // size) * size, len(recording)), gain=1.0)
+    np.testing.assert_allclose(stats['min'], data.min(axis=0) * gain, rtol=1e-6)
+    np.testing.assert_allclose(stats['max'], data.max(axis=0) * gain, rtol=1e-6)
+    np.testing.assert_allclose(stats['mean'], data.mean(axis=0, dtype=np.float64) * gain, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(stats['std'], data.std(axis=0, dtype=np.float64) * gain, rtol=1e-4)
+
+    # Квантилите на прозореца са медиани на квантилите на блоковете - подредени и в [min, max]
+    quantiles = stats['quantiles']
+    assert quantiles.shape == (len(StatsIndex.QUANTILES), 3)
+    assert np.all(np.diff(quantiles, axis=0) >= 0)
+    assert np.all((quantiles >= stats['min']) & (quantiles <= stats['max']))
+
+
+def test_chunk_quantiles_close_to_exact(recording, index):
+    size = index.chunk_size
+    for chunk in range(len(recording) // size):
+        data = recording.window(chunk * size, (chunk + 1) * size, gain=1.0)
+        exact = np.percentile(data, StatsIndex.QUANTILES, axis=0)
+        # Извадка от SKETCH_POINTS точки - крайните квантили около QRS са най-неточни
+        error = np.abs(index.query(chunk * size, (chunk + 1) * size)['quantiles'] - exact)
+        assert np.all(error <= 0.1 * (data.max(axis=0) - data.min(axis=0)))
+
+
+def test_query_outside_data(index):
+    assert index.query(40000, 50000) is None
+    assert StatsIndex(1000).query(0, 1000) is None
+
+
+def test_extend_matches_rebuild(tmp_path, ecg_signal):
+    frames = np.round(ecg_signal(seconds=31.0) * 200).astype('<i2')
+    path = tmp_path / 'growing.BIN'
+    # Първата част свършва по средата на блок
+    path.write_bytes(frames[:17300].tobytes())
+    recording = ECGRecording(str(path), 3)
+    index = StatsIndex(1000)
+    index.build(recording)
+
+    with open(path, 'ab') as f:
+        f.write(frames[17300:].tobytes())
+    recording.refresh()
+    index.extend(recording)
+
+    rebuilt = StatsIndex(1000)
+    rebuilt.build(recording)
+    assert index.length == rebuilt.length == len(recording)
+    for name in StatsIndex.FIELDS:
+        np.testing.assert_array_equal(index.arrays[name], rebuilt.arrays[name])
+
+
+def test_sidecar_round_trip(tmp_path, index):
+    sidecar = SidecarCache(root=str(tmp_path))
+    index.save(sidecar, 'key')
+
+    loaded = StatsIndex.load(sidecar, 'key', 1000)
+    assert loaded.ready
+    for name in StatsIndex.FIELDS:
+        np.testing.assert_array_equal(loaded.arrays[name], index.arrays[name])
+    assert StatsIndex.load(sidecar, 'missing', 1000) is None
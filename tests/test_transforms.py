@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from ecg_core import (BaselineStage, BlockBaseline, ECGRecording, FilterBank, FilterStage, ScaleStage,
+                      TransformPipeline)
+
+
+@pytest.fixture
+def recording(write_recording, rng):
+    recording = ECGRecording(write_recording(seconds=20.0), 3)
+    # Baseline, различен по блокове - проверява и изместването на прозореца
+    recording.baseline = BlockBaseline(np.arange(500, 20000, 1000),
+                                       rng.normal(0, 20, (20, 3)).astype(np.float32))
+    return recording
+
+
+def eager_decode(recording, start, end, gain):
+    """Целият прозорец наведнъж с NumPy - (raw - baseline) * gain / scale"""
+    raw = np.asarray(recording.raw[start:end], dtype=np.float32)
+    return (raw - recording.baseline.evaluate(start, end)) * np.float32(gain / recording.scale)
+
+
+@pytest.mark.parametrize('gain', [1.0, 2.5])
+@pytest.mark.parametrize('start, end', [(0, 3000), (12345, 17890), (19000, 20000)])
+def test_window_matches_eager_decode(recording, start, end, gain):
+    np.testing.assert_allclose(recording.window(start, end, gain), eager_decode(recording, start, end, gain),
+                               rtol=1e-6, atol=1e-6)
+
+
+def test_unfused_stages_match_fused(recording):
+    # Мащабът преди baseline-а не се слива с decode - същият резултат по общия път
+    unfused = TransformPipeline([ScaleStage(1.0), BaselineStage(), ScaleStage(1.0 / recording.scale)])
+    np.testing.assert_allclose(unfused.evaluate(recording, 4000, 9000), recording.window(4000, 9000, 1.0),
+                               rtol=1e-6, atol=1e-6)
+
+
+def test_filter_stage_reads_padded_context(recording):
+    bank = FilterBank.get(1000)
+    pipeline = recording.transforms(1.0).then(FilterStage(bank.apply, 1500, bank.key))
+    start, end = 8000, 12000
+
+    expected = bank.apply(eager_decode(recording, start - 1500, end + 1500, 1.0))[1500:-1500]
+    np.testing.assert_allclose(pipeline.evaluate(recording, start, end), expected, rtol=1e-5, atol=1e-5)
+    # При началото на записа контекстът е само отдясно
+    expected = bank.apply(eager_decode(recording, 0, 2500, 1.0))[:1000]
+    np.testing.assert_allclose(pipeline.evaluate(recording, 0, 1000), expected, rtol=1e-5, atol=1e-5)
+
+
+def test_key_follows_stages(recording):
+    assert recording.transforms(1.0).key() == recording.transforms(1.0).key()
+    assert recording.transforms(1.0).key() != recording.transforms(2.0).key()
+    bank = FilterBank.get(1000)
+    filtered = recording.transforms(1.0).then(FilterStage(bank.apply, 1500, bank.key))
+    assert filtered.pad == 1500 and recording.transforms(1.0).pad == 0
+    assert filtered.key() != recording.transforms(1.0).key()
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+from ecg_viewerGPU import ECGViewer, FilterBank, WindowCache
+
+
+def test_lru_eviction_and_stats():
+    cache = WindowCache(max_entries=3)
+    for key in 'abc':
+        cache.put(key, key.upper())
+
+    assert cache.get('a') == 'A'
+    cache.put('d', 'D')
+
+    assert 'b' not in cache
+    assert all(key in cache for key in 'acd')
+    assert cache.get('b') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 3}
+
+    cache.clear()
+    assert 'a' not in cache
+
+
+def test_key_changes_with_gain_and_filter():
+    viewer = SimpleNamespace(band=(0.5, 40.0))
+    viewer.get_filter_bank = lambda: FilterBank.get(1000, band=viewer.band)
+
+    def key(filter_on=True, gain=1.0):
+        return ECGViewer._window_key(viewer, 5000, 10000, filter_on, gain)
+
+    cache = WindowCache()
+    cache.put(key(), 'filtered x1')
+
+    assert cache.get(key()) == 'filtered x1'
+    assert cache.get(key(gain=2.0)) is None
+    assert cache.get(key(filter_on=False)) is None
+
+    # Смяна на честотната лента - старият прозорец не се използва
+    viewer.band = (1.0, 40.0)
+    assert cache.get(key()) is None